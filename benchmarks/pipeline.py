@@ -0,0 +1,209 @@
+"""
+End-to-end throughput benchmark of the `from_created` -> `to_checked` pipeline.
+
+Every dataset size runs in a fresh interpreter against a local `FakeOpenAI`
+stub, so the reported peak RSS belongs to that size alone. Peak RSS is the
+process high-water mark at the end of each phase. The stub generates batch
+outputs between the upload and check phases, outside of any measurement.
+
+usage:
+
+```sh
+python -m benchmarks.pipeline --sizes 10000 100000 --output bench.json
+```
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess as sp
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from tests.fake_api import FakeOpenAI
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+
+
+@dataclass
+class PhaseResult:
+    phase: str
+    items: int
+    bytes: int
+    seconds: float
+    items_per_sec: float
+    peak_rss_mb: float
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss / (1024 * 1024 if platform.system() == "Darwin" else 1024)
+
+
+def measure[T](
+    phase: str,
+    fn: Callable[[], T],
+    items: Callable[[T], int],
+    bytes: Callable[[T], int],
+) -> tuple[T, PhaseResult]:
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+
+    count = items(result)
+    return result, PhaseResult(
+        phase=phase,
+        items=count,
+        bytes=bytes(result),
+        seconds=seconds,
+        items_per_sec=count / seconds if seconds else 0.0,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def _run(size: int, base_url: str, content_size: int) -> list[dict[str, Any]]:
+    """Run all phases for one dataset size, inside a fresh interpreter."""
+
+    os.environ["HOME"] = tempfile.mkdtemp(prefix="openai_batch_bench_")
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["OPENAI_BASE_URL"] = base_url
+
+    import httpx
+
+    from openai_batch import BatchInputItem, BatchOutputItem, OpenAIBatchRunner
+    from openai_batch.openai import openai_file
+    from openai_batch.shard import ShardArchive
+    from openai_batch.status import checked, created, utils
+
+    class BenchmarkRunner(OpenAIBatchRunner):
+        delivered = 0
+
+        @staticmethod
+        def upload() -> Iterable[BatchInputItem]:
+            padding = "x" * content_size
+            for idx in range(size):
+                yield BatchInputItem(
+                    id=str(idx),
+                    messages=[
+                        {"role": "system", "content": "You are a benchmark."},
+                        {"role": "user", "content": f"{idx} {padding}"},
+                    ],
+                )
+
+        @staticmethod
+        def download(output: Iterable[BatchOutputItem]):
+            for _ in output:
+                BenchmarkRunner.delivered += 1
+
+    config = BenchmarkRunner.work_config
+    archive = ShardArchive.of_work("benchmark", compression=config.shard_compression)
+    phases: list[PhaseResult] = []
+
+    _, phase = measure(
+        "transform",
+        lambda: created.transform(config, BenchmarkRunner.upload(), archive),
+        items=lambda _: size,
+        bytes=lambda result: sum(shard.size for shard in result.shards),
+    )
+    phases.append(phase)
+
+    upload_result, phase = measure(
+        "upload",
+        lambda: created.upload(config, archive),
+        items=lambda _: size,
+        bytes=lambda _: phases[0].bytes,
+    )
+    phases.append(phase)
+
+    httpx.post(f"{base_url}/_fake/complete").raise_for_status()
+
+    check_result, phase = measure(
+        "check",
+        lambda: checked.check(upload_result.batch_ids),
+        items=lambda _: size,
+        bytes=lambda _: 0,
+    )
+    phases.append(phase)
+
+    output_file_ids = [
+        file_id for status in check_result.statuses if (file_id := status.file_id)
+    ]
+    _, phase = measure(
+        "download",
+        lambda: utils.download(BenchmarkRunner, output_file_ids),
+        items=lambda _: BenchmarkRunner.delivered,
+        bytes=lambda _: sum(
+            openai_file.retrieve_meta(file_id).bytes for file_id in output_file_ids
+        ),
+    )
+    phases.append(phase)
+
+    return [asdict(phase) for phase in phases]
+
+
+def _commit() -> str | None:
+    try:
+        return sp.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, sp.CalledProcessError):
+        return None
+
+
+def run(sizes: Iterable[int], content_size: int = 200) -> dict[str, Any]:
+    results = []
+    with FakeOpenAI(auto_complete=False) as api:
+        for size in sizes:
+            # a fresh interpreter per size, so peak RSS is not inherited
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                phases = pool.submit(_run, size, api.base_url, content_size).result()
+
+            results.append({"size": size, "phases": phases})
+            api.reset()
+            api.auto_complete = False
+
+    return {
+        "commit": _commit(),
+        "created_at": datetime.now().isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "content_size": content_size,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--content-size", type=int, default=200)
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    report = run(args.sizes, content_size=args.content_size)
+    for result in report["results"]:
+        for phase in result["phases"]:
+            print(
+                f"{result['size']:>10} {phase['phase']:<10}"
+                f"{phase['items_per_sec']:>14.0f} items/s"
+                f"{phase['peak_rss_mb']:>10.1f} MB"
+            )
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+CPU time per GB of shards uploaded, with shards read into buffers or sent from
+a memory map, see `TransferConfig.mmap_upload`.
+
+Every mode runs in a fresh interpreter against a local `FakeOpenAI` stub served
+by this process, so the CPU time and peak RSS reported are those of the uploads
+alone, not of the stub receiving them. Shards are uncompressed, compressed ones
+are always read.
+
+usage:
+
+```sh
+python -m benchmarks.upload --size-mb 512 --repeat 3 --output upload.json
+```
+"""
+
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Iterable
+
+from benchmarks.pipeline import _commit, peak_rss_mb
+from tests.fake_api import FakeOpenAI
+
+MODES = ["read", "mmap"]
+
+G = 1_000_000_000
+
+
+@dataclass
+class UploadResult:
+    mode: str
+    bytes: int
+    seconds: float
+    cpu_seconds: float
+    cpu_seconds_per_gb: float
+    mb_per_sec: float
+    peak_rss_mb: float
+
+
+def _reset_peak_rss():
+    # Linux only, so that the peak covers the uploads alone: `ru_maxrss` keeps
+    # the peak of the process the interpreter was forked from
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return peak_rss_mb()
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run(mode: str, size: int, repeat: int, base_url: str) -> dict[str, Any]:
+    """Upload a shard of `size` bytes `repeat` times, inside a fresh interpreter."""
+
+    os.environ["HOME"] = tempfile.mkdtemp(prefix="openai_batch_bench_")
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["OPENAI_BASE_URL"] = base_url
+
+    from openai_batch.openai import openai_file, upload
+    from openai_batch.shard import ShardArchive
+
+    config = upload.global_config
+    upload.global_config = config.model_copy(
+        update={
+            "transfer": config.transfer.model_copy(
+                update={"mmap_upload": mode == "mmap"}
+            )
+        }
+    )
+
+    archive = ShardArchive.of_work("benchmark", compression="none")
+    line = json.dumps({"custom_id": "0", "body": "x" * 1000}).encode() + b"\n"
+    with archive.writer(max_size=size) as writer:
+        for _ in range(size // len(line)):
+            writer.write(line)
+    archive.commit(writer.shards, dataset_hash=None)
+    (shard,) = archive.shards
+
+    _reset_peak_rss()
+    start, cpu_start = time.perf_counter(), _cpu_seconds()
+    for _ in range(repeat):
+        with archive.open(shard) as reader:
+            openai_file.upload(reader, purpose="batch", size=shard.size)
+    seconds, cpu_seconds = time.perf_counter() - start, _cpu_seconds() - cpu_start
+
+    uploaded = shard.size * repeat
+    return asdict(
+        UploadResult(
+            mode=mode,
+            bytes=uploaded,
+            seconds=seconds,
+            cpu_seconds=cpu_seconds,
+            cpu_seconds_per_gb=cpu_seconds / (uploaded / G),
+            mb_per_sec=uploaded / 1_000_000 / seconds if seconds else 0.0,
+            peak_rss_mb=_peak_rss_mb(),
+        )
+    )
+
+
+def run(
+    size_mb: int = 512,
+    repeat: int = 3,
+    modes: Iterable[str] = MODES,
+) -> dict[str, Any]:
+    results = []
+    with FakeOpenAI() as api:
+        for mode in modes:
+            # a fresh interpreter per mode, so peak RSS is not inherited
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                future = pool.submit(
+                    _run, mode, size_mb * 1_000_000, repeat, api.base_url
+                )
+                results.append(future.result())
+            api.reset()
+
+    return {
+        "commit": _commit(),
+        "created_at": datetime.now().isoformat(),
+        "size_mb": size_mb,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    report = run(args.size_mb, repeat=args.repeat, modes=args.modes)
+    for result in report["results"]:
+        print(
+            f"{result['mode']:<6}"
+            f"{result['cpu_seconds_per_gb']:>10.3f} CPU s/GB"
+            f"{result['mb_per_sec']:>10.0f} MB/s"
+            f"{result['peak_rss_mb']:>10.1f} MB"
+        )
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
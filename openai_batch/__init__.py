@@ -1,3 +1,10 @@
 from .runner import OpenAIBatchRunner
-from .model import BatchInputItem, BatchOutputItem, BatchErrorItem
+from .client import BatchClient, WorkHandle
+from .model import (
+    BatchInputItem,
+    BatchInputTemplate,
+    BatchOutputItem,
+    BatchErrorItem,
+    EmbeddingInputItem,
+)
 from .db import schema
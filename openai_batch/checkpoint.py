@@ -0,0 +1,143 @@
+"""
+Progress of the delivery of output and error files to `Runner.download` and
+`Runner.download_error`, so that a check interrupted by a failing callback does
+not deliver the same outputs twice when the work is checked again.
+
+The number of lines of each file consumed by the callback is committed to the
+work every `WorkConfig.checkpoint_interval` lines, after `Runner.flush`. Lines
+up to the checkpoint are skipped on the next check without being parsed, and
+files delivered completely are not downloaded again.
+
+The usage of the outputs consumed is committed along with their lines, see
+`usage`, and so are the outputs exported, see `export`.
+"""
+
+import contextlib
+import threading
+from typing import Callable, Iterable, Iterator, Sequence
+
+from .db import schema, works_db
+from .model import BatchOutputItem
+from .usage import Ledger, Usage, charge
+
+
+class Checkpoint:
+    def __init__(
+        self,
+        work: schema.Work,
+        interval: int,
+        flush: Callable[[], None] | None = None,
+        ledger: Ledger | None = None,
+    ):
+        assert work.id is not None
+
+        self.work_id = work.id
+        self.interval = interval
+        self.flush = flush
+        self.ledger = ledger
+
+        self.offsets = dict(work.download_offsets)
+        self.delivered = set(work.delivered_file_ids)
+        self._lock = threading.RLock()
+        self._hooks: dict[str, list[Callable[[], None]]] = {}
+
+    def pending(self, file_ids: Sequence[str]) -> list[str]:
+        """`file_ids` not delivered completely yet"""
+
+        return [file_id for file_id in file_ids if file_id not in self.delivered]
+
+    @contextlib.contextmanager
+    def hooked(self, file_ids: Iterable[str], hook: Callable[[], None]):
+        """
+        Call `hook` whenever the items consumed of one of `file_ids` are
+        counted, from the thread consuming them, before they are committed.
+        """
+
+        file_ids = list(file_ids)
+        with self._lock:
+            for file_id in file_ids:
+                self._hooks.setdefault(file_id, []).append(hook)
+        try:
+            yield
+        finally:
+            with self._lock:
+                for file_id in file_ids:
+                    self._hooks[file_id].remove(hook)
+                    if not self._hooks[file_id]:
+                        del self._hooks[file_id]
+
+    def offset(self, file_id: str) -> int:
+        """Lines of `file_id` delivered by earlier checks"""
+
+        return self.offsets.get(file_id, 0)
+
+    def skip(self, file_id: str, lines: Iterable[str]) -> Iterator[str]:
+        """Drop the lines of `file_id` delivered by earlier checks."""
+
+        skip = self.offset(file_id)
+        for count, line in enumerate(lines):
+            if count >= skip:
+                yield line
+
+    def track[T](self, file_id: str, items: Iterable[T]) -> Iterator[T]:
+        """
+        Count the items of `file_id` consumed after the skipped lines, one per
+        line: an item is consumed once the next one is requested.
+        """
+
+        ledger = self.ledger
+        consumed = self.offset(file_id)
+        usage = Usage()
+        for item in items:
+            yield item
+
+            consumed += 1
+            if ledger is not None and isinstance(item, BatchOutputItem):
+                ledger.count(usage, item)
+            if consumed % self.interval == 0:
+                with self._lock:
+                    self.offsets[file_id] = consumed
+                    if ledger is not None:
+                        ledger.settle(file_id, usage)
+                    for hook in self._hooks.get(file_id, []):
+                        hook()
+                usage = Usage()
+                self.commit()
+
+        with self._lock:
+            self.offsets.pop(file_id, None)
+            self.delivered.add(file_id)
+            if ledger is not None:
+                ledger.settle(file_id, usage)
+            for hook in self._hooks.get(file_id, []):
+                hook()
+        self.commit()
+
+    def wrap(self, file_id: str, lines: Iterable[str]) -> Iterator[str]:
+        """Skip the delivered lines of `file_id` and count those consumed."""
+
+        return self.track(file_id, self.skip(file_id, lines))
+
+    def commit(self):
+        # downloads of outputs and errors may run in different threads
+        with self._lock:
+            if self.flush is not None:
+                self.flush()
+
+            ledger = self.ledger
+            settled = ledger.take() if ledger is not None else {}
+            with works_db.session() as session:
+                work = session.get(schema.Work, self.work_id)
+                assert work is not None
+                work.download_offsets = dict(self.offsets)
+                work.delivered_file_ids = sorted(self.delivered)
+                session.add(work)
+
+                for file_id, usage in settled.items():
+                    assert ledger is not None
+                    charge(work, usage)
+                    if (batch_id := ledger.batch_ids.get(file_id)) is None:
+                        continue
+                    if (batch := session.get(schema.Batch, batch_id)) is not None:
+                        charge(batch, usage)
+                        session.add(batch)
@@ -0,0 +1,232 @@
+"""
+Deletion of the remote input, output and error files of works.
+
+`clean_up` deletes the files of a completed work, recording every deleted file
+in `Work.deleted_file_ids` so that an interrupted clean up resumes where it
+stopped. `find_orphans` finds files left by older works, e.g. works completed
+without clean up, or inputs of batches that were never created, for `gc`.
+"""
+
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import partial
+from typing import Callable, Iterable, Sequence
+
+import openai
+from openai.types import Batch, FileObject
+
+from . import metrics
+from .config import global_config
+from .db import schema, works_db
+from .openai import pool
+from .openai.ratelimit import retrying
+from .shard import UPLOAD_NAME
+
+logger = logging.getLogger(__name__)
+
+RECORD_EVERY = 100
+"""Deleted files recorded in the database at once"""
+
+ACTIVE_BATCH = frozenset({"validating", "in_progress", "finalizing", "cancelling"})
+
+
+def _batch_files(batch: Batch) -> list[str]:
+    return [
+        file_id
+        for file_id in (batch.input_file_id, batch.output_file_id, batch.error_file_id)
+        if file_id is not None
+    ]
+
+
+def _delete(client: pool.Client, file_id: str) -> str:
+    try:
+        retrying(
+            "files.delete",
+            partial(client.files.delete, file_id),
+            bucket=client.bucket,
+        )
+    except openai.NotFoundError:
+        pass  # deleted by an earlier attempt
+
+    metrics.deleted_files.inc()
+    return file_id
+
+
+def delete_files(
+    client: pool.Client,
+    file_ids: Sequence[str],
+    on_deleted: Callable[[list[str]], None] | None = None,
+    concurrency: int | None = None,
+) -> int:
+    """
+    Delete `file_ids` of `client`, `concurrency` at once. `on_deleted` receives
+    deleted files in groups, including those deleted before a failure.
+    """
+
+    concurrency = concurrency or global_config.transfer.delete_concurrency
+    deleted: list[str] = []
+    count = 0
+
+    def flush():
+        nonlocal count
+        if deleted and on_deleted is not None:
+            on_deleted(list(deleted))
+        count += len(deleted)
+        deleted.clear()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_delete, client, file_id) for file_id in file_ids]
+        seen: set[Future] = set()
+        try:
+            for future in as_completed(futures):
+                seen.add(future)
+                deleted.append(future.result())
+                if len(deleted) >= RECORD_EVERY:
+                    flush()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            # record deletions still running, they would be retried otherwise
+            for future in wait(futures).done - seen:
+                if not future.cancelled() and future.exception() is None:
+                    deleted.append(future.result())
+            raise
+        finally:
+            flush()
+
+    return count
+
+
+def clean_up(work: schema.Work) -> int:
+    """Delete the remote files of the batches of `work`, return the number deleted."""
+
+    assert work.id is not None
+    work_id = work.id
+
+    def record(file_ids: list[str]):
+        with works_db.update_work(work_id) as work:
+            work.deleted_file_ids = [*work.deleted_file_ids, *file_ids]
+
+    owned: dict[str, list[schema.Batch]] = {}
+    for row in works_db.list_batches(work_id):
+        owned.setdefault(row.credential, []).append(row)
+
+    deleted = set(work.deleted_file_ids)
+    count = 0
+    for name, rows in owned.items():
+        client = pool.client(name)
+        file_ids = []
+        for row in rows:
+            files = [row.input_file_id, row.output_file_id, row.error_file_id]
+            # files of finished batches are known since their last check, unless
+            # recorded before the batch table, see `migrate`
+            if row.state == schema.BatchState.Undone or not row.input_file_id:
+                try:
+                    batch = retrying(
+                        "batches.retrieve",
+                        partial(client.batches.retrieve, row.id),
+                        bucket=client.bucket,
+                    )
+                    files = _batch_files(batch)
+                except openai.NotFoundError:
+                    logger.warning(f"Batch {row.id} of work {work_id} not found")
+
+            file_ids.extend(f for f in files if f and f not in deleted)
+
+        count += delete_files(client, file_ids, on_deleted=record)
+
+    logger.info(f"Deleted {count} remote files of work {work_id}")
+    return count
+
+
+@dataclass
+class Orphan:
+    client: pool.Client
+    file: FileObject
+
+
+def _list_batches(client: pool.Client) -> Iterable[Batch]:
+    page = retrying(
+        "batches.list",
+        partial(client.batches.list, limit=100),
+        bucket=client.bucket,
+    )
+    while True:
+        yield from page.data
+        if not page.has_next_page():
+            break
+        page = retrying("batches.list", page.get_next_page, bucket=client.bucket)
+
+
+def find_orphans(older_than: timedelta = timedelta(days=1)) -> list[Orphan]:
+    """
+    Files of every credential uploaded by `openai_batch`, or produced by batches
+    of such files, that no running batch nor unfinished work uses anymore.
+
+    Files younger than `older_than` are kept, they may belong to a work being
+    uploaded.
+    """
+
+    # batches of unfinished works, whatever their state on the provider
+    kept_batches = {
+        batch.id
+        for work in works_db.list_works()
+        if work.id is not None and work.status in schema.RUNNING
+        for batch in works_db.list_batches(work.id)
+    }
+    created_before = time.time() - older_than.total_seconds()
+
+    orphans: list[Orphan] = []
+    for client in pool.clients():
+        files = {
+            file.id: file
+            for purpose in ("batch", "batch_output")
+            for file in retrying(
+                "files.list",
+                partial(client.files.list, purpose=purpose),
+                bucket=client.bucket,
+            ).data
+        }
+
+        # every file of batches of uploaded shards is ours, only inputs are named
+        ours = {
+            file.id
+            for file in files.values()
+            if file.purpose == "batch" and UPLOAD_NAME.fullmatch(file.filename)
+        }
+        kept = set()
+        for batch in _list_batches(client):
+            if batch.input_file_id not in ours:
+                continue
+
+            batch_files = _batch_files(batch)
+            if batch.id in kept_batches or batch.status in ACTIVE_BATCH:
+                kept.update(batch_files)
+            else:
+                ours.update(batch_files)
+
+        orphans.extend(
+            Orphan(client=client, file=files[file_id])
+            for file_id in ours - kept
+            if file_id in files and files[file_id].created_at < created_before
+        )
+
+    return orphans
+
+
+def gc(orphans: Sequence[Orphan]) -> int:
+    """Delete `orphans`, return the number deleted."""
+
+    count = 0
+    by_client: dict[str, list[Orphan]] = {}
+    for orphan in orphans:
+        by_client.setdefault(orphan.client.name, []).append(orphan)
+
+    for group in by_client.values():
+        client = group[0].client
+        count += delete_files(client, [orphan.file.id for orphan in group])
+
+    return count
@@ -1,17 +1,21 @@
 import subprocess as sp
-import time
-from datetime import datetime
-from typing import Annotated, Iterable, Optional
+from datetime import datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from typing import Annotated, Iterable, List, Optional, Sequence
 
 import typer
 from rich.console import Console
-from rich.progress import Progress
+from rich.live import Live
+from rich.progress_bar import ProgressBar
 from rich.table import Table
 from rich.text import Text
 
 from .config import global_config
 from .const import TO_STATUS, WORK_ID
 from .db import schema, works_db
+from .progress import Board, Listener, PhaseProgress
+from .snapshot import Progress, progress, refresh_in_background, stale
 from .utils import recursive_getattr, recursive_setattr
 
 app = typer.Typer()
@@ -32,18 +36,51 @@ def _colored_status(status: schema.WorkStatus) -> Text:
             return Text(status.value)
 
 
+def _format_progress(progress: Progress | None) -> str:
+    if progress is None or (ratio := progress.ratio) is None:
+        return ""
+
+    return f"{ratio:.1%} ({progress.done}/{progress.batches} batches)"
+
+
+def _format_age(at: datetime | None) -> str:
+    if at is None:
+        return ""
+
+    return f"{_format_seconds((datetime.now() - at).total_seconds())} ago"
+
+
 def _show(works: Iterable[schema.Work]):
+    """Show works with their progress as of the last snapshot of their batches."""
+
+    works = [*works]
+    progresses = progress(works)
+
     table = Table()
     table.add_column("ID", style="cyan")
     table.add_column("name", style="magenta")
     table.add_column("Status")
+    table.add_column("Progress", justify="right")
+    table.add_column("Snapshot")
 
     for work in works:
-        table.add_row(str(work.id), work.name, _colored_status(work.status))
+        table.add_row(
+            str(work.id),
+            work.name,
+            _colored_status(work.status),
+            _format_progress(progresses.get(work.id)),  # type: ignore
+            _format_age(work.snapshot_at),
+        )
 
     console.print(table)
 
 
+def _refresh_stale(works: Iterable[schema.Work]):
+    # shown from the cache now, refreshed for the next command
+    if refresh_in_background(stale(works)):
+        console.print("Refreshing outdated snapshots in the background")
+
+
 @app.command()
 def get(id: Annotated[int, typer.Argument(help="Work ID")]):
     """Get work from ID."""
@@ -54,6 +91,10 @@ def get(id: Annotated[int, typer.Argument(help="Work ID")]):
         return
 
     _show([work])
+    _refresh_stale([work])
+    if work.outputs:
+        assert work.id is not None
+        _show_usage(work, works_db.list_batches(work.id))
 
 
 @app.command()
@@ -90,7 +131,9 @@ def list(
 
         return True
 
-    _show([work for work in works_db.list_works() if accept(work)])
+    works = [work for work in works_db.list_works() if accept(work)]
+    _show(works)
+    _refresh_stale(works)
 
 
 @app.command()
@@ -99,6 +142,11 @@ def delete(id: Annotated[int, typer.Argument(help="Work ID")]):
     if work is None:
         raise ValueError(f"Work with id: {id} not found")
 
+    # works submitted in process have no script, their client stops checking them
+    if work.config is not None:
+        _show([work])
+        return
+
     sp.run(
         [
             work.interpreter_path,
@@ -133,8 +181,261 @@ def config(
         console.print(f"{item}: {value}")
 
 
+def _format_bytes(size: int | None) -> str:
+    if size is None:
+        return ""
+
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024  # type: ignore
+
+    return f"{size:.1f} TB"
+
+
+def _show_batches(batches: Sequence[schema.Batch]):
+    table = Table()
+    table.add_column("Batch", style="cyan")
+    table.add_column("State")
+    table.add_column("Status")
+    table.add_column("Credential")
+    table.add_column("Shard")
+    table.add_column("Attempt", justify="right")
+    table.add_column("Requests", justify="right")
+    table.add_column("Failed", justify="right")
+    table.add_column("Checked at")
+
+    for batch in batches:
+        table.add_row(
+            batch.id,
+            batch.state.value,
+            batch.status,
+            batch.credential,
+            batch.shard or "",
+            str(batch.attempt),
+            "" if batch.request_total is None else str(batch.request_total),
+            "" if batch.request_failed is None else str(batch.request_failed),
+            f"{batch.checked_at:%Y-%m-%d %H:%M:%S}" if batch.checked_at else "",
+        )
+
+    console.print(table)
+
+
+def _format_cost(cost: float) -> str:
+    # without prices, costs are not estimated
+    return f"${cost:.4f}" if global_config.prices else "-"
+
+
+def _show_usage(work: schema.Work, batches: Sequence[schema.Batch]):
+    """Show usage of the outputs delivered, by batch and in total."""
+
+    table = Table(title="Usage")
+    table.add_column("Batch", style="cyan")
+    table.add_column("Outputs", justify="right")
+    table.add_column("Prompt tokens", justify="right")
+    table.add_column("Completion tokens", justify="right")
+    table.add_column("Cost", justify="right")
+
+    rows: list[schema.Work | schema.Batch] = [
+        *(batch for batch in batches if batch.outputs),
+        work,
+    ]
+    for row in rows:
+        table.add_row(
+            row.id if isinstance(row, schema.Batch) else "total",
+            str(row.outputs),
+            str(row.prompt_tokens),
+            str(row.completion_tokens),
+            _format_cost(row.cost),
+            end_section=isinstance(row, schema.Batch) and row is rows[-2],
+        )
+
+    console.print(table)
+
+
+def _show_timings(spans: Sequence[schema.Span], width: int = 40):
+    """Show spans as a waterfall, children indented below their parents."""
+
+    spans = [span for span in spans if span.ended_at is not None]
+    if not spans:
+        console.print("No timings recorded")
+        return
+
+    origin = min(span.started_at for span in spans)
+    total = max(
+        (span.ended_at - origin).total_seconds()  # type: ignore
+        for span in spans
+    )
+    total = total or 1.0
+
+    children: dict[int | None, list[schema.Span]] = {}
+    ids = {span.id for span in spans}
+    for span in spans:
+        parent = span.parent_id if span.parent_id in ids else None
+        children.setdefault(parent, []).append(span)
+
+    table = Table()
+    table.add_column("Span", style="cyan")
+    table.add_column("Start", justify="right")
+    table.add_column("Duration", justify="right")
+    table.add_column("Items", justify="right")
+    table.add_column("Bytes", justify="right")
+    table.add_column("Waterfall")
+
+    def add_rows(parent: int | None, depth: int):
+        for span in sorted(children.get(parent, []), key=lambda s: s.started_at):
+            assert span.ended_at is not None
+            start = (span.started_at - origin).total_seconds()
+            duration = (span.ended_at - span.started_at).total_seconds()
+
+            offset = int(start / total * width)
+            length = max(1, round(duration / total * width))
+            bar = Text(" " * offset)
+            bar.append(
+                "█" * min(length, width - offset),
+                style="red" if span.error else "green",
+            )
+
+            table.add_row(
+                "  " * depth + span.name,
+                f"{start:.2f}s",
+                f"{duration:.2f}s",
+                str(span.items) if span.items is not None else "",
+                _format_bytes(span.bytes),
+                bar,
+            )
+            add_rows(span.id, depth + 1)
+
+    add_rows(None, 0)
+    console.print(table)
+
+
+def _format_rate(progress: PhaseProgress) -> str:
+    if progress.unit == "B":
+        return f"{_format_bytes(int(progress.rate))}/s"
+
+    return f"{progress.rate:.0f} {progress.unit}/s"
+
+
+def _format_eta(seconds: float | None) -> str:
+    if seconds is None:
+        return ""
+
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return (
+        f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+    )
+
+
+def _render_board(board: Board) -> Table:
+    table = Table()
+    table.add_column("ID", style="cyan")
+    table.add_column("name", style="magenta")
+    table.add_column("Status")
+    table.add_column("Phase")
+    table.add_column("Progress")
+    table.add_column("Done", justify="right")
+    table.add_column("Throughput", justify="right")
+    table.add_column("ETA", justify="right")
+
+    for work in sorted(board.works.values(), key=lambda work: work.work_id):
+        status = _colored_status(schema.WorkStatus(work.status)) if work.status else ""
+        if not work.processes:
+            table.add_row(str(work.work_id), work.name, status, Text("idle", "dim"))
+            continue
+
+        for pid, process in sorted(work.processes.items()):
+            done = (
+                _format_bytes(process.current)
+                if process.unit == "B"
+                else f"{process.current} {process.unit}"
+            )
+            table.add_row(
+                str(work.work_id),
+                work.name,
+                status,
+                f"{process.phase} [dim]({pid})[/dim]",
+                ProgressBar(
+                    total=process.total,
+                    completed=process.current,
+                    width=30,
+                    pulse=process.total is None,
+                ),
+                done,
+                _format_rate(process),
+                _format_eta(process.eta),
+            )
+
+    return table
+
+
+def _watch(ids: Sequence[int] | None = None, refresh: float = 0.25):
+    """
+    Show progress pushed by the processes of active works, or only of works `ids`.
+    The database is only read to name works, never polled.
+    """
+
+    board = Board()
+
+    def add_work(work: schema.Work):
+        assert work.id is not None
+        board.add_work(work.id, work.name, work.status.value)
+
+    if ids:
+        for id in ids:
+            if (work := works_db.get_work(id)) is None:
+                raise ValueError(f"Work with id: {id} not found")
+            add_work(work)
+    else:
+        for work in works_db.list_works():
+            if work.status in schema.RUNNING:
+                add_work(work)
+
+    with Listener() as listener, Live(_render_board(board)) as live:
+        while True:
+            events = listener.receive(timeout=refresh)
+            if ids:
+                events = [event for event in events if event["work_id"] in ids]
+
+            for event in events:
+                if event["work_id"] not in board.works:
+                    if work := works_db.get_work(event["work_id"]):
+                        add_work(work)
+
+            board.update(events)
+            live.update(_render_board(board))
+
+
 @app.command()
-def inspect(id: Annotated[int, typer.Argument(help="Work ID")]):
+def watch(
+    ids: Annotated[
+        Optional[List[int]],  # `list` is shadowed by the command
+        typer.Argument(help="Work IDs, all active works if not given"),
+    ] = None,
+):
+    """
+    Live progress, throughput and ETA of running works, until interrupted.
+    """
+
+    try:
+        _watch(ids)
+    except KeyboardInterrupt:
+        pass
+
+
+@app.command()
+def inspect(
+    id: Annotated[int, typer.Argument(help="Work ID")],
+    timings: Annotated[
+        bool,
+        typer.Option("--timings", help="Show where the time of the work went"),
+    ] = False,
+    batches: Annotated[
+        bool,
+        typer.Option("--batches", help="Show the batches of the work"),
+    ] = False,
+):
     """
     Inspect current running processes of a work.
     """
@@ -143,21 +444,181 @@ def inspect(id: Annotated[int, typer.Argument(help="Work ID")]):
     if work is None:
         raise ValueError(f"Work with id: {id} not found")
 
-    with Progress() as progress:
-        task_ids = [
-            progress.add_task(
-                process.description,
-                total=process.total,
-            )
-            for process in work.processes
-        ]
-        pids = [process.pid for process in work.processes]
-
-        while not progress.finished:
-            with works_db.session() as session:
-                for pid, task_id in zip(pids, task_ids):
-                    process = session.get(schema.ProcessStatus, pid)
-                    assert process is not None
-                    progress.update(task_id, completed=process.current)
-
-            time.sleep(1)
+    if timings:
+        _show_timings(works_db.list_spans(id))
+        return
+
+    if batches:
+        _show_batches(works_db.list_batches(id))
+        return
+
+    try:
+        _watch([id])
+    except KeyboardInterrupt:
+        pass
+
+
+class ExportFormat(str, Enum):
+    Parquet = "parquet"
+
+
+@app.command()
+def export(
+    id: Annotated[int, typer.Argument(help="Work ID")],
+    output: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--output", "-o", help="Output file, `<work id>.parquet` by default"
+        ),
+    ] = None,
+    format: Annotated[
+        ExportFormat,
+        typer.Option("--format", "-f", help="Output format"),
+    ] = ExportFormat.Parquet,
+    row_group_size: Annotated[
+        int,
+        typer.Option(help="Outputs per row group, bounds the memory used"),
+    ] = 100_000,
+):
+    """
+    Export outputs of the completed batches of a work, downloading them again.
+    """
+
+    # imported here, the OpenAI client is only needed by this command
+    from .status.utils import export_work
+
+    work = works_db.get_work(id)
+    if work is None:
+        raise ValueError(f"Work with id: {id} not found")
+
+    path = output or Path(f"{id}.{format.value}")
+    rows = export_work(work, path, row_group_size)
+    console.print(f"Exported {rows} outputs to {path}")
+
+
+@app.command()
+def gc(
+    older_than: Annotated[
+        float,
+        typer.Option(help="Only delete files older than this many hours"),
+    ] = 24,
+    dry_run: Annotated[
+        bool,
+        typer.Option("--dry-run", help="Only show the files that would be deleted"),
+    ] = False,
+    yes: Annotated[
+        bool,
+        typer.Option("--yes", "-y", help="Delete without confirmation"),
+    ] = False,
+):
+    """
+    Delete remote files of batches uploaded by openai-batch that no unfinished
+    work or running batch uses anymore, across every credential.
+    """
+
+    # imported here, the OpenAI client is only needed by this command
+    from .cleanup import find_orphans
+    from .cleanup import gc as delete_orphans
+
+    orphans = find_orphans(older_than=timedelta(hours=older_than))
+
+    table = Table()
+    table.add_column("Credential", style="cyan")
+    table.add_column("File")
+    table.add_column("Name")
+    table.add_column("Size", justify="right")
+    for orphan in orphans:
+        table.add_row(
+            orphan.client.name,
+            orphan.file.id,
+            orphan.file.filename,
+            _format_bytes(orphan.file.bytes),
+        )
+    console.print(table)
+
+    if not orphans or dry_run:
+        return
+
+    if not yes and not typer.confirm(f"Delete {len(orphans)} files?"):
+        return
+
+    console.print(f"Deleted {delete_orphans(orphans)} files")
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds != seconds:  # no batch detected
+        return "-"
+
+    return str(timedelta(seconds=round(seconds)))
+
+
+@app.command()
+def simulate(
+    intervals: Annotated[
+        Optional[List[float]],
+        typer.Option(
+            "--interval",
+            help="Check intervals of cron policies, in hours",
+            show_default="4",
+        ),
+    ] = None,
+    backoff: Annotated[
+        bool,
+        typer.Option(help="Also simulate in process checks with exponential backoff"),
+    ] = True,
+    works: Annotated[
+        int,
+        typer.Option(help="Synthetic works, submitted over a day"),
+    ] = 100,
+    batches: Annotated[
+        int,
+        typer.Option(help="Batches of each synthetic work"),
+    ] = 4,
+    recorded: Annotated[
+        Optional[List[int]],
+        typer.Option("--recorded", help="Replay the batches of this work instead"),
+    ] = None,
+    seed: Annotated[int, typer.Option(help="Seed of synthetic works")] = 0,
+):
+    """
+    Compare polling policies on synthetic or recorded batch timelines, checking
+    simulated works with a virtual clock and a simulated API.
+    """
+
+    # imported here, the OpenAI client is only needed by this command
+    from . import simulate as sim
+
+    if recorded:
+        timelines = [sim.recorded(id) for id in recorded]
+    else:
+        timelines = sim.synthetic(works, batches=batches, seed=seed)
+
+    policies: List[sim.Policy] = [
+        sim.Cron(timedelta(hours=interval)) for interval in intervals or [4]
+    ]
+    if backoff:
+        policies.append(sim.Backoff())
+
+    table = Table()
+    table.add_column("Policy", style="cyan")
+    table.add_column("Checks", justify="right")
+    table.add_column("Launches", justify="right")
+    table.add_column("API calls", justify="right")
+    table.add_column("Latency p50", justify="right")
+    table.add_column("p95", justify="right")
+    table.add_column("max", justify="right")
+    table.add_column("Undetected", justify="right")
+    for policy in policies:
+        report = sim.simulate(timelines, policy)
+        table.add_row(
+            str(policy),
+            str(report.checks),
+            str(report.launches),
+            str(sum(report.api_calls.values())),
+            _format_seconds(report.latency(0.5)),
+            _format_seconds(report.latency(0.95)),
+            _format_seconds(report.latency(1)),
+            str(report.undetected),
+        )
+
+    console.print(table)
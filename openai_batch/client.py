@@ -0,0 +1,347 @@
+"""
+In-process submission of works, for services creating batches on demand
+instead of runner scripts checked by scheduled tasks.
+
+```python
+client = BatchClient()
+handle = await client.asubmit(items, WorkConfig(name="summaries"))
+
+await handle.wait()
+for output in handle.results():
+    ...
+```
+
+Works of a client share the OpenAI clients and the database of the process.
+While awaited, they are checked by one polling task of the client, every
+`WorkConfig.check_interval`, in the threads of the default executor of the
+event loop, which also uploads the works submitted by `asubmit`. Their outputs
+and errors are appended to local files as they are delivered, and read back by
+`WorkHandle.results` and `WorkHandle.errors`.
+"""
+
+import asyncio
+import contextlib
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import IO, Iterable, Iterator, Literal
+
+from pydantic import BaseModel
+
+from . import metrics, progress
+from .config import global_config
+from .db import schema, works_db
+from .exception import OpenAIBatchException
+from .model import (
+    BatchErrorItem,
+    BatchInputItem,
+    BatchOutputItem,
+    EmbeddingInputItem,
+    TemplateInputItem,
+    WorkConfig,
+)
+from .runner import OpenAIBatchRunner
+from .status.status import to_status
+
+type InputItem = BatchInputItem | EmbeddingInputItem | TemplateInputItem
+
+
+def results_path(work_id: int, kind: Literal["outputs", "errors"]) -> Path:
+    """Local file of the outputs or errors delivered for work `work_id`"""
+
+    return Path(global_config.save_path) / "results" / f"{work_id}.{kind}.jsonl"
+
+
+class _ResultWriter:
+    """Items appended to the result files of a work, made durable by `flush`."""
+
+    def __init__(self, work_id: int):
+        self.work_id = work_id
+        self._open: set[IO[str]] = set()
+        self._lock = threading.Lock()
+
+    def write(self, kind: Literal["outputs", "errors"], items: Iterable[BaseModel]):
+        path = results_path(self.work_id, kind)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with path.open("a") as f:
+            with self._lock:
+                self._open.add(f)
+            try:
+                for item in items:
+                    f.write(item.model_dump_json() + "\n")
+            finally:
+                with self._lock:
+                    self._open.discard(f)
+
+    def flush(self):
+        # outputs and errors may be delivered by different threads
+        with self._lock:
+            for f in self._open:
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _runner(
+    work_id: int,
+    config: WorkConfig,
+    items: Iterable[InputItem] = (),
+) -> type[OpenAIBatchRunner]:
+    writer = _ResultWriter(work_id)
+
+    class InProcessRunner(OpenAIBatchRunner):
+        work_config = config
+
+        @staticmethod
+        def upload() -> Iterable[InputItem]:
+            return items
+
+        @staticmethod
+        def download(output: Iterable[BatchOutputItem]):
+            writer.write("outputs", output)
+
+        @staticmethod
+        def download_error(output: Iterable[BatchErrorItem]):
+            writer.write("errors", output)
+
+        @staticmethod
+        def flush():
+            writer.flush()
+
+    return InProcessRunner
+
+
+def _read[T: (BatchOutputItem, BatchErrorItem)](
+    path: Path, model: type[T]
+) -> Iterator[T]:
+    if not path.exists():
+        return
+
+    # items delivered again after an interrupted check are skipped
+    seen: set[str] = set()
+    with path.open() as f:
+        for line in f:
+            item = model.model_validate_json(line)
+            if item.id not in seen:
+                seen.add(item.id)
+                yield item
+
+
+class WorkHandle:
+    """A work submitted in process, see `BatchClient.submit`."""
+
+    def __init__(self, client: "BatchClient", work_id: int):
+        self.client = client
+        self.id = work_id
+
+    def __repr__(self) -> str:
+        return f"WorkHandle(id={self.id})"
+
+    def status(self) -> schema.WorkStatus:
+        """Status of the work as of its last check"""
+
+        return self.client._get(self.id).status
+
+    def check(self) -> schema.WorkStatus:
+        """Check the work now, delivering the outputs of finished batches."""
+
+        return self.client._check(self.id)
+
+    async def wait(self) -> schema.WorkStatus:
+        """Wait for the work to be completed, failed or canceled."""
+
+        return await self.client._wait(self.id)
+
+    def results(self) -> Iterator[BatchOutputItem]:
+        """Outputs delivered so far, all of them once the work is completed."""
+
+        return _read(results_path(self.id, "outputs"), BatchOutputItem)
+
+    def errors(self) -> Iterator[BatchErrorItem]:
+        """Errors of the failed batches delivered so far."""
+
+        return _read(results_path(self.id, "errors"), BatchErrorItem)
+
+
+class BatchClient:
+    """
+    Submit works and wait for them in process, without scripts nor scheduled
+    tasks. Handles of works submitted by an earlier process are returned by
+    `handle`.
+    """
+
+    def __init__(self):
+        self._runners: dict[int, type[OpenAIBatchRunner]] = {}
+        self._locks: dict[int, threading.Lock] = {}
+        # waiters of each awaited work, and when it is checked next
+        self._waiters: dict[int, list[asyncio.Future[schema.WorkStatus]]] = {}
+        self._due: dict[int, float] = {}
+        self._wakeup: asyncio.Event | None = None
+        self._poller: asyncio.Task | None = None
+
+    def submit(
+        self,
+        items: Iterable[InputItem],
+        config: WorkConfig | None = None,
+    ) -> WorkHandle:
+        """
+        Create a work of `items`, upload them and submit its batches, or
+        execute them with the direct backend, then check it once.
+        """
+
+        if config is None:
+            config = WorkConfig()
+
+        work = works_db.create_work(
+            schema.Work(
+                name=config.name,
+                status=schema.WorkStatus.Created,
+                interpreter_path=sys.executable,
+                work_dir=os.getcwd(),
+                class_name="",
+                script="",
+                config=config.model_dump(mode="json"),
+            )
+        )
+        assert work.id is not None
+
+        cls = self._runners[work.id] = _runner(work.id, config, items)
+        with self._checking(work.id):
+            work = to_status(work, schema.WorkStatus.Checked, cls)
+            assert work.id is not None
+            self._checked(work, config)
+
+        if work.status not in schema.RUNNING:
+            self._forget(work.id)
+
+        return WorkHandle(self, work.id)
+
+    async def asubmit(
+        self,
+        items: Iterable[InputItem],
+        config: WorkConfig | None = None,
+    ) -> WorkHandle:
+        """`submit` in a thread of the default executor, items are read there."""
+
+        return await asyncio.to_thread(self.submit, items, config)
+
+    def handle(self, work_id: int) -> WorkHandle:
+        """Handle of a work submitted in process, by this client or another."""
+
+        if self._get(work_id).config is None:
+            raise OpenAIBatchException(
+                f"Work {work_id} is checked by its script, not submitted in process"
+            )
+
+        return WorkHandle(self, work_id)
+
+    def _get(self, work_id: int) -> schema.Work:
+        work = works_db.get_work(work_id)
+        if work is None:
+            raise OpenAIBatchException(f"Work {work_id} not found")
+
+        return work
+
+    @contextlib.contextmanager
+    def _checking(self, work_id: int):
+        # a work is checked by one thread at a time, with its metrics and
+        # progress exported as in checks of runner scripts
+        with (
+            self._locks.setdefault(work_id, threading.Lock()),
+            metrics.exporting(work_id),
+            progress.reporting(work_id),
+        ):
+            yield
+
+    def _check(self, work_id: int) -> schema.WorkStatus:
+        with self._checking(work_id):
+            work = self._get(work_id)
+            if work.status in schema.RUNNING:
+                assert work.config is not None
+                config = WorkConfig.model_validate(work.config)
+                if (cls := self._runners.get(work_id)) is None:
+                    cls = self._runners[work_id] = _runner(work_id, config)
+
+                work = to_status(work, schema.WorkStatus.Checked, cls)
+                self._checked(work, config)
+
+        # the lock is dropped once released, stopped works are only read again
+        if work.status not in schema.RUNNING:
+            self._forget(work_id)
+
+        return work.status
+
+    def _checked(self, work: schema.Work, config: WorkConfig):
+        assert work.id is not None
+        if work.status in schema.RUNNING:
+            self._due[work.id] = (
+                time.monotonic() + config.check_interval.total_seconds()
+            )
+
+    def _forget(self, work_id: int):
+        # stopped works are not checked again
+        self._due.pop(work_id, None)
+        self._runners.pop(work_id, None)
+        self._locks.pop(work_id, None)
+
+    async def _wait(self, work_id: int) -> schema.WorkStatus:
+        if (status := self._get(work_id).status) not in schema.RUNNING:
+            return status
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(work_id, []).append(future)
+
+        if self._poller is None or self._poller.done():
+            self._wakeup = asyncio.Event()
+            self._poller = asyncio.create_task(self._poll())
+        else:
+            assert self._wakeup is not None
+            self._wakeup.set()
+
+        return await future
+
+    async def _poll(self):
+        assert self._wakeup is not None
+        wakeup = self._wakeup
+
+        while True:
+            # waiters cancelled by their caller don't keep works checked
+            for work_id, futures in list(self._waiters.items()):
+                if not (futures := [f for f in futures if not f.done()]):
+                    del self._waiters[work_id]
+                else:
+                    self._waiters[work_id] = futures
+            if not self._waiters:
+                return
+
+            now = time.monotonic()
+            due = [id for id in self._waiters if self._due.get(id, now) <= now]
+            results = await asyncio.gather(
+                *(asyncio.to_thread(self._check, id) for id in due),
+                return_exceptions=True,
+            )
+            for work_id, result in zip(due, results, strict=True):
+                if not isinstance(result, BaseException) and result in schema.RUNNING:
+                    continue
+
+                for future in self._waiters.pop(work_id, []):
+                    if future.done():
+                        continue
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+            if not self._waiters:
+                return
+
+            # sleep until the next work is due, or a new one is awaited
+            now = time.monotonic()
+            timeout = min(self._due.get(id, now) for id in self._waiters) - now
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), max(timeout, 0))
+            except TimeoutError:
+                pass
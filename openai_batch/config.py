@@ -5,7 +5,7 @@ from pathlib import Path
 from typing import Final
 
 import toml
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 match platform.system():
     case "Windows":
@@ -23,6 +23,76 @@ match platform.system():
 config_path: Final = config_dir / "config.toml"
 
 
+class RateLimitConfig(BaseModel):
+    """
+    Args:
+        requests_per_second (float, optional): Files and Batches API calls per second, shared by all works. Defaults to 10.
+        burst (int, optional): Calls allowed at once after being idle. Defaults to 20.
+        max_retries (int, optional): Retries of a rate limited or failed call. Defaults to 5.
+        backoff_base (float, optional): Seconds of the first backoff, doubled for each retry. Defaults to 1.
+        backoff_max (float, optional): Maximum seconds of a backoff. Defaults to 60.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    requests_per_second: float = Field(default=10, gt=0)
+    burst: int = Field(default=20, ge=1)
+    max_retries: int = Field(default=5, ge=0)
+    backoff_base: float = Field(default=1, ge=0)
+    backoff_max: float = Field(default=60, ge=0)
+
+
+class TransferConfig(BaseModel):
+    """
+    Args:
+        http2 (bool, optional): Use HTTP/2 if `h2` is installed. Defaults to True.
+        max_connections (int, optional): Connections kept open to the API. Defaults to 10.
+        timeout (float, optional): Seconds to wait for a file transfer to make progress. Defaults to 600.
+        upload_chunk_size (int, optional): Bytes read from a file per upload write. Defaults to 1 MiB.
+        mmap_upload (bool, optional): Send regular files, such as uncompressed shards, from a memory map instead of reading them. Defaults to True.
+        download_chunk_size (int, optional): Bytes read from the network per download read. Defaults to 1 MiB.
+        delete_concurrency (int, optional): Remote files deleted at once by clean up and gc. Defaults to 8.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    http2: bool = True
+    max_connections: int = Field(default=10, ge=1)
+    timeout: float = Field(default=600, gt=0)
+    upload_chunk_size: int = Field(default=1024 * 1024, ge=1)
+    mmap_upload: bool = True
+    download_chunk_size: int = Field(default=1024 * 1024, ge=1)
+    delete_concurrency: int = Field(default=8, ge=1)
+
+
+class CredentialConfig(BaseModel):
+    """
+    Args:
+        api_key (str, optional): API key. Defaults to the `OPENAI_API_KEY` environment variable.
+        base_url (str, optional): Base URL of the API. Defaults to the OpenAI client's base URL.
+        organization (str, optional): Organization of the requests. Defaults to the key's default organization.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    api_key: str | None = None
+    base_url: str | None = None
+    organization: str | None = None
+
+
+class PriceConfig(BaseModel):
+    """
+    Args:
+        input (float): Dollars per million prompt tokens.
+        output (float, optional): Dollars per million completion tokens. Defaults to 0.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    input: float = Field(ge=0)
+    output: float = Field(default=0, ge=0)
+
+
 class OpenAIBatchConfig(BaseModel):
     model_config = ConfigDict(
         frozen=True,
@@ -30,6 +100,18 @@ class OpenAIBatchConfig(BaseModel):
     )
 
     save_path: str = str(Path.home() / ".openai_batch")
+    max_open_shards: int = 4
+    metrics_port: int | None = None
+    metrics_textfile_dir: str | None = None
+    rate_limit: RateLimitConfig = RateLimitConfig()
+    transfer: TransferConfig = TransferConfig()
+    # named credentials shards of works are spread over, see `WorkConfig.credentials`
+    credentials: dict[str, CredentialConfig] = {}
+    # Batch API prices of models for cost estimates, by model name or its prefix
+    prices: dict[str, PriceConfig] = {}
+    # seconds before `list` and `get` refresh the cached batches of running works
+    # in the background, never when 0, see `snapshot`
+    snapshot_ttl: int = Field(default=300, ge=0)
 
     @property
     def db_path(self) -> Path:
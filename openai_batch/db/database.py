@@ -1,15 +1,170 @@
 import contextlib
+import json
 import os
+import shutil
+from datetime import datetime
 from pathlib import Path
-from typing import Final, Iterable
+from typing import Callable, Final, Iterable, Sequence
+from uuid import uuid4
 
-from sqlmodel import Session, SQLModel, create_engine, select
+from sqlalchemy import Connection, insert
+from sqlmodel import Session, SQLModel, case, create_engine, func, select
 
 from ..config import global_config
-from ..openai.upload import StreamChunk
+from ..shard import ShardArchive
 from . import schema
 
 
+def _columns(conn: Connection, table: str) -> set[str]:
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def _add_columns(conn: Connection, table: str, columns: dict[str, str]):
+    """Add the `columns` missing from `table`, by name and SQL definition."""
+
+    existing = _columns(conn, table)
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _to_batch_table(conn: Connection):
+    """
+    Columns added to works and batches since the first version, and batches
+    moved from the id lists of works to the batch table.
+    """
+
+    _add_columns(
+        conn,
+        "work",
+        {
+            "config": "JSON",
+            "pending_shards": "JSON DEFAULT '[]'",
+            "deleted_file_ids": "JSON DEFAULT '[]'",
+            "download_offsets": "JSON DEFAULT '{}'",
+            "delivered_file_ids": "JSON DEFAULT '[]'",
+            "snapshot_at": "DATETIME",
+            "outputs": "INTEGER NOT NULL DEFAULT 0",
+            "prompt_tokens": "INTEGER NOT NULL DEFAULT 0",
+            "completion_tokens": "INTEGER NOT NULL DEFAULT 0",
+            "cost": "FLOAT NOT NULL DEFAULT 0",
+        },
+    )
+    _add_columns(
+        conn,
+        "batch",
+        {
+            "outputs": "INTEGER NOT NULL DEFAULT 0",
+            "prompt_tokens": "INTEGER NOT NULL DEFAULT 0",
+            "completion_tokens": "INTEGER NOT NULL DEFAULT 0",
+            "cost": "FLOAT NOT NULL DEFAULT 0",
+            "in_progress_at": "DATETIME",
+            "finalizing_at": "DATETIME",
+        },
+    )
+
+    columns = _columns(conn, "work")
+    if "undone_batch_ids" not in columns:
+        return
+
+    # credentials and shards of batches were kept along the ids for a while
+    maps = [name for name in ("batch_credentials", "batch_shards") if name in columns]
+    rows = conn.exec_driver_sql(
+        "SELECT id, created_at, undone_batch_ids, done_batch_ids"
+        + "".join(f", {name}" for name in maps)
+        + " FROM work"
+    ).all()
+    existing = {row[0] for row in conn.exec_driver_sql("SELECT id FROM batch")}
+
+    batches = []
+    for work_id, created_at, undone, done, *values in rows:
+        found = dict(
+            zip(maps, (json.loads(value or "{}") for value in values), strict=True)
+        )
+        states = {
+            **{id: schema.BatchState.Done for id in json.loads(done or "[]")},
+            **{id: schema.BatchState.Undone for id in json.loads(undone or "[]")},
+        }
+        for batch_id, state in states.items():
+            if batch_id in existing:
+                continue
+            batches.append(
+                {
+                    "id": batch_id,
+                    "work_id": work_id,
+                    "state": state,
+                    "credential": found.get("batch_credentials", {}).get(
+                        batch_id, "default"
+                    ),
+                    "shard": found.get("batch_shards", {}).get(batch_id),
+                    "attempt": 1,
+                    # unknown until the batch is checked or retrieved again
+                    "status": "unknown",
+                    "input_file_id": "",
+                    "created_at": datetime.fromisoformat(created_at),
+                }
+            )
+
+    if batches:
+        conn.execute(insert(schema.Batch.__table__), batches)  # type: ignore
+    conn.exec_driver_sql(
+        "UPDATE work SET undone_batch_ids = '[]', done_batch_ids = '[]'"
+    )
+
+
+def _to_work_uuid(conn: Connection):
+    """
+    Shards of works moved from directories named by the id of their work to
+    ones named by its uuid, the shards of stopped works removed.
+    """
+
+    _add_columns(conn, "work", {"uuid": "VARCHAR"})
+
+    shards = Path(global_config.save_path) / "shards"
+    rows = conn.exec_driver_sql("SELECT id, status FROM work WHERE uuid IS NULL")
+    for work_id, status in rows.all():
+        work = uuid4().hex
+        conn.exec_driver_sql("UPDATE work SET uuid = ? WHERE id = ?", (work, work_id))
+
+        root = shards / str(work_id)
+        if not root.is_dir():
+            continue
+        if schema.WorkStatus[status] not in schema.RUNNING:
+            shutil.rmtree(root, ignore_errors=True)
+            continue
+
+        archive = ShardArchive(root)
+        if archive.load():
+            archive.root = shards / work
+            root.rename(archive.root)
+            archive.work = work
+            archive.commit(archive.shards, archive.dataset_hash)
+
+    # left by works deleted before
+    for root in shards.glob("[0-9]*"):
+        if root.name.isdigit():
+            shutil.rmtree(root, ignore_errors=True)
+
+
+MIGRATIONS: list[Callable[[Connection], None]] = [_to_batch_table, _to_work_uuid]
+"""
+Steps from each version of the database to the next one, the version being
+stored in `PRAGMA user_version`. Tables added by a version are created by
+`create_all`, steps add columns to existing tables and move data.
+"""
+
+
+def migrate(engine):
+    """Bring a database written by an earlier version to the current schema."""
+
+    with engine.begin() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+        for step in MIGRATIONS[version:]:
+            step(conn)
+        if version < len(MIGRATIONS):
+            conn.exec_driver_sql(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+
 class OpenAIBatchDatabase:
     """
     A sqlite database for storing OpenAI Batch works.
@@ -21,10 +176,12 @@ class OpenAIBatchDatabase:
 
         self.engine = create_engine(f"sqlite:///{database}")
         SQLModel.metadata.create_all(self.engine)
+        migrate(self.engine)
 
     @contextlib.contextmanager
     def session(self):
-        with Session(self.engine) as session:
+        # keep attributes loaded after commit, works are used after the session closes
+        with Session(self.engine, expire_on_commit=False) as session:
             try:
                 yield session
             finally:
@@ -33,6 +190,7 @@ class OpenAIBatchDatabase:
     def create_work(self, work: schema.Work) -> schema.Work:
         with self.session() as session:
             session.add(work)
+            session.flush()
             # Automatic attribute refresh must be bound to session
             session.refresh(work)
 
@@ -65,6 +223,10 @@ class OpenAIBatchDatabase:
             if work:
                 session.delete(work)
 
+        if work:
+            # a later work may get the same id, not the same shards
+            ShardArchive.of_work(work.uuid).remove()
+
         return work
 
     @contextlib.contextmanager
@@ -89,35 +251,94 @@ class OpenAIBatchDatabase:
 
         return work
 
-    def update_process_status(
+    def add_batches(self, batches: Iterable[schema.Batch]):
+        with self.session() as session:
+            session.add_all(batches)
+
+    def list_batches(
         self,
-        pid: int,
-        description: str,
-        status: "StreamChunk | None",
-    ):
+        work_id: int,
+        states: set[schema.BatchState] | None = None,
+    ) -> Sequence[schema.Batch]:
         with self.session() as session:
-            process = session.get(schema.ProcessStatus, pid)
-
-            match (status, process):
-                # update existing process status
-                case (StreamChunk() as status, schema.ProcessStatus() as process):
-                    process.current = status.current
-                    process.total = status.total
-                    session.add(process)
-                # delete process status
-                case (None, schema.ProcessStatus() as process):
-                    session.delete(process)
-                # create new process status
-                case (StreamChunk() as status, None):
-                    process = schema.ProcessStatus(
-                        pid=pid,
-                        current=status.current,
-                        total=status.total,
-                        description=description,
-                    )
-                    session.add(process)
-                case _:
-                    pass
+            statement = (
+                select(schema.Batch)
+                .where(schema.Batch.work_id == work_id)
+                .order_by(schema.Batch.created_at, schema.Batch.id)  # type: ignore
+            )
+
+            if states:
+                statement = statement.where(schema.Batch.state.in_(states))  # type: ignore
+
+            batches = session.exec(statement).all()
+
+        return batches
+
+    def count_batches(self, work_id: int, state: schema.BatchState) -> int:
+        with self.session() as session:
+            statement = (
+                select(func.count())
+                .select_from(schema.Batch)
+                .where(schema.Batch.work_id == work_id, schema.Batch.state == state)
+            )
+            count = session.exec(statement).one()
+
+        return count
+
+    def batch_progress(
+        self,
+        work_ids: Iterable[int],
+    ) -> dict[int, tuple[int, int, int, int]]:
+        """
+        Batches, batches done, requests and requests processed of each work, as
+        of the last snapshot of its batches. Requeued batches are not counted.
+        """
+
+        Batch = schema.Batch
+        processed = func.coalesce(Batch.request_completed, 0) + func.coalesce(
+            Batch.request_failed, 0
+        )
+        with self.session() as session:
+            statement = (
+                select(
+                    Batch.work_id,
+                    func.count(),
+                    func.sum(case((Batch.state == schema.BatchState.Done, 1), else_=0)),
+                    func.coalesce(func.sum(Batch.request_total), 0),
+                    func.sum(processed),
+                )
+                .where(
+                    Batch.work_id.in_(work_ids),  # type: ignore
+                    Batch.state != schema.BatchState.Requeued,
+                )
+                .group_by(Batch.work_id)  # type: ignore
+            )
+            rows = session.exec(statement).all()
+
+        return {work_id: tuple(counts) for work_id, *counts in rows}  # type: ignore
+
+    def create_span(self, span: schema.Span) -> schema.Span:
+        with self.session() as session:
+            session.add(span)
+            session.flush()
+            session.refresh(span)
+
+        return span
+
+    def update_span(self, span: schema.Span):
+        with self.session() as session:
+            session.add(span)
+
+    def list_spans(self, work_id: int) -> Sequence[schema.Span]:
+        with self.session() as session:
+            statement = (
+                select(schema.Span)
+                .where(schema.Span.work_id == work_id)
+                .order_by(schema.Span.started_at, schema.Span.id)  # type: ignore
+            )
+            spans = session.exec(statement).all()
+
+        return spans
 
 
 try:
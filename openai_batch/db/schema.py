@@ -1,7 +1,8 @@
 from datetime import datetime
 from enum import Enum
+from uuid import uuid4
 
-from sqlmodel import JSON, Column, Field, Relationship, SQLModel
+from sqlmodel import JSON, Column, Field, Index, Relationship, SQLModel
 
 
 class WorkStatus(Enum):
@@ -12,6 +13,10 @@ class WorkStatus(Enum):
     Canceled = "canceled"
 
 
+# works still checked, whose batches may change, the others are done
+RUNNING = (WorkStatus.Created, WorkStatus.Checked)
+
+
 class Work(SQLModel, table=True):
     # --------------------------------- Meta info -------------------------------- #
 
@@ -22,6 +27,8 @@ class Work(SQLModel, table=True):
         sa_column_kwargs={"onupdate": datetime.now},
     )
     name: str | None = Field(default=None)
+    # names the directory of its shards, ids are reused after a delete
+    uuid: str = Field(default_factory=lambda: uuid4().hex)
 
     # ------------------------------- Running info ------------------------------- #
 
@@ -35,20 +42,96 @@ class Work(SQLModel, table=True):
     script: str  # The full script of user defined Runner
     class_name: str  # The class name of user defined Runner
     work_dir: str  # The work directory of user defined Runner
-    # use JSON column to store the id list
-    undone_batch_ids: list[str] = Field(default=[], sa_column=Column(JSON))
-    done_batch_ids: list[str] = Field(default=[], sa_column=Column(JSON))
+    # `WorkConfig` of works submitted in process by `BatchClient`, which have no
+    # script and are checked by their client instead of a scheduled task
+    config: dict | None = Field(default=None, sa_column=Column(JSON))
+    # shards waiting for in-flight batches to finish, see `max_enqueued_tokens`
+    pending_shards: list[str] = Field(default=[], sa_column=Column(JSON))
+    # remote files removed by clean up, skipped when an interrupted clean up resumes
+    deleted_file_ids: list[str] = Field(default=[], sa_column=Column(JSON))
+    # lines of output and error files consumed by `download`, see `checkpoint`
+    download_offsets: dict[str, int] = Field(default={}, sa_column=Column(JSON))
+    delivered_file_ids: list[str] = Field(default=[], sa_column=Column(JSON))
+    # last time the rows of its batches were updated from the API, see `snapshot`
+    snapshot_at: datetime | None = None
+
+    # ----------------------------------- usage ---------------------------------- #
+    # of the outputs delivered to `download`, see `usage`
+    outputs: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0
+
+    # ---------------------------------- batches --------------------------------- #
+    batches: list["Batch"] = Relationship(
+        back_populates="work",
+        sa_relationship_kwargs={"cascade": "all, delete-orphan"},
+    )
+
+    # ---------------------------------- timings --------------------------------- #
+    spans: list["Span"] = Relationship(
+        back_populates="work",
+        sa_relationship_kwargs={"cascade": "all, delete-orphan"},
+    )
+
+
+class BatchState(Enum):
+    Undone = "undone"  # not finished on the provider
+    Done = "done"  # finished, its outputs or errors delivered
+    Requeued = "requeued"  # rejected over the enqueued token limit, shard pending again
+
 
-    # ----------------------------- running processes ---------------------------- #
-    processes: list["ProcessStatus"] = Relationship(back_populates="work")
+class Batch(SQLModel, table=True):
+    """A batch of a work, created from one shard, as of the last check."""
 
+    # undone batches of a work are looked up at every check
+    __table_args__ = (Index("ix_batch_work_id_state", "work_id", "state"),)
+
+    id: str = Field(primary_key=True)
+    work_id: int = Field(foreign_key="work.id", index=True)
+    work: Work | None = Relationship(back_populates="batches")
+
+    state: BatchState = Field(default=BatchState.Undone, index=True)
+    credential: str = "default"  # credential the batch was created with
+    shard: str | None = None  # shard the batch was created from
+    attempt: int = 1  # batches created from the shard so far, this one included
+
+    # as reported by the provider
+    status: str
+    input_file_id: str
+    output_file_id: str | None = None
+    error_file_id: str | None = None
+    request_total: int | None = None
+    request_completed: int | None = None
+    request_failed: int | None = None
+
+    # of the outputs delivered to `download`, see `usage`
+    outputs: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0
+
+    created_at: datetime = Field(default_factory=datetime.now)
+    checked_at: datetime | None = None
+    in_progress_at: datetime | None = None
+    finalizing_at: datetime | None = None
+    ended_at: datetime | None = None
+
+
+class Span(SQLModel, table=True):
+    """Timing of a phase of a work, see `openai_batch.tracing`."""
+
+    id: int | None = Field(default=None, primary_key=True)
+    parent_id: int | None = Field(default=None, foreign_key="span.id")
 
-class ProcessStatus(SQLModel, table=True):
-    pid: int = Field(primary_key=True)  # explicitly specified, can not be None
+    work_id: int = Field(foreign_key="work.id", index=True)
+    work: Work | None = Relationship(back_populates="spans")
 
-    work_id: int | None = Field(default=None, foreign_key="work.id")
-    work: Work | None = Relationship(back_populates="processes")
+    pid: int
+    name: str
+    started_at: datetime
+    ended_at: datetime | None = None
 
-    description: str
-    current: int
-    total: int
+    items: int | None = None
+    bytes: int | None = None
+    error: str | None = None
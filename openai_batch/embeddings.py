@@ -0,0 +1,228 @@
+"""
+Embeddings written straight into a NumPy `.npy` file, row `i` being the embedding
+of the `i`-th input item.
+
+Vectors are never built as Python lists: base64 embeddings are decoded by
+`binascii` and float embeddings are parsed by NumPy, then copied straight into
+their row of the memory mapped array. Besides `path`, the store keeps:
+
+- `<stem>.ids`: custom ids in input order, written by transform.
+- `<stem>.mask.npy`: whether each row has been written, outputs of a work arrive
+  in several downloads and failed requests leave their row empty.
+"""
+
+import binascii
+import contextlib
+import json
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from .exception import OpenAIBatchException
+from .model import BatchOutputItem, BatchRequestOutputItem, EmbeddingsConfig
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+BLOCK_SIZE = 4096
+
+_KEY = '"embedding":'
+
+
+def _split_embedding(line: str) -> tuple[dict[str, Any], str | None]:
+    """
+    Parse an output line without its embedding, which is returned raw:
+    base64 without quotes, or a JSON array of floats.
+    """
+
+    if (key := line.find(_KEY)) == -1:
+        return json.loads(line), None
+
+    start = key + len(_KEY)
+    while line[start] in " \t":
+        start += 1
+
+    if line[start] == '"':
+        end = line.index('"', start + 1) + 1
+        raw = line[start + 1 : end - 1]
+        if "\\" in raw:  # base64 has no escapes but `/` may be escaped
+            raw = raw.replace("\\/", "/")
+    else:
+        end = line.index("]", start) + 1
+        raw = line[start:end]
+
+    return json.loads(line[:start] + "null" + line[end:]), raw
+
+
+def _decode(raw: str) -> "np.ndarray":
+    assert np is not None
+
+    if raw.startswith("["):
+        return np.fromstring(raw[1:-1], dtype=np.float32, sep=",")
+
+    return np.frombuffer(binascii.a2b_base64(raw), dtype=np.float32)
+
+
+class EmbeddingStore:
+    """
+    example:
+
+    ```python
+    store = EmbeddingStore(Path("embeddings.npy"))
+    with store.ids_writer() as write_id:
+        for item in items:
+            write_id(item.id)
+
+    for output in store.write(lines):  # lines of batch output files
+        ...
+
+    embeddings, mask = store.load()
+    ```
+    """
+
+    def __init__(self, path: Path, dtype: str = "float32"):
+        if np is None:
+            raise OpenAIBatchException(
+                "embeddings output requires `numpy`, "
+                "install it with `pip install openai-batch[embeddings]`"
+            )
+
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.ids_path = path.with_suffix(".ids")
+        self.mask_path = path.with_suffix(".mask.npy")
+
+        self._index: dict[str, int] | None = None
+
+    @classmethod
+    def of_config(cls, config: EmbeddingsConfig) -> "EmbeddingStore":
+        return cls(Path(config.path), dtype=config.dtype)
+
+    @contextlib.contextmanager
+    def ids_writer(self):
+        """Record custom ids in input order, discarding embeddings of a previous run."""
+
+        self.path.unlink(missing_ok=True)
+        self.mask_path.unlink(missing_ok=True)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = self.ids_path.with_suffix(".ids.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+
+            def write_id(custom_id: str):
+                if "\n" in custom_id:
+                    raise OpenAIBatchException(
+                        f"id of embedding input must be a single line: {custom_id!r}"
+                    )
+                f.write(f"{custom_id}\n")
+
+            yield write_id
+
+        tmp_path.replace(self.ids_path)
+        self._index = None
+
+    @property
+    def index(self) -> dict[str, int]:
+        """Row of each custom id"""
+
+        if self._index is None:
+            with self.ids_path.open(encoding="utf-8") as f:
+                self._index = {line[:-1]: row for row, line in enumerate(f)}
+
+        return self._index
+
+    def _open(self, dimensions: int) -> tuple["np.memmap", "np.memmap"]:
+        assert np is not None
+
+        shape = (len(self.index), dimensions)
+        if not self.path.exists():
+            array = np.lib.format.open_memmap(
+                self.path, mode="w+", dtype=self.dtype, shape=shape
+            )
+            mask = np.lib.format.open_memmap(
+                self.mask_path, mode="w+", dtype=np.bool_, shape=shape[:1]
+            )
+            return array, mask
+
+        array = np.lib.format.open_memmap(self.path, mode="r+")
+        if array.shape != shape:
+            raise OpenAIBatchException(
+                f"{self.path} has shape {array.shape}, embeddings have shape {shape}"
+            )
+
+        return array, np.lib.format.open_memmap(self.mask_path, mode="r+")
+
+    def write(self, lines: Iterable[str]) -> Iterator[BatchOutputItem]:
+        """Write embeddings of output lines, yield the output of each line."""
+
+        assert np is not None
+
+        array = mask = None
+        # rows written since the mask was last updated
+        rows: list[int] = []
+
+        def flush():
+            assert mask is not None
+            if rows:
+                mask[rows] = True
+                rows.clear()
+
+        try:
+            for line in lines:
+                record, raw = _split_embedding(line)
+                response = record.get("response") or {}
+                if (
+                    raw is None
+                    or record.get("error")
+                    or response.get("status_code") != 200
+                ):
+                    # failures are small, parse them as any other output
+                    yield BatchRequestOutputItem.model_validate_json(line).to_output()
+                    continue
+
+                vector = _decode(raw)
+                if array is None:
+                    array, mask = self._open(len(vector))
+                elif len(vector) != array.shape[1]:
+                    raise OpenAIBatchException(
+                        f"Embedding of {record['custom_id']} has {len(vector)} "
+                        f"dimensions, expected {array.shape[1]}"
+                    )
+
+                try:
+                    row = self.index[record["custom_id"]]
+                except KeyError as e:
+                    raise OpenAIBatchException(
+                        f"Unknown custom id of embedding: {record['custom_id']}"
+                    ) from e
+
+                # a single copy, faster than stacking a block and scattering it
+                array[row] = vector
+                rows.append(row)
+                if len(rows) >= BLOCK_SIZE:
+                    flush()
+
+                usage = response["body"].get("usage") or {}
+                yield BatchOutputItem(
+                    request_id=record["id"],
+                    id=record["custom_id"],
+                    status="success",
+                    prompt_tokens=usage.get("prompt_tokens"),
+                    total_tokens=usage.get("total_tokens"),
+                    model=response["body"].get("model"),
+                )
+        finally:
+            if array is not None and mask is not None:
+                flush()
+                array.flush()
+                mask.flush()
+
+    def load(self, mmap_mode: str | None = "r") -> tuple["np.ndarray", "np.ndarray"]:
+        """Embeddings and the mask of written rows."""
+
+        assert np is not None
+        return (
+            np.load(self.path, mmap_mode=mmap_mode),  # type: ignore
+            np.load(self.mask_path, mmap_mode=mmap_mode),  # type: ignore
+        )
@@ -0,0 +1,199 @@
+"""
+Outputs streamed into Parquet files as they are downloaded.
+
+Outputs are buffered column by column and written as a row group once
+`row_group_size` of them are buffered, so memory is bounded by the row group
+size whatever the size of the output.
+
+Downloads write a directory of part files, one per checkpoint, so that the
+outputs delivered before a failed download stay exported and a resumed download
+adds the next parts to the same directory, see `checkpoint`.
+"""
+
+import contextlib
+import os
+from pathlib import Path
+from types import TracebackType
+from typing import ContextManager, Iterable, Iterator
+
+from .exception import OpenAIBatchException
+from .model import BatchOutputItem, ExportConfig
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = pq = None
+
+FIELDS = list(BatchOutputItem.model_fields)
+
+
+def _schema() -> "pa.Schema":
+    assert pa is not None
+    return pa.schema(
+        [
+            ("request_id", pa.string()),
+            ("id", pa.string()),
+            ("status", pa.dictionary(pa.int8(), pa.string())),
+            ("response", pa.string()),
+            ("error", pa.string()),
+            ("prompt_tokens", pa.int64()),
+            ("completion_tokens", pa.int64()),
+            ("total_tokens", pa.int64()),
+            ("model", pa.dictionary(pa.int32(), pa.string())),
+        ]
+    )
+
+
+class ParquetSink:
+    """
+    example:
+
+    ```python
+    with ParquetSink(Path("outputs.parquet")) as sink:
+        for output in sink.tee(outputs):
+            ...
+    ```
+
+    The file is written to a temporary path and moved to `path` once closed.
+    With `parts`, `path` is a directory and `commit` moves the outputs written
+    since the last commit to its next `part-<n>.parquet` file.
+    """
+
+    def __init__(self, path: Path, row_group_size: int = 100_000, parts: bool = False):
+        if pa is None or pq is None:
+            raise OpenAIBatchException(
+                "parquet export requires `pyarrow`, "
+                "install it with `pip install openai-batch[export]`"
+            )
+
+        self.path = path
+        self.row_group_size = row_group_size
+        self.parts = parts
+        self.schema = _schema()
+        self.rows = 0
+
+        self._writer: "pq.ParquetWriter | None" = None
+        self._columns: dict[str, list] = {name: [] for name in FIELDS}
+        if parts:
+            path.mkdir(parents=True, exist_ok=True)
+            # parts committed by an earlier download are kept
+            self._part = len(list(path.glob("part-*.parquet")))
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._open()
+
+    @property
+    def _target(self) -> Path:
+        return self.path / f"part-{self._part:05d}.parquet" if self.parts else self.path
+
+    @property
+    def _tmp_path(self) -> Path:
+        target = self._target
+        return target.with_name(f".{target.name}.{os.getpid()}.tmp")
+
+    def _open(self) -> "pq.ParquetWriter":
+        assert pq is not None
+        self._writer = pq.ParquetWriter(self._tmp_path, self.schema)
+        return self._writer
+
+    @classmethod
+    def of_config(
+        cls, config: ExportConfig, name: str, parts: bool = False
+    ) -> "ParquetSink":
+        """Sink of `name` in the export directory of `config`, a directory with `parts`."""
+
+        if parts:
+            return cls(Path(config.path) / name, config.row_group_size, parts=True)
+
+        return cls(Path(config.path) / f"{name}.parquet", config.row_group_size)
+
+    def _flush(self):
+        if not self._columns["id"]:
+            return
+
+        batch = pa.RecordBatch.from_pydict(self._columns, schema=self.schema)  # type: ignore
+        writer = self._writer or self._open()
+        writer.write_batch(batch, row_group_size=self.row_group_size)
+        for column in self._columns.values():
+            column.clear()
+
+    def write(self, output: BatchOutputItem):
+        for name in FIELDS:
+            self._columns[name].append(getattr(output, name))
+
+        self.rows += 1
+        if len(self._columns["id"]) >= self.row_group_size:
+            self._flush()
+
+    def tee(self, outputs: Iterable[BatchOutputItem]) -> Iterator[BatchOutputItem]:
+        """Write each output, then yield it."""
+
+        for output in outputs:
+            self.write(output)
+            yield output
+
+    def commit(self):
+        """Move the outputs written since the last commit to the next part."""
+
+        assert self.parts
+        self._flush()
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._writer = None
+        self._tmp_path.replace(self._target)
+        self._part += 1
+
+    def close(self, commit: bool = True):
+        if self.parts and commit:
+            self.commit()
+            return
+
+        self._flush()
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._writer = None
+        if commit:
+            self._tmp_path.replace(self._target)
+        else:
+            self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "ParquetSink":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ):
+        self.close(commit=exc_type is None)
+
+
+def sink_of(
+    config: ExportConfig | None, name: str, parts: bool = False
+) -> ContextManager[ParquetSink | None]:
+    """Sink of the file `name` if the export is configured."""
+
+    if config is None:
+        return contextlib.nullcontext()
+
+    return ParquetSink.of_config(config, name, parts)
+
+
+def export(
+    outputs: Iterable[BatchOutputItem],
+    path: Path,
+    row_group_size: int = 100_000,
+) -> int:
+    """Write `outputs` to the Parquet file `path`, return the number of rows."""
+
+    with ParquetSink(path, row_group_size) as sink:
+        for output in outputs:
+            sink.write(output)
+
+    return sink.rows
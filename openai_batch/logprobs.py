@@ -0,0 +1,317 @@
+"""
+Logprobs of chat completions stored as flat columns, appended while downloading.
+
+Tokens of all requests are concatenated; the `i`-th request owns tokens
+`offsets[i]:offsets[i + 1]`. Token strings are kept as their UTF-8 bytes,
+concatenated, with the end offset of each token. Files in the store directory:
+
+- `requests.ids`: custom ids, one per line, in download order.
+- `requests.i64`: index of the first token of each request.
+- `logprob.f32`, `token.i64`, `token.bin`: logprob and bytes of each token.
+- `top_logprob.f32`, `top_token.i64`, `top_token.bin`: the same for the `k`
+  alternatives of each token, `NaN` and empty where a token has fewer.
+- `meta.json`: `k`.
+
+Columns are buffered in memory and appended to the files by `commit`, which a
+download calls with each checkpoint, see `checkpoint`. When a download fails,
+the columns written since the last commit are dropped, as the outputs they
+belong to are delivered again by the next check.
+
+Writing only needs the standard library, reading the columns needs `numpy`.
+"""
+
+import array
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from .exception import OpenAIBatchException
+from .model import BatchOutputItem, BatchRequestOutputItem, LogprobsConfig
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+META = "meta.json"
+
+
+def _token_bytes(token: dict[str, Any]) -> bytes:
+    # `bytes` keeps tokens that are not valid UTF-8 on their own
+    if (data := token.get("bytes")) is not None:
+        return bytes(data)
+
+    return token["token"].encode()
+
+
+def _size(path: Path) -> int:
+    return path.stat().st_size if path.exists() else 0
+
+
+def _truncate(path: Path, size: int):
+    if _size(path) > size:
+        with path.open("r+b") as f:
+            f.truncate(size)
+
+
+class _Column:
+    """Buffered append-only file of fixed size values."""
+
+    def __init__(self, path: Path, typecode: str):
+        self.path = path
+        self.buffer = array.array(typecode)
+        self.committed = _size(path)
+
+    @property
+    def stored(self) -> int:
+        return self.committed // self.buffer.itemsize
+
+    def flush(self):
+        with self.path.open("ab") as f:
+            self.buffer.tofile(f)
+        del self.buffer[:]
+        self.committed = _size(self.path)
+
+    def rollback(self):
+        del self.buffer[:]
+        _truncate(self.path, self.committed)
+
+
+class _Bytes:
+    """Buffered append-only concatenation of byte strings, with their end offsets."""
+
+    def __init__(self, path: Path, offsets_path: Path):
+        self.path = path
+        self.offsets = _Column(offsets_path, "q")
+        self.buffer = bytearray()
+        self.committed = self.end = _size(path)
+
+    def append(self, data: bytes):
+        self.buffer += data
+        self.end += len(data)
+        self.offsets.buffer.append(self.end)
+
+    def flush(self):
+        with self.path.open("ab") as f:
+            f.write(self.buffer)
+        self.buffer.clear()
+        self.committed = self.end
+        self.offsets.flush()
+
+    def rollback(self):
+        self.buffer.clear()
+        self.end = self.committed
+        _truncate(self.path, self.committed)
+        self.offsets.rollback()
+
+
+@dataclass
+class Logprobs:
+    """Columns of a logprobs store, memory mapped."""
+
+    ids: list[str]
+    offsets: "np.ndarray"
+    """Index of the first token of each request, and the total number of tokens"""
+    logprob: "np.ndarray"
+    token_offsets: "np.ndarray"
+    token_bytes: "np.ndarray"
+    top_logprob: "np.ndarray"
+    """Shape (tokens, k)"""
+    top_token_offsets: "np.ndarray"
+    """Shape (tokens, k)"""
+    top_token_bytes: "np.ndarray"
+
+    @staticmethod
+    def _decode(data: "np.ndarray", ends: "np.ndarray", start: int) -> list[str]:
+        tokens = []
+        for end in ends.tolist():
+            tokens.append(data[start:end].tobytes().decode(errors="replace"))
+            start = end
+        return tokens
+
+    def tokens(self, request: int) -> list[str]:
+        """Tokens of the `request`-th request"""
+
+        start, stop = self.offsets[request], self.offsets[request + 1]
+        first = self.token_offsets[start - 1] if start else 0
+        return self._decode(self.token_bytes, self.token_offsets[start:stop], first)
+
+    def logprobs(self, request: int) -> "np.ndarray":
+        """Logprobs of the tokens of the `request`-th request"""
+
+        return self.logprob[self.offsets[request] : self.offsets[request + 1]]
+
+
+class LogprobsStore:
+    """
+    example:
+
+    ```python
+    store = LogprobsStore(Path("logprobs"), top_logprobs=5)
+    for output in store.write(lines):  # lines of batch output files
+        ...
+
+    columns = store.load()
+    columns.tokens(0), columns.logprobs(0)
+    ```
+    """
+
+    def __init__(self, root: Path, top_logprobs: int = 0):
+        self.root = root
+        self.k = top_logprobs
+        self._writing = False
+
+    @classmethod
+    def of_config(cls, config: LogprobsConfig) -> "LogprobsStore":
+        return cls(Path(config.path), top_logprobs=config.top_logprobs)
+
+    def _open(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        meta_path = self.root / META
+        if meta_path.exists():
+            k = json.loads(meta_path.read_text())["top_logprobs"]
+            if k != self.k:
+                raise OpenAIBatchException(
+                    f"{self.root} stores {k} top logprobs, {self.k} configured"
+                )
+        else:
+            meta_path.write_text(json.dumps({"top_logprobs": self.k}))
+
+        for name in ("requests.i64", "logprob.f32", "top_logprob.f32"):
+            (self.root / name).touch()
+
+        self._ids_path = self.root / "requests.ids"
+        self._ids: list[str] = []
+        self._ids_committed = _size(self._ids_path)
+        self._offsets = _Column(self.root / "requests.i64", "q")
+        self._logprob = _Column(self.root / "logprob.f32", "f")
+        self._tokens = _Bytes(self.root / "token.bin", self.root / "token.i64")
+        self._top_logprob = _Column(self.root / "top_logprob.f32", "f")
+        self._top_tokens = _Bytes(
+            self.root / "top_token.bin",
+            self.root / "top_token.i64",
+        )
+        self._count = self._logprob.stored
+        self._writing = True
+
+    def _columns(self) -> list[_Column | _Bytes]:
+        # requests last, a request is only visible once its tokens are stored
+        return [
+            self._logprob,
+            self._tokens,
+            self._top_logprob,
+            self._top_tokens,
+            self._offsets,
+        ]
+
+    def _append(self, custom_id: str, content: list[dict[str, Any]]):
+        self._ids.append(f"{custom_id}\n")
+        self._offsets.buffer.append(self._count)
+
+        nan = float("nan")
+        for token in content:
+            self._logprob.buffer.append(token["logprob"])
+            self._tokens.append(_token_bytes(token))
+
+            top = (token.get("top_logprobs") or [])[: self.k]
+            for alternative in top:
+                self._top_logprob.buffer.append(alternative["logprob"])
+                self._top_tokens.append(_token_bytes(alternative))
+            for _ in range(self.k - len(top)):
+                self._top_logprob.buffer.append(nan)
+                self._top_tokens.append(b"")
+
+        self._count += len(content)
+
+    def commit(self):
+        """Append the columns of the outputs yielded so far to the files."""
+
+        if not self._writing:
+            return
+
+        for column in self._columns():
+            column.flush()
+        with self._ids_path.open("a", encoding="utf-8") as f:
+            f.writelines(self._ids)
+        self._ids.clear()
+        self._ids_committed = _size(self._ids_path)
+
+    def rollback(self):
+        """Drop the columns written since the last commit."""
+
+        if not self._writing:
+            return
+
+        for column in self._columns():
+            column.rollback()
+        self._ids.clear()
+        _truncate(self._ids_path, self._ids_committed)
+        self._count = self._logprob.stored
+
+    def write(self, lines: Iterable[str]) -> Iterator[BatchOutputItem]:
+        """
+        Store logprobs of output lines, yield the output of each line. They are
+        committed once the lines are exhausted, or by `commit` before.
+        """
+
+        self._open()
+        try:
+            for line in lines:
+                record = json.loads(line)
+                response = record.get("response") or {}
+                choices = (response.get("body") or {}).get("choices") or []
+
+                if response.get("status_code") == 200 and choices:
+                    choice = choices[0]
+                    logprobs = choice.get("logprobs") or {}
+                    content = logprobs.get("content") or []
+                    self._append(record["custom_id"], content)
+
+                    # the output keeps the text only
+                    choice["logprobs"] = None
+
+                yield BatchRequestOutputItem.model_validate(record).to_output()
+        except BaseException:
+            self.rollback()
+            raise
+        else:
+            self.commit()
+        finally:
+            self._writing = False
+
+    def load(self) -> Logprobs:
+        if np is None:
+            raise OpenAIBatchException(
+                "reading logprobs requires `numpy`, "
+                "install it with `pip install openai-batch[logprobs]`"
+            )
+
+        def column(name: str, dtype) -> "np.ndarray":
+            path = self.root / name
+            if not path.exists() or path.stat().st_size == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(path, dtype=dtype, mode="r")
+
+        ids = (self.root / "requests.ids").read_text(encoding="utf-8").splitlines()
+        offsets = column("requests.i64", np.int64)[: len(ids)]
+        logprob = column("logprob.f32", np.float32)
+        # tokens of an interrupted write past the last request are ignored
+        total = len(logprob)
+
+        def top(name: str, dtype) -> "np.ndarray":
+            if self.k == 0:
+                return np.zeros((total, 0), dtype=dtype)
+            return column(name, dtype).reshape(-1, self.k)[:total]
+
+        return Logprobs(
+            ids=ids,
+            offsets=np.append(offsets, total),
+            logprob=logprob,
+            token_offsets=column("token.i64", np.int64)[:total],
+            token_bytes=column("token.bin", np.uint8),
+            top_logprob=top("top_logprob.f32", np.float32),
+            top_token_offsets=top("top_token.i64", np.int64),
+            top_token_bytes=column("top_token.bin", np.uint8),
+        )
@@ -0,0 +1,436 @@
+"""
+Minimal Prometheus metrics of the batch pipeline.
+
+Metrics are exported either by an HTTP endpoint (`metrics_port` in config), served
+by the process for as long as it lives, or by a file for the node exporter
+textfile collector (`metrics_textfile_dir` in config), written when the check of
+a work ends. Samples recorded inside `exporting` carry the `work_id` label of
+their work, so works checked by the same process never mix, and each work writes
+its own `openai_batch_work_<id>.prom` file.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import httpx
+import openai
+
+from .config import global_config
+
+logger = logging.getLogger(__name__)
+
+type Labels = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    math.inf,
+)
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ""
+
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list["Metric"] = []
+        self.const_labels: dict[str, str] = {}
+
+    def register(self, metric: "Metric"):
+        self.metrics.append(metric)
+
+    def exposition(self, work_id: int | None = None) -> str:
+        """Prometheus text format 0.0.4 of all metrics, or of the work `work_id`"""
+
+        const = tuple(sorted(self.const_labels.items()))
+        lines: list[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.exposition(const, work_id))
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+_work_id: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "metrics_work_id",
+    default=None,
+)
+
+
+def _of_work(key: Labels, work_id: int) -> bool:
+    return key[:1] == (("work_id", str(work_id)),)
+
+
+class Metric:
+    type: str
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        registry: Registry = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict[str, str | int]) -> Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+
+        key = tuple((name, str(labels[name])) for name in self.labelnames)
+        if (work_id := _work_id.get()) is not None:
+            key = (("work_id", str(work_id)),) + key
+
+        return key
+
+    def _header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+
+    def samples(self) -> Iterable[tuple[str, Labels, Labels, float]]:
+        """Yield (suffix, labels, extra labels, value) samples."""
+
+        raise NotImplementedError()
+
+    def exposition(self, const: Labels, work_id: int | None = None) -> list[str]:
+        with self._lock:
+            samples = [
+                sample
+                for sample in self.samples()
+                if work_id is None or _of_work(sample[1], work_id)
+            ]
+
+        return self._header() + [
+            f"{self.name}{suffix}{_format_labels(const + labels, extra)} "
+            f"{_format_value(value)}"
+            for suffix, labels, extra, value in samples
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str | int):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str | int) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _header(self) -> list[str]:
+        # Prometheus text format names the counter family after its sample
+        name = f"{self.name}_total"
+        return [
+            f"# HELP {name} {self.documentation}",
+            f"# TYPE {name} counter",
+        ]
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield "_total", key, (), value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[Labels, float] = {}
+
+    def set(self, value: float, **labels: str | int):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels: str | int) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield "", key, (), value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(set(buckets) | {math.inf}))
+        self._counts: dict[Labels, list[int]] = {}
+        self._sums: dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: str | int):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            counts[idx] += 1
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str | int):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def merge(self, counts: Sequence[int], total: float, **labels: str | int):
+        """Add observations already counted by bucket."""
+
+        key = self._key(labels)
+        with self._lock:
+            merged = self._counts.setdefault(key, [0] * len(self.buckets))
+            for idx, count in enumerate(counts):
+                merged[idx] += count
+            self._sums[key] = self._sums.get(key, 0) + total
+
+    def count(self, **labels: str | int) -> int:
+        return sum(self._counts.get(self._key(labels), []))
+
+    def samples(self):
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts, strict=True):
+                cumulative += count
+                yield "_bucket", key, (("le", _format_value(bound)),), cumulative
+            yield "_count", key, (), cumulative
+            yield "_sum", key, (), self._sums[key]
+
+
+# ---------------------------------- pipeline ---------------------------------- #
+
+transformed_items = Counter(
+    "openai_batch_transformed_items",
+    "Input items transformed into batch requests.",
+)
+transform_throughput = Gauge(
+    "openai_batch_transform_items_per_second",
+    "Items transformed per second by the last transform.",
+)
+uploaded_bytes = Counter(
+    "openai_batch_uploaded_bytes",
+    "Bytes of batch input uploaded.",
+)
+downloaded_bytes = Counter(
+    "openai_batch_downloaded_bytes",
+    "Bytes of batch output and error files downloaded.",
+)
+stage_items = Counter(
+    "openai_batch_stage_items",
+    "Items produced by each stage of pipelined downloads.",
+    labelnames=("stage",),
+)
+stage_blocked = Counter(
+    "openai_batch_stage_blocked_seconds",
+    "Time each stage of pipelined downloads waited for the next one to catch up.",
+    labelnames=("stage",),
+)
+stage_starved = Counter(
+    "openai_batch_stage_starved_seconds",
+    "Time the consumer of each stage of pipelined downloads waited for its items.",
+    labelnames=("stage",),
+)
+request_tokens = Histogram(
+    "openai_batch_request_tokens",
+    "Prompt and completion tokens of each output delivered to download.",
+    labelnames=("kind",),
+    buckets=(16, 64, 256, 1024, 4096, 16384, 65536),
+)
+cost = Counter(
+    "openai_batch_cost_dollars",
+    "Estimated cost of the outputs delivered to download.",
+)
+deleted_files = Counter(
+    "openai_batch_deleted_files",
+    "Remote files deleted by clean up and gc.",
+)
+api_latency = Histogram(
+    "openai_batch_api_request_duration_seconds",
+    "Latency of OpenAI API calls.",
+    labelnames=("endpoint",),
+)
+api_errors = Counter(
+    "openai_batch_api_errors",
+    "Failed OpenAI API calls.",
+    labelnames=("endpoint", "code"),
+)
+api_throttled = Counter(
+    "openai_batch_api_throttled",
+    "OpenAI API calls rejected with 429 Too Many Requests.",
+    labelnames=("endpoint",),
+)
+api_retries = Counter(
+    "openai_batch_api_retries",
+    "Retried OpenAI API calls.",
+    labelnames=("endpoint",),
+)
+api_limiter_wait = Counter(
+    "openai_batch_api_limiter_wait_seconds",
+    "Time spent waiting for the rate limit shared by all processes.",
+)
+batches = Gauge(
+    "openai_batch_batches",
+    "Batches of the work by status, as of the last check.",
+    labelnames=("status",),
+)
+check_duration = Histogram(
+    "openai_batch_check_duration_seconds",
+    "Duration of checking the batches of a work.",
+)
+
+
+def _error_code(e: BaseException) -> str:
+    match e:
+        case openai.APIStatusError(status_code=code):
+            return str(code)
+        case httpx.HTTPStatusError(response=httpx.Response(status_code=code)):
+            return str(code)
+        case _:
+            return type(e).__name__
+
+
+@contextlib.contextmanager
+def observe_api(endpoint: str):
+    """Record latency and errors of an API call made in the block."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        api_errors.inc(endpoint=endpoint, code=_error_code(e))
+        raise
+    finally:
+        api_latency.observe(time.perf_counter() - start, endpoint=endpoint)
+
+
+# ---------------------------------- exporters --------------------------------- #
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        data = self.registry.exposition().encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(
+    port: int,
+    addr: str = "127.0.0.1",
+    registry: Registry = REGISTRY,
+) -> ThreadingHTTPServer:
+    """Serve metrics over HTTP from a daemon thread."""
+
+    handler = type("Handler", (_Handler,), {"registry": registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+_server_lock = threading.Lock()
+_served: set[int] = set()
+
+
+def _serve_once(port: int, registry: Registry):
+    # one endpoint serves all works of the process, until it exits
+    with _server_lock:
+        if port in _served:
+            return
+
+        _served.add(port)
+        try:
+            serve(port, registry=registry)
+        except OSError as e:  # another process is serving on the port
+            logger.warning(f"Failed to serve metrics on port {port}: {e}")
+
+
+def write_textfile(
+    path: Path,
+    registry: Registry = REGISTRY,
+    work_id: int | None = None,
+):
+    """Atomically write metrics in the format of the textfile collector."""
+
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(registry.exposition(work_id))
+    tmp_path.replace(path)
+
+
+@contextlib.contextmanager
+def exporting(work_id: int, registry: Registry = REGISTRY):
+    """Label metrics recorded in the block with `work_id`, and export them."""
+
+    if (port := global_config.metrics_port) is not None:
+        _serve_once(port, registry)
+
+    token = _work_id.set(work_id)
+    try:
+        yield
+    finally:
+        _work_id.reset(token)
+
+        if textfile_dir := global_config.metrics_textfile_dir:
+            path = Path(textfile_dir) / f"openai_batch_work_{work_id}.prom"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_textfile(path, registry=registry, work_id=work_id)
@@ -1,7 +1,11 @@
+import warnings
+from dataclasses import dataclass
 from datetime import timedelta
-from typing import Iterable, Literal, Self, Union
+from functools import cached_property
+from typing import Annotated, Any, Literal, Self, Union
 
-from openai.types.batch import Batch
+from openai.types import CreateEmbeddingResponse
+from openai.types.batch import Batch, Errors
 from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
 from openai.types.chat.chat_completion_tool_choice_option_param import (
     ChatCompletionToolChoiceOptionParam,
@@ -12,11 +16,96 @@ from openai.types.chat.completion_create_params import (
 )
 from openai.types.chat.completion_create_params import ResponseFormat
 from openai.types.chat_model import ChatModel
-from pydantic import BaseModel, Field, model_validator
+from openai.types.embedding_create_params import EmbeddingCreateParams
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    TypeAdapter,
+    model_validator,
+)
+from pydantic_core import to_json
 
 from .exception import OpenAIBatchException
 
 type Endpoint = Literal["/v1/chat/completions", "/v1/embeddings", "/v1/completions"]
+type Compression = Literal["none", "gzip", "zstd"]
+
+
+class DirectConfig(BaseModel):
+    """Configuration of the direct execution backend.
+
+    Args:
+        base_url (str, optional): Base URL of an OpenAI-compatible server, e.g. "http://localhost:8000/v1". Defaults to the OpenAI client's base URL.
+        api_key (str, optional): API key of the server. Defaults to the `OPENAI_API_KEY` environment variable.
+        concurrency (int, optional): Maximum number of requests in flight. Defaults to 16.
+        requests_per_second (float, optional): Rate limit of sent requests, unlimited if None. Defaults to None.
+        max_retries (int, optional): Retries of a request on connection errors, 429 and 5xx responses. Defaults to 3.
+        timeout (timedelta, optional): Timeout of a single request. Defaults to 10 minutes.
+    """
+
+    base_url: str | None = None
+    api_key: str | None = None
+    concurrency: int = Field(default=16, ge=1)
+    requests_per_second: float | None = Field(default=None, gt=0)
+    max_retries: int = Field(default=3, ge=0)
+    timeout: timedelta = timedelta(minutes=10)
+
+
+class EmbeddingsConfig(BaseModel):
+    """Configuration of the embeddings output, see `embeddings.EmbeddingStore`.
+
+    Args:
+        path (str): Path of the `.npy` file the embeddings are written to, row `i` being the embedding of the `i`-th input item.
+        dtype (Literal["float32", "float16"], optional): Data type of the stored embeddings. Defaults to "float32".
+    """
+
+    path: str
+    dtype: Literal["float32", "float16"] = "float32"
+
+
+class LogprobsConfig(BaseModel):
+    """Configuration of the logprobs output, see `logprobs.LogprobsStore`.
+
+    Args:
+        path (str): Directory the token logprobs of chat completions are appended to as flat columns.
+        top_logprobs (int, optional): Number of alternatives stored for each token, those of requests asking for more are truncated. Defaults to 0.
+    """
+
+    path: str
+    top_logprobs: int = Field(default=0, ge=0, le=20)
+
+
+class ExportConfig(BaseModel):
+    """Configuration of the export of outputs, see `export.ParquetSink`.
+
+    Args:
+        path (str): Directory the outputs of each download are written to, as a `<first output file id>` directory of a part per checkpoint, or `direct-<work id>.parquet` with the direct backend.
+        format (Literal["parquet"], optional): Format of the exported files. Defaults to "parquet".
+        row_group_size (int, optional): Outputs per row group, which bounds the memory used by the export. Defaults to 100000.
+    """
+
+    path: str
+    format: Literal["parquet"] = "parquet"
+    row_group_size: int = Field(default=100_000, gt=0)
+
+
+class PreflightConfig(BaseModel):
+    """Configuration of the checks of the input before it is uploaded, see `preflight`.
+
+    Args:
+        max_line_size (int, optional): Maximum size of a request line in bytes. Defaults to None, only limited by the size of a shard.
+        max_request_tokens (int, optional): Maximum estimated input tokens plus `max_tokens` of a request, e.g. the context window of the model. Defaults to None.
+        models (list[str], optional): Models requests may use. Defaults to None, any model.
+        max_errors (int, optional): Errors reported before the check stops. Defaults to 100.
+        workers (int, optional): Processes checking shards in parallel. Defaults to the number of cores.
+    """
+
+    max_line_size: int | None = Field(default=None, gt=0)
+    max_request_tokens: int | None = Field(default=None, gt=0)
+    models: list[str] | None = None
+    max_errors: int = Field(default=100, ge=1)
+    workers: int | None = Field(default=None, ge=1)
 
 
 class WorkConfig(BaseModel):
@@ -29,6 +118,18 @@ class WorkConfig(BaseModel):
         endpoint (Literal["/v1/chat/completions", "/v1/embeddings", "/v1/completions"], optional): Endpoint to use. Defaults to "/v1/chat/completions".
         allow_same_dataset (bool, optional): Allow the same dataset to be processed multiple times. Defaults to False.
         clean_up (bool, optional): Clean up the work after completion. Defaults to True.
+        shard_compression (Literal["none", "gzip", "zstd"], optional): Compression of the input shards kept on disk until the work is done. Defaults to "gzip".
+        backend (Literal["batch", "direct"], optional): Execute the work through the Batch API, or send every request directly to the endpoint. Defaults to "batch".
+        direct (DirectConfig, optional): Configuration of the direct backend. Defaults to DirectConfig().
+        embeddings (EmbeddingsConfig, optional): Write embeddings to a NumPy array instead of `BatchOutputItem.response`, requires the "/v1/embeddings" endpoint and the batch backend. Defaults to None.
+        logprobs (LogprobsConfig, optional): Store logprobs of chat completions as flat columns instead of in `BatchOutputItem.response`, requires the "/v1/chat/completions" endpoint and the batch backend. Defaults to None.
+        export (ExportConfig, optional): Also write outputs to Parquet files as they are downloaded. Defaults to None.
+        max_enqueued_tokens (int, optional): Keep shards pending and submit them as earlier batches finish, so that the estimated input tokens of unfinished batches stay under this quota. Defaults to None, submitting every shard at once.
+        credentials (dict[str, float], optional): Weight of each credential of the global config the shards are spread over, by size. Defaults to the `OPENAI_API_KEY` credential only.
+        preflight (PreflightConfig, optional): Check every request of the input before anything is uploaded, None to skip the check. Defaults to PreflightConfig().
+        pipeline_depth (int, optional): Items buffered between the fetch, parse and delivery stages of downloads, each running in its own thread, with `download` and `download_error` of different batches running concurrently. Defaults to 0, every stage running in the thread of the callbacks.
+        parse_workers (int, optional): Processes parsing output files, each file being downloaded to disk first and split at line ends, requires neither `embeddings` nor `logprobs`. Defaults to 0, parsing in the process of the callbacks.
+        checkpoint_interval (int, optional): Lines of output files delivered to `download` between two checkpoints of the progress, outputs after the last checkpoint are delivered again if `download` fails. Defaults to 10000.
     """
 
     name: str | None = None
@@ -37,11 +138,46 @@ class WorkConfig(BaseModel):
     endpoint: Endpoint = "/v1/chat/completions"
     allow_same_dataset: bool = False
     clean_up: bool = True
+    shard_compression: Compression = "gzip"
+    backend: Literal["batch", "direct"] = "batch"
+    direct: DirectConfig = DirectConfig()
+    embeddings: EmbeddingsConfig | None = None
+    logprobs: LogprobsConfig | None = None
+    export: ExportConfig | None = None
+    max_enqueued_tokens: int | None = Field(default=None, gt=0)
+    credentials: dict[str, Annotated[float, Field(gt=0)]] = {}
+    preflight: PreflightConfig | None = PreflightConfig()
+    pipeline_depth: int = Field(default=0, ge=0)
+    parse_workers: int = Field(default=0, ge=0)
+    checkpoint_interval: int = Field(default=10_000, gt=0)
+
+    @model_validator(mode="after")
+    def _validate(self):
+        if self.embeddings is not None:
+            if self.endpoint != "/v1/embeddings":
+                raise ValueError("`embeddings` requires the /v1/embeddings endpoint")
+            if self.backend != "batch":
+                raise ValueError("`embeddings` requires the batch backend")
+
+        if self.logprobs is not None:
+            if self.endpoint != "/v1/chat/completions":
+                raise ValueError(
+                    "`logprobs` requires the /v1/chat/completions endpoint"
+                )
+            if self.backend != "batch":
+                raise ValueError("`logprobs` requires the batch backend")
+
+        if self.parse_workers and (self.embeddings or self.logprobs):
+            raise ValueError(
+                "`parse_workers` can't parse into `embeddings` or `logprobs`"
+            )
+
+        return self
 
 
 class BatchInputItem(BaseModel):
     id: str
-    messages: Iterable[ChatCompletionMessageParam]
+    messages: list[ChatCompletionMessageParam]
 
     model: ChatModel = "gpt-3.5-turbo"
     frequency_penalty: float | None = Field(default=None, ge=-2.0, le=2.0)
@@ -50,16 +186,16 @@ class BatchInputItem(BaseModel):
     max_tokens: int | None = None
     n: int | None = 1
     presence_penalty: float | None = Field(default=None, ge=-2.0, le=2.0)
-    response_format: ResponseFormat = {}
+    response_format: ResponseFormat | None = None
     seed: int | None = None
     stop: Union[str, list[str], None] = None
     temperature: float | None = Field(default=None, ge=0.0, le=2.0)
-    tool_choice: ChatCompletionToolChoiceOptionParam = "none"
-    tools: Iterable[ChatCompletionToolParam] = Field(default=[], max_length=128)
+    tool_choice: ChatCompletionToolChoiceOptionParam | None = None
+    tools: list[ChatCompletionToolParam] | None = Field(default=None, max_length=128)
     top_logprobs: int | None = Field(default=None, ge=0, le=20)
     top_p: float | None = Field(default=None, ge=0.0, le=1.0)
     user: str | None = None
-    stream: Literal[False] | None = None
+    stream: Literal[False] = False
 
     @model_validator(mode="after")
     def _validate(self):
@@ -69,18 +205,148 @@ class BatchInputItem(BaseModel):
         return self
 
 
-class BatchOutputItem(BaseModel):
-    batch_id: str
+_messages_adapter = TypeAdapter(list[ChatCompletionMessageParam])
+
+
+class BatchInputTemplate(BatchInputItem):
+    """
+    Constant part of the input items of a work, validated and encoded once.
+    `messages` of the template are a prefix of the messages of every item,
+    e.g. the system message.
+
+    example:
+
+    ```python
+    template = BatchInputTemplate(
+        model="gpt-4o-mini",
+        messages=[{"role": "system", "content": "Answer in French."}],
+        tools=tools,
+    )
+
+    def upload():
+        for row in rows:
+            yield template.item(row.id, [{"role": "user", "content": row.text}])
+    ```
+    """
+
+    # the encoded template is cached
+    model_config = ConfigDict(frozen=True)
+
+    id: str = ""
+    messages: list[ChatCompletionMessageParam] = []
+
+    @cached_property
+    def _encoded(self) -> tuple[bytes, bytes]:
+        """Body up to the messages of items, and whether a separator is needed"""
+
+        body = self.model_dump(
+            mode="json",
+            exclude={"id", "messages"},
+            exclude_none=True,
+        )
+        prefix = to_json(self.messages)[1:-1]
+        return to_json(body)[:-1] + b',"messages":[' + prefix, b"," if prefix else b""
+
+    def item(
+        self,
+        id: str,
+        messages: list[ChatCompletionMessageParam],
+    ) -> "TemplateInputItem":
+        """Input item whose `messages` follow the messages of the template."""
+
+        return TemplateInputItem(
+            template=self,
+            id=id,
+            messages=_messages_adapter.validate_python(messages),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class TemplateInputItem:
+    """Input item of a `BatchInputTemplate`, see `BatchInputTemplate.item`."""
+
+    template: BatchInputTemplate
+    id: str
+    messages: list[ChatCompletionMessageParam]
+
+    def to_input(self) -> BatchInputItem:
+        fields = dict(self.template)
+        fields.update(id=self.id, messages=[*self.template.messages, *self.messages])
+        # validated by the template and `BatchInputTemplate.item` already
+        return BatchInputItem.model_construct(**fields)
+
+    def encode(self, endpoint: Endpoint) -> bytes:
+        """Line of the batch input file, spliced into the encoded template."""
+
+        body, separator = self.template._encoded
+        messages = to_json(self.messages)[1:-1]
+        return b"".join(
+            (
+                b'{"custom_id":',
+                to_json(self.id),
+                b',"method":"POST","url":',
+                to_json(endpoint),
+                b',"body":',
+                body,
+                separator if messages else b"",
+                messages,
+                b"]}}\n",
+            )
+        )
+
+
+class EmbeddingInputItem(BaseModel):
+    """Input item of the /v1/embeddings endpoint, embedding a single input."""
+
     id: str
+    input: str | list[int]
+
+    model: str = "text-embedding-3-small"
+    dimensions: int | None = Field(default=None, ge=1)
+    encoding_format: Literal["float", "base64"] = "base64"
+    user: str | None = None
+
+
+class _ResultItem(BaseModel):
+    request_id: str  # id of the request in the batch, `batch_req_...`
+    id: str  # custom id of the request, the id of its input item
+
+    @model_validator(mode="before")
+    @classmethod
+    def _from_earlier_version(cls, data: Any) -> Any:
+        # items written by earlier versions held the custom id in `batch_id`
+        # and the id of the request in `id`
+        if isinstance(data, dict) and "batch_id" in data and "request_id" not in data:
+            data = {**data, "request_id": data["id"], "id": data["batch_id"]}
+            del data["batch_id"]
+
+        return data
+
+    @property
+    def batch_id(self) -> str:
+        """Deprecated, the custom id of the request, use `id`"""
+
+        warnings.warn(
+            "`batch_id` is deprecated, use `id` for the custom id and "
+            "`request_id` for the id of the request in the batch",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return self.id
+
+
+class BatchOutputItem(_ResultItem):
     status: Literal["success", "failed"]
     response: str | None = None
     error: str | None = None
 
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    total_tokens: int | None = None
+    model: str | None = None
 
-class BatchErrorItem(BaseModel):
-    batch_id: str
-    id: str
 
+class BatchErrorItem(_ResultItem):
     code: str | None = None
     line: int | None = None
     message: str | None = None
@@ -97,19 +363,27 @@ class BatchRequestInputItem(BaseModel):
     custom_id: str
     method: Literal["POST"]
     url: Endpoint
-    body: CompletionCreateParams
+    body: CompletionCreateParams | EmbeddingCreateParams
 
     @classmethod
     def from_input(
         cls,
         config: WorkConfig,
-        item: BatchInputItem,
+        item: BatchInputItem | EmbeddingInputItem | TemplateInputItem,
     ) -> "BatchRequestInputItem":
+        if isinstance(item, TemplateInputItem):
+            item = item.to_input()
+
+        body = item.model_dump(exclude={"id"}, exclude_none=True)
         return cls(
             custom_id=item.id,
             method="POST",
             url=config.endpoint,
-            body=CompletionCreateParams(**item.model_dump(exclude={"id"})),
+            body=(
+                CompletionCreateParams(**body)
+                if isinstance(item, BatchInputItem)
+                else EmbeddingCreateParams(**body)
+            ),
         )
 
 
@@ -123,7 +397,10 @@ class BatchRequestOutputItem(BaseModel):
     class Response(BaseModel):
         status_code: int
         request_id: str
-        body: ChatCompletion
+        # bodies of failed requests are error objects
+        body: ChatCompletion | CreateEmbeddingResponse | dict[str, Any] = Field(
+            union_mode="left_to_right"
+        )
 
     class Error(BaseModel):
         code: str
@@ -136,32 +413,56 @@ class BatchRequestOutputItem(BaseModel):
 
     def to_output(self) -> BatchOutputItem:
         if self.error:
-            error_message = f"Request failed with error code {self.error.code}: {self.error.message}"
+            error_message = (
+                f"Request failed with error code {self.error.code}: "
+                f"{self.error.message}"
+            )
         elif (resp := self.response) and resp.status_code != 200:
             error_message = f"Request failed with HTTP status code {resp.status_code}"
         else:
             error_message = None
 
-        if not error_message and self.response:
-            response = self.response.body.choices[0].message.content
-        else:
-            response = None
+        match self.response:
+            case self.Response(body=ChatCompletion() as body) if not error_message:
+                response = body.choices[0].message.content
+            case _:
+                response = None
+
+        match self.response:
+            case self.Response(
+                body=ChatCompletion(usage=usage) | CreateEmbeddingResponse(usage=usage)
+            ) if usage is not None:
+                usage = usage.model_dump()
+            case _:
+                usage = {}
+
+        match self.response:
+            case self.Response(
+                body=ChatCompletion(model=model) | CreateEmbeddingResponse(model=model)
+            ):
+                pass
+            case _:
+                model = None
 
         status = "success" if not error_message else "failed"
 
         return BatchOutputItem(
-            batch_id=self.custom_id,
-            id=self.id,
+            request_id=self.id,
+            id=self.custom_id,
             status=status,
             response=response,
             error=error_message,
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            total_tokens=usage.get("total_tokens"),
+            model=model,
         )
 
     def to_error_output(self) -> BatchErrorItem | None:
         if self.error:
             return BatchErrorItem(
-                batch_id=self.custom_id,
-                id=self.id,
+                request_id=self.id,
+                id=self.custom_id,
                 code=self.error.code,
                 message=self.error.message,
             )
@@ -169,6 +470,10 @@ class BatchRequestOutputItem(BaseModel):
         return None
 
 
+QUOTA_ERRORS = frozenset({"token_limit_exceeded"})
+"""Error codes of batches rejected for the enqueued token limit"""
+
+
 class BatchStatus(BaseModel):
     """
     Status object that extracts information from a `Batch`.
@@ -205,9 +510,28 @@ class BatchStatus(BaseModel):
     def batch_id(self) -> str:
         return self.batch.id
 
+    @property
+    def error_codes(self) -> set[str]:
+        """Codes of the errors the batch was rejected with, before running"""
+
+        match self.batch:
+            case Batch(errors=Errors(data=list(errors))):
+                return {error.code for error in errors if error.code is not None}
+            case _:
+                return set()
+
+    @property
+    def over_quota(self) -> bool:
+        """Whether the batch was rejected for the enqueued token limit"""
+
+        return self.status == "failed" and bool(self.error_codes & QUOTA_ERRORS)
+
     @model_validator(mode="after")
     def _validate(self) -> Self:
         match self:
+            # batches rejected before running have no error file
+            case BatchStatus(status="failed", file_id=None, error_codes=codes) if codes:
+                pass
             case BatchStatus(status="success" | "failed" as status, file_id=None):
                 raise OpenAIBatchException(
                     f"Batch ended with status {status}"
@@ -1,6 +1,12 @@
 from openai import OpenAI
 
-from .upload import OpenAIFile
+from .upload import OpenAIFile, create_http_client
 
-openai_client = OpenAI()
-openai_file = OpenAIFile(client=openai_client)
+# one connection pool for API calls and file transfers
+http_client = create_http_client()
+openai_client = OpenAI(http_client=http_client)
+openai_file = OpenAIFile(client=openai_client, http_client=http_client)
+
+# retries are left to `ratelimit.retrying`, which shares the rate limit of processes
+openai_batches = openai_client.with_options(max_retries=0).batches
+openai_files = openai_client.with_options(max_retries=0).files
@@ -0,0 +1,175 @@
+import asyncio
+import queue
+import threading
+import time
+from typing import Iterable
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from ..model import BatchRequestInputItem, BatchRequestOutputItem, DirectConfig
+
+_DONE = object()
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket, refilled with `rate` tokens per second up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated) * self.rate,
+        )
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        # waiters queue up on the lock, so tokens are handed out in FIFO order
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+
+            self._tokens -= tokens
+
+
+class _Stopped(Exception):
+    pass
+
+
+async def _send(
+    client: AsyncOpenAI,
+    idx: int,
+    request: BatchRequestInputItem,
+) -> BatchRequestOutputItem:
+    request_id = f"direct_req_{idx}"
+    try:
+        resp = await client.post(
+            request.url.removeprefix("/v1"),
+            # the body is validated lazily (iterables), dump it to plain JSON types
+            body=request.model_dump(mode="json")["body"],
+            cast_to=httpx.Response,
+        )
+    except openai.APIStatusError as e:
+        return BatchRequestOutputItem(
+            id=request_id,
+            custom_id=request.custom_id,
+            error=BatchRequestOutputItem.Error(
+                code=str(e.status_code),
+                message=e.message,
+            ),
+        )
+    except openai.APIConnectionError as e:
+        return BatchRequestOutputItem(
+            id=request_id,
+            custom_id=request.custom_id,
+            error=BatchRequestOutputItem.Error(
+                code="connection_error",
+                message=str(e),
+            ),
+        )
+
+    return BatchRequestOutputItem(
+        id=request_id,
+        custom_id=request.custom_id,
+        response=BatchRequestOutputItem.Response(
+            status_code=resp.status_code,
+            request_id=resp.headers.get("x-request-id", ""),
+            body=resp.json(),
+        ),
+    )
+
+
+async def _execute(
+    requests: Iterable[BatchRequestInputItem],
+    config: DirectConfig,
+    put,
+):
+    slots = asyncio.Semaphore(config.concurrency)
+    bucket = (
+        TokenBucket(config.requests_per_second)  #
+        if config.requests_per_second
+        else None
+    )
+
+    async def send(idx: int, request: BatchRequestInputItem):
+        try:
+            output = await _send(client, idx, request)
+            # the slot is held until the consumer takes the output (backpressure)
+            await asyncio.to_thread(put, output)
+        finally:
+            slots.release()
+
+    async with AsyncOpenAI(
+        base_url=config.base_url,
+        api_key=config.api_key,
+        max_retries=config.max_retries,
+        timeout=config.timeout.total_seconds(),
+    ) as client:
+        async with asyncio.TaskGroup() as group:
+            for idx, request in enumerate(requests):
+                await slots.acquire()
+                if bucket:
+                    await bucket.acquire()
+                group.create_task(send(idx, request))
+
+
+def execute(
+    requests: Iterable[BatchRequestInputItem],
+    config: DirectConfig,
+) -> Iterable[BatchRequestOutputItem]:
+    """
+    Send `requests` directly to an OpenAI-compatible server, yielding outputs in completion order.
+
+    Requests are sent from an event loop in a background thread, with at most
+    `config.concurrency` requests in flight (including outputs not yet consumed).
+    """
+
+    outputs: queue.Queue = queue.Queue(maxsize=config.concurrency)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                outputs.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+        raise _Stopped()
+
+    def run():
+        try:
+            asyncio.run(_execute(requests, config, put))
+            result = _DONE
+        except BaseException as e:
+            result = e
+
+        try:
+            put(result)
+        except _Stopped:  # the consumer is gone
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    try:
+        while (item := outputs.get()) is not _DONE:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
@@ -0,0 +1,132 @@
+"""
+Clients of the credentials of the global config, among which the shards of a
+work are spread according to `WorkConfig.credentials`.
+
+Batches are recorded with the name of the credential they were created with,
+so that they are checked and downloaded by the client of their owner. Each
+credential has its own shared rate limit, a throttled organization does not
+hold back the others.
+"""
+
+import collections
+import functools
+from dataclasses import dataclass
+from typing import Iterable, Mapping, Sequence
+
+from openai import OpenAI
+from openai.resources import Batches, Files
+
+from ..config import global_config
+from ..exception import OpenAIBatchException
+from . import http_client, openai_batches, openai_file, openai_files
+from .upload import OpenAIFile
+
+DEFAULT = "default"
+"""Credential of the `OPENAI_API_KEY` environment variable"""
+
+
+@dataclass(frozen=True)
+class Client:
+    name: str
+    file: OpenAIFile
+    batches: Batches
+    files: Files
+
+    @property
+    def bucket(self) -> str:
+        """Name of the shared rate limit of the credential"""
+
+        return self.file.bucket
+
+
+@functools.cache
+def client(name: str = DEFAULT) -> Client:
+    """Client of the credential `name`."""
+
+    if name == DEFAULT:
+        return Client(
+            name=name,
+            file=openai_file,
+            batches=openai_batches,
+            files=openai_files,
+        )
+
+    try:
+        config = global_config.credentials[name]
+    except KeyError as e:
+        raise OpenAIBatchException(f"Unknown credential: {name}") from e
+
+    # retries are left to `ratelimit.retrying`
+    openai_client = OpenAI(
+        api_key=config.api_key,
+        base_url=config.base_url,
+        organization=config.organization,
+        http_client=http_client,
+        max_retries=0,
+    )
+    return Client(
+        name=name,
+        file=OpenAIFile(openai_client, http_client=http_client, bucket=f"api:{name}"),
+        batches=openai_client.batches,
+        files=openai_client.files,
+    )
+
+
+def clients() -> list[Client]:
+    """Clients of every credential, the default one first."""
+
+    return [client(), *(client(name) for name in global_config.credentials)]
+
+
+def organization(name: str) -> str:
+    """
+    Organization whose quotas credential `name` counts against, the credential
+    itself if its organization is not configured.
+    """
+
+    config = global_config.credentials.get(name)
+    if config is not None and config.organization:
+        return config.organization
+
+    return f"credential:{name}"
+
+
+def lightest(
+    weights: Mapping[str, float],
+    assigned: Mapping[str, int],
+    size: int,
+    names: Iterable[str] | None = None,
+) -> str:
+    """
+    Credential among `names`, all of `weights` if None, whose share would stay
+    the lowest relative to its weight with `size` more.
+    """
+
+    return min(
+        names if names is not None else weights,
+        key=lambda name: (assigned.get(name, 0) + size) / weights[name],
+    )
+
+
+def assign(
+    weights: Mapping[str, float],
+    sizes: Sequence[int],
+    assigned: Mapping[str, int] | None = None,
+) -> list[str]:
+    """
+    Credential of each shard of `sizes` bytes, spreading bytes in proportion to
+    `weights`: each shard goes to the credential whose share would stay the
+    lowest relative to its weight, counting the bytes `assigned` earlier.
+    """
+
+    if not weights:
+        return [DEFAULT] * len(sizes)
+
+    assigned = collections.Counter(assigned or {})
+    names = []
+    for size in sizes:
+        name = lightest(weights, assigned, size)
+        assigned[name] += size
+        names.append(name)
+
+    return names
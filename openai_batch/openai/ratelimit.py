@@ -0,0 +1,260 @@
+"""
+Rate limiting and retries of OpenAI API calls, shared by all processes.
+
+Every checker process of every work calls the same organization's Files and
+Batches endpoints, so the token bucket lives in a SQLite database next to the
+works database instead of in memory. A `Retry-After` answer pauses the bucket,
+and with it every other process, until the server accepts requests again.
+"""
+
+import contextlib
+import email.utils
+import logging
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+import httpx
+import openai
+
+from .. import metrics
+from ..config import global_config
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class SharedTokenBucket:
+    """
+    Token bucket refilled with `rate` tokens per second up to `capacity` tokens,
+    whose state is stored in the SQLite database `path`.
+    """
+
+    def __init__(self, path: Path, rate: float, capacity: float, name: str = "api"):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # transactions are explicit, see `_transaction`
+            self._conn = sqlite3.connect(
+                self.path,
+                timeout=30,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS bucket ("
+                "name TEXT PRIMARY KEY, "
+                "tokens REAL NOT NULL, "
+                "updated REAL NOT NULL, "
+                "paused_until REAL NOT NULL)"
+            )
+
+        return self._conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self._connect()
+            # lock the database for writing before reading the bucket
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+
+    def _load(self, conn: sqlite3.Connection, now: float) -> tuple[float, float]:
+        row = conn.execute(
+            "SELECT tokens, updated, paused_until FROM bucket WHERE name = ?",
+            (self.name,),
+        ).fetchone()
+        if row is None:
+            return self.capacity, 0.0
+
+        tokens, updated, paused_until = row
+        tokens = min(self.capacity, tokens + max(now - updated, 0) * self.rate)
+        return tokens, paused_until
+
+    def _store(
+        self,
+        conn: sqlite3.Connection,
+        tokens: float,
+        now: float,
+        paused_until: float,
+    ):
+        conn.execute(
+            "INSERT OR REPLACE INTO bucket VALUES (?, ?, ?, ?)",
+            (self.name, tokens, now, paused_until),
+        )
+
+    def _take(self) -> float:
+        """Take a token, return the seconds to wait if there is none."""
+
+        with self._transaction() as conn:
+            now = time.time()
+            tokens, paused_until = self._load(conn, now)
+
+            if paused_until > now:
+                wait = paused_until - now
+            elif tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._store(conn, tokens, now, paused_until)
+
+        return wait
+
+    def acquire(self):
+        """Block until a token is taken."""
+
+        while (wait := self._take()) > 0:
+            metrics.api_limiter_wait.inc(wait)
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Let no process take a token for `seconds`."""
+
+        with self._transaction() as conn:
+            now = time.time()
+            tokens, paused_until = self._load(conn, now)
+            self._store(conn, tokens, now, max(paused_until, now + seconds))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_buckets: dict[str, SharedTokenBucket] = {}
+
+
+def shared_bucket(name: str = "api") -> SharedTokenBucket:
+    """Rate limit `name`, one per credential, see `pool`."""
+
+    if name not in _buckets:
+        config = global_config.rate_limit
+        _buckets[name] = SharedTokenBucket(
+            path=Path(global_config.save_path) / "rate_limit.sqlite",
+            rate=config.requests_per_second,
+            capacity=config.burst,
+            name=name,
+        )
+
+    return _buckets[name]
+
+
+def _status_and_headers(e: BaseException) -> tuple[int, httpx.Headers] | None:
+    match e:
+        case openai.APIStatusError(status_code=status, response=response):
+            return status, response.headers
+        case httpx.HTTPStatusError(response=response):
+            return response.status_code, response.headers
+        case _:
+            return None
+
+
+def retry_after(headers: httpx.Headers) -> float | None:
+    """Seconds to wait as asked by the server, if it did."""
+
+    if (value := headers.get("retry-after-ms")) is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    if (value := headers.get("retry-after")) is None:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(date.timestamp() - time.time(), 0)
+
+
+def backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+
+    config = global_config.rate_limit
+    return random.uniform(0, min(config.backoff_max, config.backoff_base * 2**attempt))
+
+
+def _is_retryable(e: BaseException) -> bool:
+    match e:
+        case openai.APIConnectionError() | httpx.TransportError():
+            return True
+        case _ if (status := _status_and_headers(e)) is not None:
+            return status[0] in RETRYABLE_STATUS
+        case _:
+            return False
+
+
+def retrying[T](
+    endpoint: str,
+    call: Callable[[], T],
+    max_retries: int | None = None,
+    bucket: str = "api",
+) -> T:
+    """
+    Call `call` within the shared rate limit `bucket`, retrying rate limited,
+    server and connection errors. Each attempt is observed as a call to `endpoint`.
+    """
+
+    shared = shared_bucket(bucket)
+    if max_retries is None:
+        max_retries = global_config.rate_limit.max_retries
+
+    attempt = 0
+    while True:
+        shared.acquire()
+        try:
+            with metrics.observe_api(endpoint):
+                return call()
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable(e):
+                raise
+
+            requested = None
+            if (status := _status_and_headers(e)) is not None:
+                code, headers = status
+                if code == 429:
+                    metrics.api_throttled.inc(endpoint=endpoint)
+                requested = retry_after(headers)
+
+            wait = requested if requested is not None else backoff(attempt)
+            metrics.api_retries.inc(endpoint=endpoint)
+            logger.warning(
+                f"{endpoint} failed ({e}), "
+                f"retry {attempt + 1}/{max_retries} in {wait:.1f}s"
+            )
+
+            if requested is not None:
+                # the whole organization is limited, not only this process,
+                # the next `acquire` waits until the pause is over
+                shared.pause(wait)
+            else:
+                time.sleep(wait)
+
+            attempt += 1
@@ -1,17 +1,25 @@
+import contextlib
+import mmap
+import os
+import stat
 from dataclasses import dataclass
-from typing import IO, Callable, Iterable, Literal
+from typing import IO, Callable, Iterable, Iterator, Literal
 
-import requests as rq
+import httpx
 from openai import OpenAI
 from openai.types.file_object import FileObject
-from requests_toolbelt import (
-    MultipartEncoder,
-    MultipartEncoderMonitor,
-)
 
-from ..const import K
+from ..config import global_config
+from ..exception import OpenAIBatchException
+from ..utils import iter_lines
+from .ratelimit import retrying
 from .utils import check_file_size
 
+try:
+    import h2
+except ImportError:  # optional dependency
+    h2 = None
+
 
 @dataclass(frozen=True)
 class StreamChunk:
@@ -37,11 +45,154 @@ class RetrieveChunk(StreamChunk):
     line: str
 
 
-DEFAULT_RETRIEVE_CHUNK_SIZE = 16 * K
+def create_http_client() -> httpx.Client:
+    """
+    Pooled keep-alive client shared by the OpenAI client and file transfers,
+    speaking HTTP/2 when `h2` is installed (`pip install openai-batch[http2]`).
+    """
+
+    config = global_config.transfer
+    return httpx.Client(
+        http2=config.http2 and h2 is not None,
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_connections,
+        ),
+        timeout=httpx.Timeout(config.timeout, connect=10),
+        follow_redirects=True,
+    )
+
+
+def _mapped(file: IO[bytes], start: int, size: int) -> mmap.mmap | None:
+    """
+    Read-only map of the regular file behind `file` holding `size` bytes from
+    `start`, None if there is none, such as for in-memory or compressed streams.
+    """
+
+    if not size:  # empty files can't be mapped
+        return None
+
+    try:
+        fd = file.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+    info = os.fstat(fd)
+    if not stat.S_ISREG(info.st_mode) or info.st_size < start + size:
+        return None
+
+    return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+
+
+class _MultipartBody:
+    """
+    Streamed multipart/form-data body with a single file, whose length is known
+    up front so that the upload is not chunked.
+
+    Regular files are sent as slices of a memory map of the file when `mapped`,
+    without copying them to buffers read from the file first. Pages sent are
+    dropped from the map, so that the memory used stays that of a chunk.
+    """
+
+    def __init__(
+        self,
+        fields: dict[str, str],
+        filename: str,
+        file: IO[bytes],
+        size: int,
+        chunk_size: int,
+        on_chunk: Callable[[int], None] | None = None,
+        start: int = 0,
+        mapped: bool = False,
+    ):
+        self.boundary = os.urandom(16).hex()
+        self.file = file
+        self.size = size
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+        self.start = start
+        self.mapped = mapped
+
+        head = b"".join(
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n".encode()
+            for name, value in fields.items()
+        )
+        self.head = (
+            head
+            + (
+                f"--{self.boundary}\r\n"
+                f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n"
+            ).encode()
+        )
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode()
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self) -> Iterator[bytes | memoryview]:
+        yield self.head
+
+        if self.mapped and (mapped := _mapped(self.file, self.start, self.size)):
+            yield from self._iter_mapped(mapped)
+        else:
+            yield from self._iter_read()
+
+        yield self.tail
+
+    def _iter_read(self) -> Iterator[bytes]:
+        sent = 0
+        while data := self.file.read(self.chunk_size):
+            sent += len(data)
+            yield data
+            if self.on_chunk is not None:
+                self.on_chunk(sent)
+
+        if sent != self.size:
+            raise OpenAIBatchException(
+                f"Expected {self.size} bytes of file, got {sent} bytes"
+            )
+
+    def _iter_mapped(self, mapped: mmap.mmap) -> Iterator[memoryview]:
+        if hasattr(mmap, "MADV_SEQUENTIAL"):  # not on Windows
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+        end = self.start + self.size
+        # first page not dropped from the map yet
+        kept = self.start - self.start % mmap.PAGESIZE
+        view = memoryview(mapped)
+        try:
+            for offset in range(self.start, end, self.chunk_size):
+                stop = min(offset + self.chunk_size, end)
+                with view[offset:stop] as chunk:
+                    yield chunk
+
+                # pages sent are still in the page cache, unmapped from this
+                # process only
+                sent_pages = stop - stop % mmap.PAGESIZE
+                if hasattr(mmap, "MADV_DONTNEED") and sent_pages > kept:
+                    mapped.madvise(mmap.MADV_DONTNEED, kept, sent_pages - kept)
+                    kept = sent_pages
+
+                if self.on_chunk is not None:
+                    self.on_chunk(stop - self.start)
+        finally:
+            # a slice still held by the transport keeps the map until collected
+            with contextlib.suppress(BufferError):
+                view.release()
+                mapped.close()
 
 
 class OpenAIFile:
     """
+    Streamed upload and download of files, sharing the connection pool of `client`.
+
     example:
 
     ```python
@@ -59,19 +210,21 @@ class OpenAIFile:
 
     _client: OpenAI
 
-    def __init__(self, client: OpenAI):
+    def __init__(
+        self,
+        client: OpenAI,
+        http_client: httpx.Client | None = None,
+        bucket: str = "api",
+    ):
         self._client = client
 
-        self.session = rq.sessions.Session()
-
-    def _upload_base_url(self) -> str:
-        return str(self._client.base_url.join("/files"))
-
-    def _retrieve_base_url(self, file_id: str) -> str:
-        return str(self._client.base_url.join(f"/files/{file_id}/content"))
+        self.http_client = http_client or create_http_client()
+        # shared rate limit of the credential of `client`, see `ratelimit`
+        self.bucket = bucket
 
-    def _retrieve_meta_base_url(self, file_id: str) -> str:
-        return str(self._client.base_url.join(f"/files/{file_id}"))
+    def _url(self, path: str) -> str:
+        # `base_url` of the OpenAI client always ends with a slash
+        return str(self._client.base_url.join(path))
 
     @property
     def _auth_headers(self):
@@ -82,68 +235,143 @@ class OpenAIFile:
         file: IO[bytes],
         purpose: Literal["assistants", "batch", "fine-tune", "vision"],
         on_upload_chunk: Callable[[UploadStatus], None] | None = None,
+        size: int | None = None,
+        filename: str | None = None,
+        chunk_size: int | None = None,
     ) -> FileObject:
-        file_size = check_file_size(file)
-
-        data = MultipartEncoder(
-            {
-                "file": file,
-                "purpose": purpose,
-            }
-        )
-
-        def handle_monitor(monitor: MultipartEncoderMonitor):
+        """
+        Upload `file`, `size` is read by seeking to the end of `file` if not given,
+        which requires `file` to be seekable.
+
+        Failed uploads are retried from the start of `file` if it is seekable.
+        Regular files are sent from a memory map unless `transfer.mmap_upload`
+        is disabled.
+        """
+
+        file_size = size if size is not None else check_file_size(file)
+        filename = filename or os.path.basename(str(getattr(file, "name", "file")))
+        chunk_size = chunk_size or global_config.transfer.upload_chunk_size
+        seekable = file.seekable()
+        start = file.tell() if seekable else 0
+
+        def handle_chunk(sent: int):
             assert on_upload_chunk is not None
-            on_upload_chunk(
-                UploadStatus(
-                    current=monitor.bytes_read,
-                    total=file_size,
-                )
+            on_upload_chunk(UploadStatus(current=sent, total=file_size))
+
+        def post() -> FileObject:
+            if seekable:
+                file.seek(start)
+
+            body = _MultipartBody(
+                fields={"purpose": purpose},
+                filename=filename,
+                file=file,
+                size=file_size,
+                chunk_size=chunk_size,
+                on_chunk=handle_chunk if on_upload_chunk else None,
+                start=start,
+                mapped=global_config.transfer.mmap_upload,
+            )
+            resp = self.http_client.post(
+                self._url("files"),
+                content=iter(body),
+                headers={
+                    "Content-Type": body.content_type,
+                    "Content-Length": str(len(body)),
+                    **self._auth_headers,
+                },
             )
+            resp.raise_for_status()
 
-        if on_upload_chunk:
-            data = MultipartEncoderMonitor(data, handle_monitor)
+            return FileObject.model_validate_json(resp.content)
 
-        resp = self.session.post(
-            self._upload_base_url(),
-            data=data,
-            headers={
-                "Content-Type": data.content_type,
-                **self._auth_headers,
-            },
+        return retrying(
+            "files.upload",
+            post,
+            max_retries=None if seekable else 0,
+            bucket=self.bucket,
         )
 
-        return FileObject.model_validate(resp.json())
+    @contextlib.contextmanager
+    def _content(self, file_id: str) -> Iterator[tuple[httpx.Response, int]]:
+        """Streamed response of the content of the file, and its size."""
+
+        request = self.http_client.build_request(
+            "GET",
+            self._url(f"files/{file_id}/content"),
+            headers={"Accept-Encoding": "gzip", **self._auth_headers},
+        )
+
+        def send() -> httpx.Response:
+            resp = self.http_client.send(request, stream=True)
+            try:
+                resp.raise_for_status()
+            except httpx.HTTPStatusError:
+                resp.close()
+                raise
+            return resp
+
+        resp = retrying("files.content", send, bucket=self.bucket)
+        try:
+            if (length := resp.headers.get("Content-Length")) is not None:
+                total = int(length)
+            else:  # chunked transfer, only the metadata knows the size
+                total = self.retrieve_meta(file_id).bytes
+
+            yield resp, total
+        finally:
+            resp.close()
 
     def retrieve(
         self,
         file_id: str,
-        chunk_size: int = DEFAULT_RETRIEVE_CHUNK_SIZE,
+        chunk_size: int | None = None,
     ) -> Iterable[RetrieveChunk]:
-        meta = self.retrieve_meta(file_id)
-        resp = self.session.get(
-            self._retrieve_base_url(file_id),
-            params={"file_id": file_id},
-            stream=True,
-            headers=self._auth_headers,
-        )
+        """
+        Stream lines of the file. Progress is counted in bytes received, which
+        are compressed if the server compresses the transfer.
+        """
+
+        chunk_size = chunk_size or global_config.transfer.download_chunk_size
+        with self._content(file_id) as (resp, total):
+            for line in iter_lines(resp.iter_bytes(chunk_size)):
+                yield RetrieveChunk(
+                    current=min(resp.num_bytes_downloaded, total),
+                    total=total,
+                    line=line.decode(),
+                )
 
-        current = 0
-        total = int(meta.bytes)
-        for line in resp.iter_lines(
-            chunk_size=chunk_size,
-            decode_unicode=True,
-        ):
-            current += len(line)
-            yield RetrieveChunk(
-                current=current,
-                total=total,
-                line=line,
-            )
+    def retrieve_to(
+        self,
+        file_id: str,
+        dst: IO[bytes],
+        on_chunk: Callable[[StreamChunk], None] | None = None,
+        chunk_size: int | None = None,
+    ) -> int:
+        """Write the content of the file to `dst`, return the bytes received."""
+
+        chunk_size = chunk_size or global_config.transfer.download_chunk_size
+        with self._content(file_id) as (resp, total):
+            for chunk in resp.iter_bytes(chunk_size):
+                dst.write(chunk)
+                if on_chunk is not None:
+                    on_chunk(
+                        StreamChunk(
+                            current=min(resp.num_bytes_downloaded, total),
+                            total=total,
+                        )
+                    )
+
+            return resp.num_bytes_downloaded
 
     def retrieve_meta(self, file_id: str) -> FileObject:
-        resp = self.session.get(
-            self._retrieve_meta_base_url(file_id),
-            headers=self._auth_headers,
-        )
-        return FileObject.model_validate(resp.json())
+        def get() -> httpx.Response:
+            resp = self.http_client.get(
+                self._url(f"files/{file_id}"),
+                headers=self._auth_headers,
+            )
+            resp.raise_for_status()
+            return resp
+
+        resp = retrying("files.retrieve", get, bucket=self.bucket)
+        return FileObject.model_validate_json(resp.content)
@@ -0,0 +1,112 @@
+"""
+Parsing of output files on several cores.
+
+An output file downloaded to disk is split at line boundaries into ranges of
+about `RANGE_SIZE` bytes. Worker processes parse the lines of each range with
+the JSON parser of pydantic-core into `BatchOutputItem`s, which are yielded in
+the order of the file, at most `2 * workers` ranges ahead of the consumer.
+"""
+
+import collections
+from concurrent.futures import Executor, Future
+from pathlib import Path
+from typing import Any, Iterator
+
+from .const import CHUNK_SIZE, M
+from .model import BatchOutputItem, BatchRequestOutputItem
+
+RANGE_SIZE = 8 * M
+"""Bytes of output parsed by a worker at once"""
+
+# outputs are sent back as tuples, lighter to pickle than models
+FIELDS = tuple(BatchOutputItem.model_fields)
+
+
+def line_offset(path: Path, lines: int) -> int:
+    """Byte offset of line `lines` of the file, without parsing the lines before."""
+
+    offset = 0
+    with path.open("rb") as f:
+        while lines > 0 and (chunk := f.read(CHUNK_SIZE)):
+            count = chunk.count(b"\n")
+            if count < lines:
+                lines -= count
+                offset += len(chunk)
+                continue
+
+            # the end of the `lines`-th line in this chunk
+            end = -1
+            for _ in range(lines):
+                end = chunk.index(b"\n", end + 1)
+            return offset + end + 1
+
+    return offset
+
+
+def split(path: Path, start: int = 0, size: int = RANGE_SIZE) -> list[tuple[int, int]]:
+    """Ranges of about `size` bytes of the file from `start`, ending at line ends."""
+
+    total = path.stat().st_size
+    ranges = []
+    with path.open("rb") as f:
+        while start < total:
+            end = min(start + size, total)
+            if end < total:
+                # extend the range to the end of its last line
+                f.seek(end)
+                end += len(f.readline())
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def parse_range(path: Path, start: int, end: int) -> list[tuple[Any, ...]]:
+    """Field values of the outputs of the lines between bytes `start` and `end`."""
+
+    with path.open("rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    outputs = []
+    for line in data.splitlines():
+        if not line:
+            continue
+        output = BatchRequestOutputItem.model_validate_json(line).to_output()
+        outputs.append(tuple(getattr(output, name) for name in FIELDS))
+
+    return outputs
+
+
+def parse_file(
+    path: Path,
+    executor: Executor,
+    workers: int,
+    start: int = 0,
+) -> Iterator[BatchOutputItem]:
+    """Outputs of the lines of the file from byte `start`, in order."""
+
+    ranges = iter(split(path, start))
+    in_flight: collections.deque[Future] = collections.deque()
+
+    def submit() -> bool:
+        if (bounds := next(ranges, None)) is None:
+            return False
+        in_flight.append(executor.submit(parse_range, path, *bounds))
+        return True
+
+    while len(in_flight) < 2 * workers and submit():
+        pass
+
+    try:
+        while in_flight:
+            values = in_flight.popleft().result()
+            submit()
+            for value in values:
+                # validated by the worker
+                yield BatchOutputItem.model_construct(
+                    **dict(zip(FIELDS, value, strict=True))
+                )
+    finally:
+        for future in in_flight:
+            future.cancel()
@@ -0,0 +1,94 @@
+"""
+Stages of pipelined downloads, each running in its own thread and connected to
+the next one by a bounded queue, so that a slow network does not stall the
+`download` callback and a slow callback stalls the network only once the
+queues are full.
+
+```python
+lines = stage("fetch", fetch_lines(), maxsize=1024)
+outputs = stage("parse", parse(lines), maxsize=1024)
+for output in outputs:  # delivered on the calling thread
+    ...
+```
+
+Each stage counts the items it produced, the time it was blocked by a full
+queue and the time its consumer waited for an empty one in `metrics`.
+"""
+
+import contextvars
+import queue
+import threading
+import time
+from typing import Iterable, Iterator
+
+from . import metrics
+
+# checks for the other side between waits on a queue, in seconds
+POLL_INTERVAL = 0.1
+
+
+class _End:
+    def __init__(self, error: BaseException | None = None):
+        self.error = error
+
+
+def stage[T](name: str, source: Iterable[T], maxsize: int) -> Iterator[T]:
+    """
+    Produce the items of `source` in a thread, at most `maxsize` ahead of the
+    consumer. Errors of `source` are raised to the consumer, and the thread
+    stops when the consumer closes the iterator.
+    """
+
+    items: queue.Queue[T | _End] = queue.Queue(maxsize)
+    closed = threading.Event()
+
+    def put(item: T | _End) -> bool:
+        start = time.perf_counter()
+        try:
+            while not closed.is_set():
+                try:
+                    items.put(item, timeout=POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            metrics.stage_blocked.inc(time.perf_counter() - start, stage=name)
+
+    def produce():
+        try:
+            for item in source:
+                if not put(item):
+                    return
+                metrics.stage_items.inc(stage=name)
+        except BaseException as e:
+            put(_End(e))
+        else:
+            put(_End())
+        finally:
+            if (close := getattr(source, "close", None)) is not None:
+                close()
+
+    # the stage reports progress and timings of the work of the consumer
+    thread = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(produce,),
+        name=f"stage-{name}",
+        daemon=True,
+    )
+    thread.start()
+    try:
+        while True:
+            start = time.perf_counter()
+            item = items.get()
+            metrics.stage_starved.inc(time.perf_counter() - start, stage=name)
+
+            if isinstance(item, _End):
+                if item.error is not None:
+                    raise item.error
+                return
+
+            yield item
+    finally:
+        closed.set()
+        thread.join()
@@ -0,0 +1,200 @@
+"""
+Checks of the request lines of the shards of a work before they are uploaded,
+so that a malformed line is reported at once instead of after the provider
+validated the batch, which can take hours.
+
+Shards are checked in parallel, one process per shard. Every line must be a
+JSON request to the endpoint of the work, with a body of that endpoint, a model
+among `PreflightConfig.models` and a `custom_id` unique across all shards,
+within the size and token limits of the config.
+"""
+
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+from . import tracing
+from .const import CHUNK_SIZE
+from .exception import OpenAIBatchException
+from .model import Compression, Endpoint, PreflightConfig, WorkConfig
+from .shard import BYTES_PER_TOKEN, Shard, ShardArchive
+from .utils import iter_lines, process_pool
+
+logger = logging.getLogger(__name__)
+
+# fields an endpoint requires in the body
+REQUIRED_FIELDS: dict[str, tuple[str, ...]] = {
+    "/v1/chat/completions": ("model", "messages"),
+    "/v1/embeddings": ("model", "input"),
+    "/v1/completions": ("model", "prompt"),
+}
+
+
+@dataclass(frozen=True)
+class PreflightError:
+    shard: str
+    line: int
+    """1-based line number in the shard"""
+    custom_id: str | None
+    message: str
+
+    def __str__(self) -> str:
+        custom_id = f" ({self.custom_id})" if self.custom_id is not None else ""
+        return f"{self.shard}:{self.line}{custom_id}: {self.message}"
+
+
+@dataclass
+class ShardReport:
+    shard: str
+    ids: list[str | None] = field(default_factory=list)
+    """`custom_id` of each line checked, None if it has none"""
+    errors: list[PreflightError] = field(default_factory=list)
+
+
+def check_line(
+    line: bytes,
+    endpoint: Endpoint,
+    config: PreflightConfig,
+) -> tuple[str | None, str | None]:
+    """`custom_id` of the request `line` and what is wrong with it, if anything."""
+
+    if config.max_line_size is not None and len(line) > config.max_line_size:
+        return None, f"line of {len(line)} bytes over {config.max_line_size}"
+
+    try:
+        request: Any = json.loads(line)
+    except ValueError as e:
+        return None, f"invalid JSON: {e}"
+
+    if not isinstance(request, dict):
+        return None, "request is not a JSON object"
+
+    custom_id = request.get("custom_id")
+    if not isinstance(custom_id, str) or not custom_id:
+        return None, "missing custom_id"
+
+    if request.get("method") != "POST":
+        return custom_id, f"method {request.get('method')!r} is not POST"
+    if request.get("url") != endpoint:
+        return custom_id, f"url {request.get('url')!r} is not {endpoint}"
+
+    body = request.get("body")
+    if not isinstance(body, dict):
+        return custom_id, "body is not a JSON object"
+    if missing := [name for name in REQUIRED_FIELDS[endpoint] if name not in body]:
+        return custom_id, f"body misses {', '.join(missing)} for {endpoint}"
+
+    model = body["model"]
+    if config.models is not None and model not in config.models:
+        return custom_id, f"model {model!r} is not one of {config.models}"
+    # embedding models are only served by the embeddings endpoint
+    if "embedding" in str(model) and endpoint != "/v1/embeddings":
+        return custom_id, f"model {model!r} does not serve {endpoint}"
+
+    if config.max_request_tokens is not None:
+        tokens = len(line) // BYTES_PER_TOKEN + (body.get("max_tokens") or 0)
+        if tokens > config.max_request_tokens:
+            return custom_id, (
+                f"about {tokens} tokens with max_tokens, "
+                f"over {config.max_request_tokens}"
+            )
+
+    return custom_id, None
+
+
+def check_shard(
+    root: Path,
+    compression: Compression,
+    shard: Shard,
+    endpoint: Endpoint,
+    config: PreflightConfig,
+) -> ShardReport:
+    """Check the lines of `shard`, stopping after `config.max_errors` errors."""
+
+    report = ShardReport(shard=shard.name)
+    archive = ShardArchive(root, compression=compression)
+    with archive.open(shard) as reader:
+        chunks = iter(partial(reader.read, CHUNK_SIZE), b"")
+        # empty lines are checked too, so numbers match the lines of the shard
+        lines = iter_lines(chunks, keep_empty=True)
+        for number, line in enumerate(lines, 1):
+            custom_id, error = check_line(line, endpoint, config)
+            report.ids.append(custom_id)
+            if error is not None:
+                report.errors.append(
+                    PreflightError(shard.name, number, custom_id, error)
+                )
+                if len(report.errors) >= config.max_errors:
+                    break
+
+    return report
+
+
+def _duplicates(reports: list[ShardReport]) -> list[PreflightError]:
+    """Lines whose `custom_id` was used by an earlier line of any shard."""
+
+    seen: dict[str, tuple[str, int]] = {}
+    errors: list[PreflightError] = []
+    for report in reports:
+        for number, custom_id in enumerate(report.ids, 1):
+            if custom_id is None:
+                continue
+            first = seen.get(custom_id)
+            if first is None:
+                seen[custom_id] = (report.shard, number)
+            else:
+                errors.append(
+                    PreflightError(
+                        report.shard,
+                        number,
+                        custom_id,
+                        f"duplicate custom_id, first at {first[0]}:{first[1]}",
+                    )
+                )
+
+    return errors
+
+
+def preflight(config: WorkConfig, archive: ShardArchive) -> None:
+    """
+    Check every request of `archive` against `config.preflight`, raising an
+    `OpenAIBatchException` listing the first errors if any.
+    """
+
+    if (preflight_config := config.preflight) is None:
+        return
+
+    shards = archive.shards
+    args = [
+        (archive.root, archive.compression, shard, config.endpoint, preflight_config)
+        for shard in shards
+    ]
+    workers = min(len(shards), preflight_config.workers or os.cpu_count() or 1)
+
+    with tracing.span("preflight") as span:
+        if (pool := process_pool(workers)) is None:
+            reports = [check_shard(*arg) for arg in args]
+        else:
+            with pool:
+                reports = list(pool.map(check_shard, *zip(*args, strict=True)))
+
+        span.items = sum(shard.lines for shard in shards)
+        span.bytes = sum(shard.size for shard in shards)
+
+    errors = [error for report in reports for error in report.errors]
+    errors.extend(_duplicates(reports))
+    if not errors:
+        logger.info(f"Preflight passed for {span.items} requests")
+        return
+
+    shown = errors[: preflight_config.max_errors]
+    more = len(errors) - len(shown)
+    raise OpenAIBatchException(
+        f"Preflight found {len(errors)} invalid requests, nothing was uploaded:\n"
+        + "\n".join(str(error) for error in shown)
+        + (f"\n... and {more} more" if more else "")
+    )
@@ -0,0 +1,258 @@
+"""
+Push-based progress of running works.
+
+Worker processes publish progress events as datagrams to every dashboard
+socket in `config_dir/watch/`, so dashboards get sub-second updates without
+polling the database. Publishing never blocks: events are dropped when no
+dashboard is listening, and are throttled to one per `interval` for each phase.
+
+Unix domain datagram sockets are unavailable on Windows, where reporting is a no-op.
+"""
+
+import contextlib
+import contextvars
+import errno
+import json
+import os
+import select
+import socket
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Literal
+
+from .config import config_dir
+
+WATCH_DIR = config_dir / "watch"
+SUPPORTED = hasattr(socket, "AF_UNIX") and os.name != "nt"
+
+type EventKind = Literal["progress", "exit"]
+
+
+class Reporter:
+    """Publish progress events of the work `work_id` from this process."""
+
+    def __init__(
+        self,
+        work_id: int,
+        interval: float = 0.1,
+        directory: Path = WATCH_DIR,
+    ):
+        self.work_id = work_id
+        self.interval = interval
+        self.directory = directory
+
+        self._socket: socket.socket | None = None
+        if SUPPORTED:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+
+        self._last_sent: dict[str, float] = {}
+        self._targets: list[str] = []
+        self._targets_listed = 0.0
+
+    def _list_targets(self) -> list[str]:
+        # dashboards come and go, look for them at most once per second
+        now = time.monotonic()
+        if now - self._targets_listed > 1:
+            self._targets_listed = now
+            try:
+                self._targets = [str(path) for path in self.directory.glob("*.sock")]
+            except OSError:
+                self._targets = []
+
+        return self._targets
+
+    def _send(self, event: dict[str, Any]):
+        if self._socket is None or not (targets := self._list_targets()):
+            return
+
+        data = json.dumps(event).encode()
+        for target in targets:
+            try:
+                self._socket.sendto(data, target)
+            except OSError as e:
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    # the dashboard is gone
+                    self._targets.remove(target)
+                # EAGAIN: the dashboard is busy, drop the event
+
+    def report(
+        self,
+        phase: str,
+        current: int,
+        total: int | None = None,
+        unit: str = "B",
+    ):
+        now = time.monotonic()
+        done = total is not None and current >= total
+        if not done and now - self._last_sent.get(phase, 0) < self.interval:
+            return
+
+        self._last_sent[phase] = now
+        self._send(
+            {
+                "kind": "progress",
+                "work_id": self.work_id,
+                "pid": os.getpid(),
+                "phase": phase,
+                "current": current,
+                "total": total,
+                "unit": unit,
+                "time": time.time(),
+            }
+        )
+
+    def close(self):
+        self._send(
+            {
+                "kind": "exit",
+                "work_id": self.work_id,
+                "pid": os.getpid(),
+                "time": time.time(),
+            }
+        )
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+_reporter: contextvars.ContextVar[Reporter | None] = contextvars.ContextVar(
+    "reporter",
+    default=None,
+)
+
+
+@contextlib.contextmanager
+def reporting(work_id: int):
+    """Publish progress reported in the block as progress of work `work_id`."""
+
+    reporter = Reporter(work_id)
+    token = _reporter.set(reporter)
+    try:
+        yield reporter
+    finally:
+        _reporter.reset(token)
+        reporter.close()
+
+
+def report(phase: str, current: int, total: int | None = None, unit: str = "B"):
+    """Report progress of the current work, no-op outside of `reporting`."""
+
+    if (reporter := _reporter.get()) is not None:
+        reporter.report(phase, current, total, unit)
+
+
+class Listener:
+    """Receive progress events, as a dashboard."""
+
+    def __init__(self, directory: Path = WATCH_DIR):
+        if not SUPPORTED:
+            raise NotImplementedError("Progress events require Unix domain sockets")
+
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / f"{os.getpid()}.sock"
+        self.path.unlink(missing_ok=True)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(str(self.path))
+        self._socket.setblocking(False)
+
+    def receive(self, timeout: float) -> list[dict[str, Any]]:
+        """Wait up to `timeout` seconds for events, return all pending ones."""
+
+        events: list[dict[str, Any]] = []
+        readable, _, _ = select.select([self._socket], [], [], timeout)
+        while readable:
+            try:
+                data = self._socket.recv(65536)
+            except BlockingIOError:
+                break
+            events.append(json.loads(data))
+
+        return events
+
+    def close(self):
+        self._socket.close()
+        self.path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "Listener":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+@dataclass
+class PhaseProgress:
+    phase: str
+    current: int
+    total: int | None
+    unit: str
+    updated: float
+    rate: float = 0.0
+    """Exponential moving average of progress per second"""
+
+    @property
+    def eta(self) -> float | None:
+        """Seconds until done, None if unknown"""
+
+        if self.total is None or self.rate <= 0:
+            return None
+
+        return max(self.total - self.current, 0) / self.rate
+
+
+@dataclass
+class WorkProgress:
+    work_id: int
+    name: str | None = None
+    status: str | None = None
+    processes: dict[int, PhaseProgress] = field(default_factory=dict)
+
+
+class Board:
+    """Latest progress of every work, built from progress events."""
+
+    def __init__(self, smoothing: float = 0.3):
+        self.smoothing = smoothing
+        self.works: dict[int, WorkProgress] = {}
+
+    def add_work(self, work_id: int, name: str | None, status: str | None):
+        work = self.works.setdefault(work_id, WorkProgress(work_id))
+        work.name = name
+        work.status = status
+
+    def update(self, events: Iterable[dict[str, Any]]):
+        for event in events:
+            work = self.works.setdefault(
+                event["work_id"],
+                WorkProgress(event["work_id"]),
+            )
+            pid = event["pid"]
+
+            if event["kind"] == "exit":
+                work.processes.pop(pid, None)
+                continue
+
+            prev = work.processes.get(pid)
+            progress = PhaseProgress(
+                phase=event["phase"],
+                current=event["current"],
+                total=event["total"],
+                unit=event["unit"],
+                updated=event["time"],
+            )
+            if prev is not None and prev.phase == progress.phase:
+                elapsed = progress.updated - prev.updated
+                if elapsed > 0:
+                    rate = (progress.current - prev.current) / elapsed
+                    progress.rate = (
+                        self.smoothing * rate + (1 - self.smoothing) * prev.rate
+                        if prev.rate
+                        else rate
+                    )
+                else:
+                    progress.rate = prev.rate
+
+            work.processes[pid] = progress
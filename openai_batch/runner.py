@@ -9,6 +9,7 @@ from typing import Any, Iterable
 import pidfile
 from rich.console import Console
 
+from . import metrics, progress
 from .config import config_dir
 from .const import TO_STATUS, WORK_ID
 from .db import schema, works_db
@@ -16,6 +17,8 @@ from .model import (
     BatchErrorItem,
     BatchInputItem,
     BatchOutputItem,
+    EmbeddingInputItem,
+    TemplateInputItem,
     WorkConfig,
 )
 from .status.status import to_status
@@ -48,7 +51,7 @@ class OpenAIBatchRunner(metaclass=_RunnerMeta):
 
     @staticmethod
     @abstractmethod
-    def upload() -> Iterable[BatchInputItem]:
+    def upload() -> Iterable[BatchInputItem | EmbeddingInputItem | TemplateInputItem]:
         """
         Transform your own dataset into OpenAI Batch input format.
         """
@@ -68,6 +71,16 @@ class OpenAIBatchRunner(metaclass=_RunnerMeta):
 
         return
 
+    @staticmethod
+    def flush() -> None:
+        """
+        Make the outputs received by `download` and `download_error` durable,
+        called before their progress is checkpointed. Outputs received since
+        the last checkpoint are delivered again if the check fails.
+        """
+
+        return
+
     @classmethod
     def run(cls):
         match os.environ.get(WORK_ID):
@@ -84,7 +97,11 @@ class OpenAIBatchRunner(metaclass=_RunnerMeta):
 
         pidfile_path = config_dir / f"{work.id}-{timestamp()}.pid"
 
-        with pidfile.PIDFile(pidfile_path):
+        with (
+            pidfile.PIDFile(pidfile_path),
+            metrics.exporting(work.id),
+            progress.reporting(work.id),
+        ):
             status = (
                 schema.WorkStatus(status)
                 if (status := os.environ.get(TO_STATUS))
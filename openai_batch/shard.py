@@ -0,0 +1,325 @@
+import contextlib
+import gzip
+import io
+import json
+import re
+import shutil
+import threading
+from dataclasses import asdict, dataclass
+from functools import partial
+from pathlib import Path
+from typing import IO, Callable
+
+from .config import global_config
+from .const import CHUNK_SIZE, MAX_FILE_SIZE
+from .exception import OpenAIBatchException
+from .model import Compression
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+_SUFFIXES: dict[Compression, str] = {
+    "none": ".jsonl",
+    "gzip": ".jsonl.gz",
+    "zstd": ".jsonl.zst",
+}
+
+MANIFEST = "manifest.json"
+
+BYTES_PER_TOKEN = 4
+
+UPLOAD_NAME = re.compile(r"shard-\d{5}\.jsonl")
+"""Name shards are uploaded with, see `ShardReader.name`"""
+
+
+@dataclass(frozen=True)
+class Shard:
+    name: str
+    size: int
+    """Uncompressed size in bytes, which is the size uploaded"""
+    lines: int
+
+    @property
+    def tokens(self) -> int:
+        """Estimated input tokens, a token per 4 bytes of requests overestimates them"""
+
+        return self.size // BYTES_PER_TOKEN
+
+
+class ShardReader:
+    """
+    Stream of the decompressed bytes of a shard.
+
+    The stream can only be rewound, by opening the shard again, to retry an upload.
+    """
+
+    def __init__(self, shard: Shard, opener: Callable[[], IO[bytes]], on_close):
+        self.shard = shard
+        self.name = shard.name.split(".")[0] + ".jsonl"
+        self._opener = opener
+        self._stream = opener()
+        self._on_close = on_close
+        self._read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self._read += len(data)
+        return data
+
+    def seekable(self) -> bool:
+        """
+        True, as `OpenAIFile.upload` only retries uploads of seekable files, but
+        `seek` can only rewind to the start of the shard: the reader must be
+        uploaded from its start.
+        """
+
+        return True
+
+    def tell(self) -> int:
+        return self._read
+
+    def fileno(self) -> int:
+        """File descriptor of an uncompressed shard, which is sent as is"""
+
+        if not self.shard.name.endswith(_SUFFIXES["none"]):
+            raise io.UnsupportedOperation("compressed shards have no raw file")
+
+        return self._stream.fileno()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if (offset, whence) != (0, io.SEEK_SET):
+            raise io.UnsupportedOperation("shards can only be rewound")
+
+        if self._read:
+            self._stream.close()
+            self._stream = self._opener()
+            self._read = 0
+
+        return 0
+
+    def close(self):
+        if self._on_close is not None:
+            self._stream.close()
+            self._on_close()
+            self._on_close = None
+
+    def __enter__(self) -> "ShardReader":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class ShardWriter:
+    """
+    Split written lines into compressed shards of at most `max_size` uncompressed bytes.
+
+    Only the shard being written is open.
+    """
+
+    def __init__(self, archive: "ShardArchive", max_size: int = MAX_FILE_SIZE):
+        self.archive = archive
+        self.max_size = max_size
+        self.shards: list[Shard] = []
+
+        self._stream: IO[bytes] | None = None
+        self._name = ""
+        self._size = 0
+        self._lines = 0
+
+    def _roll(self):
+        self.close()
+        self._name = (
+            f"shard-{len(self.shards):05d}{_SUFFIXES[self.archive.compression]}"
+        )
+        self._stream = self.archive._open_write(self._name)
+        self._size = 0
+        self._lines = 0
+
+    def write(self, line: bytes):
+        if self._stream is None or self._size + len(line) > self.max_size:
+            self._roll()
+
+        assert self._stream is not None
+        self._stream.write(line)
+        self._size += len(line)
+        self._lines += 1
+
+    def close(self) -> list[Shard]:
+        if self._stream is not None:
+            self._stream.close()
+            self.shards.append(
+                Shard(name=self._name, size=self._size, lines=self._lines)
+            )
+            self._stream = None
+
+        return self.shards
+
+
+class ShardArchive:
+    """
+    Compressed batch input shards of a work, kept on disk until the work is done,
+    so that a retried upload does not have to regenerate the input.
+
+    At most `max_open_files` shards are open for reading at the same time,
+    `open` blocks until a reader is closed.
+
+    example:
+
+    ```python
+    archive = ShardArchive(path, compression="gzip")
+    with archive.writer() as writer:
+        writer.write(b"...\\n")
+    archive.commit(writer.shards, dataset_hash=None)
+
+    for shard in archive.shards:
+        with archive.open(shard) as reader:
+            reader.read()
+    ```
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        compression: Compression = "gzip",
+        max_open_files: int | None = None,
+        compress_level: int = 3,
+        work: str | None = None,
+    ):
+        if compression == "zstd" and zstandard is None:
+            raise OpenAIBatchException(
+                "zstd compression requires `zstandard`, "
+                "install it with `pip install openai-batch[zstd]`"
+            )
+
+        self.root = root
+        # `Work.uuid` of the work the shards are of, checked when they are reused
+        self.work = work
+        self.compression: Compression = compression
+        self.compress_level = compress_level
+        self.shards: list[Shard] = []
+        self.dataset_hash: str | None = None
+
+        self._slots = threading.BoundedSemaphore(
+            max_open_files or global_config.max_open_shards
+        )
+
+    @classmethod
+    def of_work(cls, work: str, **kwargs) -> "ShardArchive":
+        """Archive of the work of `Work.uuid`, ids are reused after a delete"""
+
+        return cls(Path(global_config.save_path) / "shards" / work, work=work, **kwargs)
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self.root / MANIFEST
+
+    @property
+    def committed(self) -> bool:
+        return self._manifest_path.exists()
+
+    @property
+    def size(self) -> int:
+        """Size of all shards on disk"""
+
+        return sum((self.root / shard.name).stat().st_size for shard in self.shards)
+
+    def load(self) -> bool:
+        """Load shards of a previous transform, return False if there is none."""
+
+        if not self.committed:
+            return False
+
+        manifest = json.loads(self._manifest_path.read_text())
+        if manifest.get("work") != self.work:
+            return False
+
+        self.compression = manifest["compression"]
+        self.dataset_hash = manifest["dataset_hash"]
+        self.shards = [Shard(**shard) for shard in manifest["shards"]]
+
+        return True
+
+    def commit(self, shards: list[Shard], dataset_hash: str | None):
+        """Mark shards as complete, they will be reused by later attempts."""
+
+        self.shards = shards
+        self.dataset_hash = dataset_hash
+
+        manifest = {
+            "work": self.work,
+            "compression": self.compression,
+            "dataset_hash": dataset_hash,
+            "shards": [asdict(shard) for shard in shards],
+        }
+        tmp_path = self._manifest_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest))
+        tmp_path.replace(self._manifest_path)
+
+    def remove(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.shards = []
+
+    @contextlib.contextmanager
+    def writer(self, max_size: int = MAX_FILE_SIZE):
+        # drop leftovers of an interrupted transform
+        self.remove()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        writer = ShardWriter(self, max_size=max_size)
+        try:
+            yield writer
+        finally:
+            writer.close()
+
+    def _open_write(self, name: str) -> IO[bytes]:
+        file = open(self.root / name, "wb", buffering=CHUNK_SIZE)
+        match self.compression:
+            case "none":
+                return file
+            case "gzip":
+                return _closing_gzip(file, "wb", self.compress_level)
+            case "zstd":
+                assert zstandard is not None
+                compressor = zstandard.ZstdCompressor(level=self.compress_level)
+                return compressor.stream_writer(file, closefd=True)
+
+    def _open_read(self, name: str) -> IO[bytes]:
+        file = open(self.root / name, "rb", buffering=CHUNK_SIZE)
+        match self.compression:
+            case "none":
+                return file
+            case "gzip":
+                return _closing_gzip(file, "rb")
+            case "zstd":
+                assert zstandard is not None
+                decompressor = zstandard.ZstdDecompressor()
+                return decompressor.stream_reader(file, closefd=True)
+
+    def open(self, shard: Shard) -> ShardReader:
+        self._slots.acquire()
+        try:
+            return ShardReader(
+                shard,
+                opener=partial(self._open_read, shard.name),
+                on_close=self._slots.release,
+            )
+        except BaseException:
+            self._slots.release()
+            raise
+
+
+def _closing_gzip(file: IO[bytes], mode: str, level: int = 9) -> IO[bytes]:
+    """GzipFile does not close a passed `fileobj`, close it along with the stream."""
+
+    stream = gzip.GzipFile(fileobj=file, mode=mode, compresslevel=level)
+    close = stream.close
+
+    def close_all():
+        close()
+        file.close()
+
+    stream.close = close_all  # type: ignore
+    return stream
@@ -0,0 +1,523 @@
+"""
+Offline evaluation of polling policies on recorded or synthetic timelines of
+batches.
+
+Works are checked by the `to_status` state machine as they would be in
+production, against a simulated Batch API that reports the status of each
+batch on its timeline at the time of a virtual clock:
+
+```python
+works = synthetic(1000, batches=4)
+for policy in (Cron(timedelta(hours=4)), Backoff(timedelta(minutes=5))):
+    print(simulate(works, policy))
+```
+
+Each report holds the latency between the end of each batch and the check
+detecting it, the calls made to the API and the processes launched by the
+scheduled tasks of the policy. Downloads are made of empty files, they cost
+the same whatever the policy.
+
+The simulation swaps the database and the API clients of the process for its
+own while it runs, it must not run alongside real works.
+"""
+
+import bisect
+import collections
+import contextlib
+import heapq
+import logging
+import math
+import random
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import ClassVar, Iterable, Iterator, Literal, Protocol, Sequence
+
+from openai.types import Batch
+from openai.types.batch_request_counts import BatchRequestCounts
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, create_engine
+
+from .db import schema, works_db
+from .model import BatchErrorItem, BatchInputItem, BatchOutputItem, WorkConfig
+from .openai import pool, ratelimit
+from .openai.upload import RetrieveChunk
+from .runner import OpenAIBatchRunner
+from .status.status import to_status
+
+# virtual time 0, batch timestamps of the API are seconds since the Unix epoch
+EPOCH = 1_700_000_000
+PAGE_SIZE = 100
+
+type FinalStatus = Literal["completed", "failed", "expired", "cancelled"]
+
+
+@dataclass(frozen=True)
+class Timeline:
+    """Phases of a batch on the provider, in seconds after its submission."""
+
+    ended_at: float
+    in_progress_at: float | None = None
+    finalizing_at: float | None = None
+    status: FinalStatus = "completed"
+    request_total: int = 0
+
+    def status_at(self, t: float) -> str:
+        if t >= self.ended_at:
+            return self.status
+        if self.finalizing_at is not None and t >= self.finalizing_at:
+            return "finalizing"
+        if self.in_progress_at is not None and t >= self.in_progress_at:
+            return "in_progress"
+        return "validating"
+
+
+@dataclass(frozen=True)
+class SimulatedWork:
+    """Batches of a work, all submitted `submitted_at` seconds of virtual time."""
+
+    batches: Sequence[Timeline]
+    submitted_at: float = 0
+
+
+class Policy(Protocol):
+    # checks launch a process each, or run in a long-lived one
+    in_process: ClassVar[bool]
+
+    def next_check(self, now: float, submitted_at: float, checks: int) -> float:
+        """Virtual time of the next check of a work checked `checks` times"""
+        ...
+
+
+@dataclass(frozen=True)
+class Cron:
+    """
+    Checks by a scheduled task every `interval`, at multiples of it as
+    crontab does, as `WorkConfig.check_interval`.
+    """
+
+    interval: timedelta
+    in_process: ClassVar[bool] = False
+
+    def __str__(self) -> str:
+        return f"cron every {self.interval}"
+
+    def next_check(self, now: float, submitted_at: float, checks: int) -> float:
+        step = self.interval.total_seconds()
+        return (math.floor(now / step) + 1) * step
+
+
+@dataclass(frozen=True)
+class Backoff:
+    """
+    Checks in process, `initial` after the submission and then `factor` times
+    longer each time, up to `maximum`.
+    """
+
+    initial: timedelta = timedelta(minutes=5)
+    factor: float = 2
+    maximum: timedelta = timedelta(hours=1)
+    in_process: ClassVar[bool] = True
+
+    def __str__(self) -> str:
+        return f"backoff from {self.initial} x{self.factor:g} up to {self.maximum}"
+
+    def next_check(self, now: float, submitted_at: float, checks: int) -> float:
+        interval = self.initial.total_seconds() * self.factor ** (checks - 1)
+        return now + min(interval, self.maximum.total_seconds())
+
+
+@dataclass
+class Report:
+    policy: Policy
+    works: int = 0
+    batches: int = 0
+    checks: int = 0
+    launches: int = 0
+    api_calls: collections.Counter[str] = field(default_factory=collections.Counter)
+    # seconds from the end of each batch to the check detecting it
+    latencies: list[float] = field(default_factory=list)
+
+    @property
+    def undetected(self) -> int:
+        """Batches not detected before the horizon"""
+
+        return self.batches - len(self.latencies)
+
+    def latency(self, quantile: float) -> float:
+        """Detection latency of the `quantile` of batches, in seconds"""
+
+        if not self.latencies:
+            return math.nan
+
+        latencies = sorted(self.latencies)
+        return latencies[min(int(quantile * len(latencies)), len(latencies) - 1)]
+
+    @property
+    def mean_latency(self) -> float:
+        if not self.latencies:
+            return math.nan
+
+        return sum(self.latencies) / len(self.latencies)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.policy}: {self.checks} checks, {self.launches} launches, "
+            f"{sum(self.api_calls.values())} API calls, latency mean "
+            f"{self.mean_latency:.0f}s p50 {self.latency(0.5):.0f}s "
+            f"p95 {self.latency(0.95):.0f}s max {self.latency(1):.0f}s, "
+            f"{self.undetected} undetected"
+        )
+
+
+# -------------------------------- simulated API ------------------------------- #
+
+
+def _batch_id(work: int, batch: int) -> str:
+    return f"batch_sim_{work}_{batch}"
+
+
+class _API:
+    """Batches and files of the simulated works, as of `now`."""
+
+    bucket = "simulation"
+
+    def __init__(self, works: Sequence[SimulatedWork]):
+        self.works = works
+        self.now = 0.0
+        self.calls: collections.Counter[str] = collections.Counter()
+
+        # batches by submission, listed most recent first
+        self._created = sorted(
+            (work.submitted_at, w, b)
+            for w, work in enumerate(works)
+            for b in range(len(work.batches))
+        )
+        self._times = [created for created, _, _ in self._created]
+        # a batch changes with its status only
+        self._batches: dict[tuple[int, int, str], Batch] = {}
+
+    def batch(self, w: int, b: int) -> Batch:
+        work = self.works[w]
+        status = work.batches[b].status_at(self.now - work.submitted_at)
+        if (batch := self._batches.get((w, b, status))) is None:
+            batch = self._batches[w, b, status] = self._batch(w, b, status)
+
+        return batch
+
+    def _batch(self, w: int, b: int, status: str) -> Batch:
+        work = self.works[w]
+        timeline = work.batches[b]
+        ended = status == timeline.status
+
+        def at(offset: float | None) -> int | None:
+            if offset is None or work.submitted_at + offset > self.now:
+                return None
+            return EPOCH + int(work.submitted_at + offset)
+
+        total = timeline.request_total
+        succeeded = ended and status == "completed"
+        completed = total if succeeded else 0
+        return Batch.model_construct(
+            id=_batch_id(w, b),
+            object="batch",
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            input_file_id=f"file-sim-input-{w}-{b}",
+            status=status,
+            created_at=EPOCH + int(work.submitted_at),
+            in_progress_at=at(timeline.in_progress_at),
+            finalizing_at=at(timeline.finalizing_at),
+            completed_at=at(timeline.ended_at) if status == "completed" else None,
+            failed_at=at(timeline.ended_at) if status == "failed" else None,
+            expired_at=at(timeline.ended_at) if status == "expired" else None,
+            cancelled_at=at(timeline.ended_at) if status == "cancelled" else None,
+            output_file_id=f"file-sim-output-{w}-{b}" if succeeded else None,
+            error_file_id=(
+                f"file-sim-error-{w}-{b}" if ended and not succeeded else None
+            ),
+            request_counts=BatchRequestCounts(
+                total=total, completed=completed, failed=total - completed
+            ),
+            errors=None,
+        )
+
+    # --------------------------- client.batches, file --------------------------- #
+
+    def list(self, limit: int = PAGE_SIZE) -> "_Page":
+        return _Page(self, bisect.bisect_right(self._times, self.now), 0, limit)
+
+    def retrieve(self, file_id: str) -> Iterator[RetrieveChunk]:
+        self.calls["files.content"] += 1
+        return iter(())
+
+
+@dataclass
+class _Page:
+    api: _API
+    visible: int
+    start: int
+    limit: int
+
+    def __post_init__(self):
+        self.api.calls["batches.list"] += 1
+        created = self.api._created
+        end = min(self.start + self.limit, self.visible)
+        self.data = [
+            self.api.batch(w, b)
+            for _, w, b in (
+                created[self.visible - 1 - idx] for idx in range(self.start, end)
+            )
+        ]
+
+    def has_next_page(self) -> bool:
+        return self.start + self.limit < self.visible
+
+    def get_next_page(self) -> "_Page":
+        return _Page(self.api, self.visible, self.start + self.limit, self.limit)
+
+
+class _Unlimited:
+    def acquire(self):
+        pass
+
+    def pause(self, seconds: float):
+        pass
+
+
+@contextlib.contextmanager
+def _sandbox(api: _API):
+    engine = create_engine(
+        "sqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    SQLModel.metadata.create_all(engine)
+
+    client = pool.Client(
+        name=pool.DEFAULT,
+        file=api,  # type: ignore
+        batches=api,  # type: ignore
+        files=api,  # type: ignore
+    )
+    engine, works_db.engine = works_db.engine, engine
+    client_of, pool.client = pool.client, lambda name=pool.DEFAULT: client
+    ratelimit._buckets[api.bucket] = _Unlimited()  # type: ignore
+    # failed batches are expected, and logged by every check
+    logger = logging.getLogger("openai_batch")
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        yield
+    finally:
+        works_db.engine = engine
+        pool.client = client_of  # type: ignore
+        del ratelimit._buckets[api.bucket]
+        logger.setLevel(level)
+
+
+class _SimulatedRunner(OpenAIBatchRunner):
+    # batches are deleted by clean up, not simulated
+    work_config = WorkConfig(allow_same_dataset=True, clean_up=False)
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        return []
+
+    @staticmethod
+    def download(output: Iterable[BatchOutputItem]):
+        for _ in output:
+            pass
+
+    @staticmethod
+    def download_error(output: Iterable[BatchErrorItem]):
+        for _ in output:
+            pass
+
+
+def _create(w: int, work: SimulatedWork) -> int:
+    db_work = works_db.create_work(
+        schema.Work(
+            name=f"simulated {w}",
+            status=schema.WorkStatus.Checked,
+            interpreter_path="",
+            work_dir="",
+            class_name=_SimulatedRunner.__name__,
+            script="",
+            # not registered as a scheduled task
+            config=_SimulatedRunner.work_config.model_dump(mode="json"),
+        )
+    )
+    assert db_work.id is not None
+
+    works_db.add_batches(
+        schema.Batch(
+            id=_batch_id(w, b),
+            work_id=db_work.id,
+            status="validating",
+            input_file_id=f"file-sim-input-{w}-{b}",
+        )
+        for b in range(len(work.batches))
+    )
+    return db_work.id
+
+
+def simulate(
+    works: Sequence[SimulatedWork],
+    policy: Policy,
+    horizon: timedelta = timedelta(days=3),
+) -> Report:
+    """
+    Check `works` by `policy` until they are completed, or until `horizon` of
+    virtual time after the last submission. The first check of a work runs when
+    it is submitted, by the process submitting it.
+    """
+
+    api = _API(works)
+    report = Report(
+        policy=policy,
+        works=len(works),
+        batches=sum(len(work.batches) for work in works),
+    )
+    end = max((work.submitted_at for work in works), default=0)
+    end += horizon.total_seconds()
+
+    with _sandbox(api):
+        work_ids = [_create(w, work) for w, work in enumerate(works)]
+        ended_at = {
+            _batch_id(w, b): work.submitted_at + timeline.ended_at
+            for w, work in enumerate(works)
+            for b, timeline in enumerate(work.batches)
+        }
+
+        checks = [0] * len(works)
+        events = [(work.submitted_at, w) for w, work in enumerate(works)]
+        heapq.heapify(events)
+        detected: set[str] = set()
+        while events:
+            now, w = heapq.heappop(events)
+            if now > end:
+                break
+
+            api.now = now
+            work = works_db.get_work(work_ids[w])
+            assert work is not None
+            work = to_status(work, schema.WorkStatus.Checked, _SimulatedRunner)
+
+            report.checks += 1
+            if checks[w] and not policy.in_process:
+                report.launches += 1
+            checks[w] += 1
+
+            for row in works_db.list_batches(work_ids[w], {schema.BatchState.Done}):
+                if row.id not in detected:
+                    detected.add(row.id)
+                    report.latencies.append(now - ended_at[row.id])
+
+            if work.status == schema.WorkStatus.Checked:
+                next_at = policy.next_check(now, works[w].submitted_at, checks[w])
+                heapq.heappush(events, (next_at, w))
+
+    report.api_calls = api.calls
+    return report
+
+
+# --------------------------------- timelines --------------------------------- #
+
+
+def recorded(work_id: int) -> SimulatedWork:
+    """
+    Timelines of the batches of work `work_id`, from the provider phases
+    recorded by its checks, or from the creation and end of its batches.
+    """
+
+    batches = works_db.list_batches(work_id)
+    if not batches:
+        return SimulatedWork(batches=[])
+    submitted = min(batch.created_at for batch in batches)
+
+    phases: dict[str, dict[str, float]] = collections.defaultdict(dict)
+    for span in works_db.list_spans(work_id):
+        match span.name.split(" "):
+            case ["batch", batch_id, phase]:
+                at = (span.started_at - submitted).total_seconds()
+                phases[batch_id][phase] = at
+                if span.ended_at is not None:
+                    ended = (span.ended_at - submitted).total_seconds()
+                    phases[batch_id]["ended"] = max(
+                        phases[batch_id].get("ended", 0), ended
+                    )
+
+    timelines = []
+    for batch in batches:
+        recorded = phases.get(batch.id, {})
+        ended_at = recorded.get("ended")
+        if ended_at is None and batch.ended_at is not None:
+            ended_at = (batch.ended_at - submitted).total_seconds()
+        if ended_at is None:  # not ended yet
+            continue
+
+        timelines.append(
+            Timeline(
+                ended_at=ended_at,
+                in_progress_at=recorded.get("in_progress"),
+                finalizing_at=recorded.get("finalizing"),
+                status=(
+                    batch.status
+                    if batch.status in ("failed", "expired", "cancelled")
+                    else "completed"
+                ),  # type: ignore
+                request_total=batch.request_total or 0,
+            )
+        )
+
+    return SimulatedWork(batches=timelines)
+
+
+def synthetic(
+    works: int,
+    batches: int = 4,
+    arrival: timedelta = timedelta(hours=24),
+    median: timedelta = timedelta(hours=2),
+    sigma: float = 1.0,
+    failure_rate: float = 0.02,
+    completion_window: timedelta = timedelta(hours=24),
+    seed: int = 0,
+) -> list[SimulatedWork]:
+    """
+    Works submitted uniformly over `arrival`, whose batches run for a
+    log-normal time of `median` and `sigma`, expiring after
+    `completion_window`, and failing at `failure_rate`.
+    """
+
+    rng = random.Random(seed)
+    window = completion_window.total_seconds()
+
+    def timeline() -> Timeline:
+        in_progress_at = rng.uniform(10, 300)
+        running = rng.lognormvariate(math.log(median.total_seconds()), sigma)
+        finalizing_at = in_progress_at + running
+        ended_at = finalizing_at + rng.uniform(30, 600)
+
+        if ended_at > window:
+            return Timeline(
+                ended_at=window, in_progress_at=in_progress_at, status="expired"
+            )
+        if rng.random() < failure_rate:
+            return Timeline(ended_at=in_progress_at, status="failed")
+        return Timeline(
+            ended_at=ended_at,
+            in_progress_at=in_progress_at,
+            finalizing_at=finalizing_at,
+            request_total=rng.randint(1, 50_000),
+        )
+
+    return sorted(
+        (
+            SimulatedWork(
+                batches=[timeline() for _ in range(batches)],
+                submitted_at=rng.uniform(0, arrival.total_seconds()),
+            )
+            for _ in range(works)
+        ),
+        key=lambda work: work.submitted_at,
+    )
@@ -0,0 +1,151 @@
+"""
+Snapshots of the batches of works, cached in the database so that `list` and
+`get` show the progress of works without calling the API.
+
+Every check of a work writes the latest state of its batches to their rows,
+and the time of the check to `Work.snapshot_at`. When the snapshot of a running
+work is older than `snapshot_ttl` seconds of the global config, `list` and
+`get` show it as is and start `refresh` in a background process: the unfinished
+batches of all the stale works are listed once per credential and their rows
+updated. Refreshing neither delivers outputs nor changes the status of works,
+that is left to their next check.
+
+```bash
+python -m openai_batch.snapshot 1 2 3
+```
+"""
+
+import logging
+import subprocess as sp
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, Sequence
+
+import pidfile
+
+from .config import config_dir, global_config
+from .db import schema, works_db
+
+logger = logging.getLogger(__name__)
+
+pidfile_path = config_dir / "snapshot.pid"
+
+
+@dataclass
+class Progress:
+    """Progress of a work as of the last snapshot of its batches"""
+
+    batches: int = 0
+    done: int = 0  # batches finished, their outputs or errors delivered
+    requests: int = 0  # of the batches validated by the provider
+    processed: int = 0  # requests completed or failed
+
+    @property
+    def ratio(self) -> float | None:
+        if self.requests:
+            return self.processed / self.requests
+        if self.batches:
+            return self.done / self.batches
+
+        return None
+
+
+def progress(works: Iterable[schema.Work]) -> dict[int, Progress]:
+    """Progress of each work, shards waiting to be submitted counted as batches"""
+
+    works = [work for work in works if work.id is not None]
+    counts = works_db.batch_progress([work.id for work in works])  # type: ignore
+
+    result = {}
+    for work in works:
+        assert work.id is not None
+        batches, done, requests, processed = counts.get(work.id, (0, 0, 0, 0))
+        result[work.id] = Progress(
+            batches=batches + len(work.pending_shards),
+            done=done,
+            requests=requests,
+            processed=processed,
+        )
+
+    return result
+
+
+def stale(works: Iterable[schema.Work], ttl: int | None = None) -> list[int]:
+    """Running works whose batches were not updated for `ttl` seconds"""
+
+    ttl = global_config.snapshot_ttl if ttl is None else ttl
+    if not ttl:
+        return []
+
+    expired = datetime.now() - timedelta(seconds=ttl)
+    return [
+        work.id
+        for work in works
+        if work.id is not None
+        and work.status in schema.RUNNING
+        and (work.snapshot_at is None or work.snapshot_at < expired)
+    ]
+
+
+def refresh(work_ids: Iterable[int]) -> int:
+    """
+    Update the rows of the unfinished batches of the works from one listing of
+    the batches of each credential, return the number of rows changed.
+    """
+
+    # imported here, the OpenAI client is only needed to refresh
+    from .status.checked import check, update
+
+    work_ids = sorted(set(work_ids))
+    rows = {
+        batch.id: batch
+        for work_id in work_ids
+        for batch in works_db.list_batches(work_id, {schema.BatchState.Undone})
+    }
+    result = check(rows, {id: batch.credential for id, batch in rows.items()})
+
+    changed = 0
+    snapshot_at = datetime.now()
+    with works_db.session() as session:
+        for status in result.statuses:
+            # rows are loaded again, a check may have finished them meanwhile
+            row = session.get(schema.Batch, status.batch_id)
+            if row is None or row.state != schema.BatchState.Undone:
+                continue
+            if update(row, status.batch):
+                changed += 1
+                session.add(row)
+
+        for work_id in work_ids:
+            if (work := session.get(schema.Work, work_id)) is not None:
+                work.snapshot_at = snapshot_at
+                session.add(work)
+
+    return changed
+
+
+def refresh_in_background(work_ids: Sequence[int]) -> bool:
+    """Start a process refreshing the works, unless one is running already."""
+
+    if not work_ids or pidfile.PIDFile(pidfile_path).is_running:
+        return False
+
+    sp.Popen(
+        [sys.executable, "-m", "openai_batch.snapshot", *map(str, work_ids)],
+        stdin=sp.DEVNULL,
+        stdout=sp.DEVNULL,
+        stderr=sp.DEVNULL,
+        # outlives the command that started it
+        start_new_session=True,
+    )
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        with pidfile.PIDFile(pidfile_path):
+            changed = refresh(int(arg) for arg in sys.argv[1:])
+            logger.info(f"Batches changed since the last snapshot: {changed}")
+    except pidfile.AlreadyRunningError:
+        pass
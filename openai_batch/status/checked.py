@@ -1,15 +1,24 @@
+import collections
+import contextvars
 import itertools
 import logging
-import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Iterable
+from datetime import datetime
+from functools import partial
+from typing import Iterable, Mapping
 
-import openai
+from openai.types import Batch
 
-from .. import runner
+from .. import metrics, runner, tracing
+from ..checkpoint import Checkpoint
 from ..db import schema
 from ..db.database import works_db
 from ..model import BatchStatus
+from ..openai import pool
+from ..openai.ratelimit import retrying
+from ..usage import Ledger
+from .created import submit_pending
 from .exception import StatusInterrupt
 from .utils import download, download_error
 
@@ -22,19 +31,54 @@ class CheckResult:
     not_found_ids: set[str]
 
 
-def check(batch_ids: Iterable[str]) -> CheckResult:
-    cursor = openai.batches.list(limit=100)
+def _list(client: pool.Client, batch_ids: set[str]) -> list[BatchStatus]:
+    """Statuses of `batch_ids` among the batches of `client`."""
+
     statuses: list[BatchStatus] = []
     batch_ids = set(batch_ids)
 
-    for batch in cursor:
-        if batch.id in batch_ids:
-            statuses.append(BatchStatus(batch=batch))
-            batch_ids.remove(batch.id)
+    page = retrying(
+        "batches.list",
+        partial(client.batches.list, limit=100),
+        bucket=client.bucket,
+    )
+    while True:
+        for batch in page.data:
+            if batch.id in batch_ids:
+                statuses.append(BatchStatus(batch=batch))
+                batch_ids.remove(batch.id)
 
-        if len(batch_ids) == 0:
+        if len(batch_ids) == 0 or not page.has_next_page():
             break
 
+        page = retrying("batches.list", page.get_next_page, bucket=client.bucket)
+
+    return statuses
+
+
+def check(
+    batch_ids: Iterable[str],
+    credentials: Mapping[str, str] = {},
+) -> CheckResult:
+    """Statuses of `batch_ids`, each listed by the client of its credential."""
+
+    statuses: list[BatchStatus] = []
+    batch_ids = set(batch_ids)
+
+    owned: dict[str, set[str]] = collections.defaultdict(set)
+    for batch_id in batch_ids:
+        owned[credentials.get(batch_id, pool.DEFAULT)].add(batch_id)
+
+    with tracing.span("check") as span, metrics.check_duration.time():
+        for name, ids in owned.items():
+            statuses.extend(_list(pool.client(name), ids))
+
+        span.items = len(statuses)
+
+    counts = collections.Counter(status.batch.status for status in statuses)
+    for batch_status, count in counts.items():
+        metrics.batches.set(count, status=batch_status)
+
     found_ids = {
         batch_id  #
         for status in statuses
@@ -48,52 +92,186 @@ def check(batch_ids: Iterable[str]) -> CheckResult:
     )
 
 
+def _record_provider_phases(batch: Batch):
+    """Record the phases the batch went through on the provider side as spans."""
+
+    ended_at = (
+        batch.completed_at or batch.failed_at or batch.expired_at or batch.cancelled_at
+    )
+    phases = [
+        ("validating", batch.created_at),
+        ("in_progress", batch.in_progress_at),
+        ("finalizing", batch.finalizing_at),
+        (None, ended_at),
+    ]
+    # skip phases the batch never entered
+    phases = [(name, at) for name, at in phases if at is not None]
+    items = batch.request_counts.total if batch.request_counts else None
+
+    for (name, started_at), (_, phase_ended_at) in itertools.pairwise(phases):
+        assert started_at is not None and phase_ended_at is not None
+        tracing.record(
+            f"batch {batch.id} {name}",
+            started_at=datetime.fromtimestamp(started_at),
+            ended_at=datetime.fromtimestamp(phase_ended_at),
+            items=items,
+        )
+
+
+def _timestamp(at: int | None) -> datetime | None:
+    return datetime.fromtimestamp(at) if at else None
+
+
+def update(row: schema.Batch, batch: Batch) -> bool:
+    """Update `row` with the latest state of `batch`, return whether it changed."""
+
+    counts = batch.request_counts
+    ended_at = (
+        batch.completed_at or batch.failed_at or batch.expired_at or batch.cancelled_at
+    )
+    values = {
+        "status": batch.status,
+        # unknown for batches recorded before the batch table, see `migrate`
+        "input_file_id": batch.input_file_id,
+        "output_file_id": batch.output_file_id,
+        "error_file_id": batch.error_file_id,
+        "request_total": counts.total if counts else None,
+        "request_completed": counts.completed if counts else None,
+        "request_failed": counts.failed if counts else None,
+        "in_progress_at": _timestamp(batch.in_progress_at),
+        "finalizing_at": _timestamp(batch.finalizing_at),
+        "ended_at": _timestamp(ended_at),
+    }
+    changed = any(getattr(row, name) != value for name, value in values.items())
+    for name, value in values.items():
+        setattr(row, name, value)
+
+    return changed
+
+
 def to_checked(
     work: schema.Work,
     cls: type["runner.OpenAIBatchRunner"],
 ) -> schema.Work:
-    result = check(work.undone_batch_ids)
+    assert work.id is not None
+    work_id = work.id
+
+    rows = {
+        batch.id: batch
+        for batch in works_db.list_batches(work_id, {schema.BatchState.Undone})
+    }
+    result = check(rows, {id: batch.credential for id, batch in rows.items()})
     if not_found_ids := result.not_found_ids:
         logger.warning(f"Batch IDs not found: {not_found_ids}")
 
-    statuses = sorted(result.statuses, key=lambda status: status.status)
+    # batches rejected for the enqueued token limit are submitted again later
+    requeued = [
+        status
+        for status in result.statuses
+        if status.over_quota and rows[status.batch_id].shard is not None
+    ]
+    if requeued:
+        logger.info(f"Batches over the enqueued token limit: {len(requeued)}")
+
+    def key(status: BatchStatus) -> tuple[str, str]:
+        return status.status, rows[status.batch_id].credential
 
-    # download success and failed batch files
-    grouped = itertools.groupby(
-        statuses,
-        key=lambda status: status.status,
+    statuses = sorted(
+        (status for status in result.statuses if status not in requeued),
+        key=key,
     )
-    for status, statuses in grouped:
-        ids = [id for status in statuses if (id := status.batch_id)]
-        match status:
-            case "success":
-                download(cls, ids)
-            case "failed":
-                download_error(cls, ids)
-                logger.warning(f"Batch failed: {ids}")
-
-    # update work in database
-    assert work.id
-    with works_db.update_work(work.id) as work:
-        done_batch_ids = {
-            status.batch_id  #
-            for status in statuses
-            if status.status != "in_progress"
+
+    # download success and failed batch files, with the client owning them,
+    # skipping outputs delivered by an earlier check
+    ledger = Ledger(
+        batch_ids={
+            status.file_id: status.batch_id for status in statuses if status.file_id
         }
+    )
+    checkpoint = Checkpoint(
+        work, cls.work_config.checkpoint_interval, cls.flush, ledger
+    )
+    # with a pipeline, errors are delivered while outputs are downloaded, still
+    # one call of each callback at a time
+    errors = (
+        ThreadPoolExecutor(max_workers=1) if cls.work_config.pipeline_depth else None
+    )
+    delivering: list[Future] = []
+    grouped = itertools.groupby(statuses, key=key)
+    try:
+        for (status, credential), group in grouped:
+            group = list(group)
+            ids = [id for status in group if (id := status.batch_id)]
+            # output files of completed batches, error files of failed ones
+            file_ids = [id for status in group if (id := status.file_id)]
+            if status != "in_progress":
+                for batch_status in group:
+                    _record_provider_phases(batch_status.batch)
 
-        # exclude done_batch_ids from undone_batch_ids
-        work.undone_batch_ids = list(set(work.undone_batch_ids) - done_batch_ids)
-        # add done_batch_ids to done_batch_ids
-        work.done_batch_ids = list(set(work.done_batch_ids) | done_batch_ids)
+            client = pool.client(credential)
+            match status:
+                case "success":
+                    download(cls, file_ids, client, checkpoint)
+                case "failed" if errors is not None:
+                    context = contextvars.copy_context()
+                    delivering.append(
+                        errors.submit(
+                            context.run,
+                            download_error,
+                            cls,
+                            file_ids,
+                            client,
+                            checkpoint,
+                        )
+                    )
+                    logger.warning(f"Batch failed: {ids}")
+                case "failed":
+                    download_error(cls, file_ids, client, checkpoint)
+                    logger.warning(f"Batch failed: {ids}")
 
-    works_db.update_process_status(
-        pid=os.getpid(),
-        description="Checked",
-        status=None,
-    )
+        for future in delivering:
+            future.result()
+    finally:
+        if errors is not None:
+            errors.shutdown(cancel_futures=True)
+
+    # only batches that changed since the last check are written
+    checked_at = datetime.now()
+    with works_db.session() as session:
+        for status in result.statuses:
+            row = rows[status.batch_id]
+            changed = update(row, status.batch)
+            if status in requeued:
+                row.state = schema.BatchState.Requeued
+            elif status.status != "in_progress":
+                row.state = schema.BatchState.Done
+            elif not changed:
+                continue
+
+            row.checked_at = checked_at
+            session.add(row)
+
+        # the rows of its batches are as fresh as this check, see `snapshot`
+        work = session.get(schema.Work, work_id)
+        assert work is not None
+        work.snapshot_at = checked_at
+        if requeued:
+            work.pending_shards = [
+                *(
+                    shard
+                    for status in requeued
+                    if (shard := rows[status.batch_id].shard)
+                ),
+                *work.pending_shards,
+            ]
+        session.add(work)
+
+    # refill the window left by finished batches
+    work = submit_pending(work, cls.work_config)
 
     # all batches are done, marked as completed
-    if not work.undone_batch_ids:
+    undone = works_db.count_batches(work_id, schema.BatchState.Undone)
+    if not undone and not work.pending_shards:
         raise StatusInterrupt(schema.WorkStatus.Completed)
 
     return work
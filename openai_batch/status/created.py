@@ -1,75 +1,92 @@
+import collections
+import contextlib
 import hashlib
 import importlib.resources as res
 import logging
-import os
 import platform
 import subprocess as sp
-import tempfile
+import time
 from dataclasses import dataclass
 from datetime import datetime
 from functools import partial
-from typing import IO, Iterable, Sequence
+from typing import Iterable, Mapping, Sequence
 
-import openai
 from crontab import CronTab
-from openai.types import FileObject
+from openai.types import Batch, FileObject
 from sqlmodel import select
 
-from .. import runner, scripts
-from ..const import CHUNK_SIZE, MAX_FILE_SIZE
+from .. import metrics, progress, runner, scripts, tracing
 from ..db import schema, works_db
+from ..embeddings import EmbeddingStore
 from ..exception import OpenAIBatchException
-from ..model import BatchInputItem, BatchRequestInputItem, WorkConfig
-from ..openai import openai_file
+from ..model import (
+    BatchInputItem,
+    BatchRequestInputItem,
+    EmbeddingInputItem,
+    TemplateInputItem,
+    WorkConfig,
+)
+from ..openai import pool
+from ..openai.ratelimit import retrying
 from ..openai.upload import UploadStatus
+from ..preflight import preflight
+from ..shard import Shard, ShardArchive
 from ..utils import to_minutes
 from .utils import cron_name
 
 logger = logging.getLogger(__name__)
 
-type TempFile = IO[bytes]
-
 
 @dataclass
 class TransformResult:
     dataset_hash: str | None
-    files: list[TempFile]
+    shards: list[Shard]
 
 
 def transform(
     config: WorkConfig,
-    batch_input: Iterable[BatchInputItem],
+    batch_input: Iterable[BatchInputItem | EmbeddingInputItem | TemplateInputItem],
+    archive: ShardArchive,
 ) -> TransformResult:
     hash = not config.allow_same_dataset
     hasher = hashlib.sha1()
 
-    files: list[TempFile] = []
-    curr_file = tempfile.TemporaryFile(buffering=CHUNK_SIZE)
-    curr_file_size = 0
-
-    for item in batch_input:
-        request_item = BatchRequestInputItem.from_input(config, item)
-        json = f"{request_item.model_dump_json()}\n".encode()
-        if hash:
-            hasher.update(json)
-
-        if curr_file_size + len(json) > MAX_FILE_SIZE:
-            curr_file.seek(0)
-            curr_file.flush()
-            files.append(curr_file)
-            curr_file = tempfile.TemporaryFile()
-            curr_file_size = 0
-
-        curr_file_size += len(json)
-        curr_file.write(json)
+    ids_writer = (
+        EmbeddingStore.of_config(config.embeddings).ids_writer()
+        if config.embeddings is not None
+        else contextlib.nullcontext()
+    )
 
-    if curr_file_size > 0:
-        curr_file.seek(0)
-        files.append(curr_file)
+    with tracing.span("transform") as span:
+        start = time.perf_counter()
+        with archive.writer() as writer, ids_writer as write_id:
+            for count, item in enumerate(batch_input, 1):
+                if write_id is not None:
+                    write_id(item.id)
+                progress.report("transform", count, unit="items")
+                if isinstance(item, TemplateInputItem):
+                    # spliced into the encoded template, validated once
+                    json = item.encode(config.endpoint)
+                else:
+                    request_item = BatchRequestInputItem.from_input(config, item)
+                    json = f"{request_item.model_dump_json()}\n".encode()
+                if hash:
+                    hasher.update(json)
+
+                writer.write(json)
+
+        elapsed = time.perf_counter() - start
+        span.items = sum(shard.lines for shard in writer.shards)
+        span.bytes = sum(shard.size for shard in writer.shards)
+        metrics.transformed_items.inc(span.items)
+        metrics.transform_throughput.set(span.items / elapsed if elapsed else 0)
+
+        dataset_hash = hasher.hexdigest() if hash else None
+        archive.commit(writer.shards, dataset_hash=dataset_hash)
 
     return TransformResult(
-        dataset_hash=hasher.hexdigest() if hash else None,
-        files=files,
+        dataset_hash=dataset_hash,
+        shards=writer.shards,
     )
 
 
@@ -77,44 +94,183 @@ def transform(
 class UploadResult:
     created: datetime
     batch_ids: set[str]
+    credentials: dict[str, str]
+    """Credential each batch was created with"""
+    shards: dict[str, str]
+    """Shard each batch was created from"""
+    batches: list[Batch]
 
 
-def upload(config: WorkConfig, files: Sequence[TempFile]) -> UploadResult:
-    file_count = len(files)
-    pid = os.getpid()
+def upload(
+    config: WorkConfig,
+    archive: ShardArchive,
+    shards: Sequence[Shard] | None = None,
+    credentials: Sequence[str] | None = None,
+) -> UploadResult:
+    """
+    Create a batch of each of `shards`, all shards of `archive` if None, with
+    the client of the credential of each shard, spread over the credentials of
+    the work if None.
+    """
 
-    def handle_upload_chunk(description: str, status: UploadStatus):
-        works_db.update_process_status(pid, description=description, status=status)
+    shards = archive.shards if shards is None else shards
+    file_count = len(shards)
+    if credentials is None:
+        credentials = pool.assign(config.credentials, [shard.size for shard in shards])
+    clients = [pool.client(name) for name in credentials]
+
+    def handle_upload_chunk(status: UploadStatus, description: str):
+        progress.report(description, status.current, status.total)
+
+    uploaded_files: list[tuple[pool.Client, Shard, FileObject]] = []
+    for i, (shard, client) in enumerate(zip(shards, clients, strict=True)):
+        with (
+            archive.open(shard) as file,
+            tracing.span(f"upload {file.name}") as span,
+        ):
+            file_obj = client.file.upload(
+                file=file,
+                purpose="batch",
+                size=shard.size,
+                filename=file.name,
+                on_upload_chunk=partial(
+                    handle_upload_chunk,
+                    description=f"upload {file.name} ({i + 1}/{file_count})",
+                ),
+            )
+            span.items = shard.lines
+            span.bytes = shard.size
+        uploaded_files.append((client, shard, file_obj))
+        metrics.uploaded_bytes.inc(shard.size)
+
+        logger.info(f"{file.name} uploaded to {client.name} ({i + 1}/{file_count})")
+
+    batches: list[tuple[pool.Client, Shard, Batch]] = []
+    with tracing.span("create batches") as span:
+        for client, shard, file in uploaded_files:
+            batch = retrying(
+                "batches.create",
+                partial(
+                    client.batches.create,
+                    input_file_id=file.id,
+                    # completion_window=f"{comp_window.days}d{comp_window.seconds}s",
+                    completion_window="24h",  # FIXME
+                    endpoint=config.endpoint,
+                ),
+                bucket=client.bucket,
+            )
+            batches.append((client, shard, batch))
+        span.items = len(batches)
+
+    return UploadResult(
+        created=datetime.now(),
+        batch_ids={batch.id for _, _, batch in batches},
+        credentials={batch.id: client.name for client, _, batch in batches},
+        shards={batch.id: shard.name for _, shard, batch in batches},
+        batches=[batch for _, _, batch in batches],
+    )
 
-    uploaded_files: list[FileObject] = []
-    for i, file in enumerate(files):
-        file_obj = openai_file.upload(
-            file=file,
-            purpose="batch",
-            on_upload_chunk=partial(
-                handle_upload_chunk,
-                description=f"uploading {file.name} ({i + 1}/{file_count})",
-            ),
-        )
-        uploaded_files.append(file_obj)
 
-        logger.info(f"{file.name} uploaded ({i + 1}/{file_count})")
+def record(work_id: int, result: UploadResult):
+    """Save the batches of `result` as undone batches of work `work_id`."""
 
-    batches = [
-        openai.batches.create(
-            input_file_id=file.id,
-            # completion_window=f"{comp_window.days}d{comp_window.seconds}s",
-            completion_window="24h",  # FIXME
-            endpoint=config.endpoint,
+    attempts = collections.Counter(
+        batch.shard for batch in works_db.list_batches(work_id)
+    )
+    works_db.add_batches(
+        schema.Batch(
+            id=batch.id,
+            work_id=work_id,
+            credential=result.credentials[batch.id],
+            shard=(shard := result.shards[batch.id]),
+            attempt=attempts[shard] + 1,
+            status=batch.status,
+            input_file_id=batch.input_file_id,
+            created_at=result.created,
         )
-        for file in uploaded_files
-    ]
+        for batch in result.batches
+    )
 
-    return UploadResult(
-        created=datetime.now(),
-        batch_ids={batch.id for batch in batches},
+
+def window(
+    shards: Sequence[Shard],
+    quota: int | None,
+    weights: Mapping[str, float] | None = None,
+    in_flight: Mapping[str, int] | None = None,
+) -> list[str]:
+    """
+    Credential of each of the leading `shards` to submit, with `in_flight`
+    tokens enqueued by each credential already.
+
+    Shards are spread over the credentials of `weights` as by `pool.assign`,
+    counting the tokens in flight, and the tokens enqueued in each organization
+    are kept under `quota`, the provider limit being per organization. A shard
+    over the quota is submitted alone to an organization.
+    """
+
+    weights = weights or {pool.DEFAULT: 1}
+    assigned = collections.Counter(in_flight or {})
+    enqueued: collections.Counter[str] = collections.Counter()
+    for name, tokens in assigned.items():
+        enqueued[pool.organization(name)] += tokens
+
+    def fits(name: str, tokens: int) -> bool:
+        used = enqueued[pool.organization(name)]
+        return quota is None or used == 0 or used + tokens <= quota
+
+    names = []
+    for shard in shards:
+        if not (candidates := [name for name in weights if fits(name, shard.tokens)]):
+            break
+
+        name = pool.lightest(weights, assigned, shard.tokens, candidates)
+        assigned[name] += shard.tokens
+        enqueued[pool.organization(name)] += shard.tokens
+        names.append(name)
+
+    return names
+
+
+def submit_pending(
+    work: schema.Work,
+    config: WorkConfig,
+) -> schema.Work:
+    """Submit pending shards of `work` as far as the enqueued token quota allows."""
+
+    assert work.id is not None
+    if not work.pending_shards:
+        return work
+
+    archive = ShardArchive.of_work(work.uuid)
+    if not archive.load():
+        raise OpenAIBatchException(f"Shards of work {work.id} are missing")
+
+    shards = {shard.name: shard for shard in archive.shards}
+    in_flight: collections.Counter[str] = collections.Counter()
+    for batch in works_db.list_batches(work.id, {schema.BatchState.Undone}):
+        if batch.shard is not None:
+            in_flight[batch.credential] += shards[batch.shard].tokens
+
+    pending = [shards[name] for name in work.pending_shards]
+    credentials = window(
+        pending, config.max_enqueued_tokens, config.credentials, in_flight
+    )
+    if not (count := len(credentials)):
+        return work
+
+    result = upload(config, archive, pending[:count], credentials)
+    record(work.id, result)
+    logger.info(
+        f"Submitted {count} pending shards of work {work.id}, "
+        f"{len(pending) - count} left"
     )
 
+    # JSON columns are only saved when assigned
+    with works_db.update_work(work.id) as work:
+        work.pending_shards = work.pending_shards[count:]
+
+    return work
+
 
 def register_task_windows(
     work: schema.Work,
@@ -151,7 +307,7 @@ def register_task_unix(
 ):
     assert work.id is not None
     config = cls.work_config
-    with CronTab() as cron:
+    with CronTab(user=True) as cron:
         job = cron.new(
             command=f"cd {work.work_dir} && {work.interpreter_path} -c {work.script}",
             comment=cron_name(work.id),
@@ -168,11 +324,22 @@ def from_created(
     """
 
     config = cls.work_config
+    assert work.id is not None
 
-    transform_result = transform(
-        config=config,
-        batch_input=cls.upload(),
-    )
+    # shards of a previous attempt are reused instead of being regenerated
+    archive = ShardArchive.of_work(work.uuid, compression=config.shard_compression)
+    if archive.load():
+        logger.info(f"Reusing {len(archive.shards)} shards of work {work.id}")
+        transform_result = TransformResult(
+            dataset_hash=archive.dataset_hash,
+            shards=archive.shards,
+        )
+    else:
+        transform_result = transform(
+            config=config,
+            batch_input=cls.upload(),
+            archive=archive,
+        )
 
     # check if same dataset exists
     if not config.allow_same_dataset:
@@ -188,15 +355,27 @@ def from_created(
                     message=f"Same dataset already exists in work {other_work.id}"
                 )
 
+    # malformed requests fail the work before anything is uploaded
+    preflight(config, archive)
+
+    # with a quota, shards over it stay pending until earlier batches finish
+    credentials = window(archive.shards, config.max_enqueued_tokens, config.credentials)
+    count = len(credentials)
     upload_result = upload(
         config=config,
-        files=transform_result.files,
+        archive=archive,
+        shards=archive.shards[:count],
+        credentials=credentials,
     )
 
-    assert work.id is not None
+    record(work.id, upload_result)
     with works_db.update_work(work.id) as work:
         work.created_at = upload_result.created
-        work.undone_batch_ids = list(upload_result.batch_ids)
+        work.pending_shards = [shard.name for shard in archive.shards[count:]]
+
+    # works submitted in process are checked by their client
+    if work.config is not None:
+        return
 
     match platform.system():
         case "Windows":
@@ -0,0 +1,54 @@
+import logging
+
+from .. import progress, runner
+from ..db import schema, works_db
+from ..export import sink_of
+from ..model import BatchRequestInputItem
+from ..openai import direct
+from ..usage import Ledger, Usage, charge
+from .exception import StatusInterrupt
+
+logger = logging.getLogger(__name__)
+
+
+def from_created_direct(
+    work: schema.Work,
+    cls: type["runner.OpenAIBatchRunner"],
+):
+    """
+    Send the batch input directly to the endpoint instead of the Batch API.
+
+    Outputs are delivered to `download()` as soon as they arrive, failed requests
+    included, so the work is completed once the input is exhausted.
+    """
+
+    config = cls.work_config
+
+    requests = (
+        BatchRequestInputItem.from_input(config, item)  #
+        for item in cls.upload()
+    )
+
+    ledger = Ledger()
+    usage = Usage()
+
+    def outputs():
+        for count, item in enumerate(direct.execute(requests, config.direct), 1):
+            progress.report("direct", count, unit="requests")
+            output = item.to_output()
+            yield output
+            ledger.count(usage, output)
+
+    try:
+        with sink_of(config.export, f"direct-{work.id}") as sink:
+            cls.download(outputs() if sink is None else sink.tee(outputs()))
+    finally:
+        assert work.id is not None
+        ledger.settle("direct", usage)
+        with works_db.update_work(work.id) as db_work:
+            for settled in ledger.take().values():
+                charge(db_work, settled)
+
+    logger.info(f"Work {work.id} executed directly")
+
+    raise StatusInterrupt(schema.WorkStatus.Completed)
@@ -1,10 +1,11 @@
 import logging
 
-from .. import runner
+from .. import runner, tracing
 from ..db import schema, works_db
 from ..exception import OpenAIBatchException
 from .checked import to_checked
 from .created import from_created
+from .direct import from_created_direct
 from .exception import StatusInterrupt
 from .stopped import to_canceled, to_completed, to_failed
 from .utils import load_cls
@@ -26,24 +27,36 @@ def to_status(
         cls = load_cls(work.script, work.class_name)
 
     try:
-        match (prev_status, status):
-            case (schema.WorkStatus.Created, schema.WorkStatus.Checked):
-                from_created(work, cls=cls)
-                to_checked(work, cls=cls)
-            case (schema.WorkStatus.Checked, schema.WorkStatus.Checked):
-                to_checked(work, cls=cls)
-            case (_, schema.WorkStatus.Completed):
-                to_completed(work, cls=cls)
-            case (_, schema.WorkStatus.Failed):
-                to_failed(work, cls=cls)
-            case (_, schema.WorkStatus.Canceled):
-                to_canceled(work, cls=cls)
-            case _:
-                raise OpenAIBatchException(
-                    f"Invalid status transition: {prev_status} -> {status}"
-                )
-
         assert work.id is not None
+        with (
+            tracing.trace_work(work.id),
+            tracing.span(
+                f"{prev_status.value} -> {status.value}",
+                expected=(StatusInterrupt,),
+            ),
+        ):
+            match (prev_status, status):
+                case (
+                    schema.WorkStatus.Created,
+                    schema.WorkStatus.Checked,
+                ) if cls.work_config.backend == "direct":
+                    from_created_direct(work, cls=cls)
+                case (schema.WorkStatus.Created, schema.WorkStatus.Checked):
+                    from_created(work, cls=cls)
+                    to_checked(work, cls=cls)
+                case (schema.WorkStatus.Checked, schema.WorkStatus.Checked):
+                    to_checked(work, cls=cls)
+                case (_, schema.WorkStatus.Completed):
+                    to_completed(work, cls=cls)
+                case (_, schema.WorkStatus.Failed):
+                    to_failed(work, cls=cls)
+                case (_, schema.WorkStatus.Canceled):
+                    to_canceled(work, cls=cls)
+                case _:
+                    raise OpenAIBatchException(
+                        f"Invalid status transition: {prev_status} -> {status}"
+                    )
+
         with works_db.update_work(work_id=work.id) as work:
             work.status = status
             return work
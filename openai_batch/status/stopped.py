@@ -3,8 +3,10 @@ import platform
 
 from crontab import CronTab
 
-from .. import runner
+from .. import runner, tracing
+from ..cleanup import clean_up
 from ..db import schema
+from ..shard import ShardArchive
 from .utils import cron_name
 
 logger = logging.getLogger(__name__)
@@ -13,7 +15,7 @@ logger = logging.getLogger(__name__)
 def unregister_task_unix(work_id: int) -> None:
     """Unregister the task from the crontab."""
 
-    with CronTab() as cron:
+    with CronTab(user=True) as cron:
         cron.remove_all(comment=cron_name(work_id))
 
 
@@ -21,7 +23,14 @@ def unregister_task_windows(work_id: int) -> None:
     pass
 
 
-def unregister_task(work_id: int) -> None:
+def unregister_task(work: schema.Work) -> None:
+    assert work.id is not None
+    work_id = work.id
+
+    # works submitted in process have no scheduled task
+    if work.config is not None:
+        return
+
     match platform.system():
         case "Windows":
             unregister_task_windows(work_id)
@@ -37,9 +46,15 @@ def to_completed(
 ) -> schema.Work:
     assert work.id is not None
 
-    unregister_task(work.id)
+    if cls.work_config.clean_up:
+        # before unregistering, an interrupted clean up resumes at the next check
+        with tracing.span("clean up") as span:
+            span.items = clean_up(work)
+        ShardArchive.of_work(work.uuid).remove()
 
-    raise NotImplementedError()
+    unregister_task(work)
+
+    return work
 
 
 def to_failed(
@@ -48,9 +63,11 @@ def to_failed(
 ) -> schema.Work:
     assert work.id is not None
 
-    unregister_task(work.id)
+    # a failed work is not resumed, its shards are of no use
+    ShardArchive.of_work(work.uuid).remove()
+    unregister_task(work)
 
-    raise NotImplementedError()
+    return work
 
 
 def to_canceled(
@@ -59,6 +76,6 @@ def to_canceled(
 ) -> schema.Work:
     assert work.id is not None
 
-    unregister_task(work.id)
+    unregister_task(work)
 
     raise NotImplementedError()
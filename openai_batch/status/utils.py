@@ -1,11 +1,25 @@
-import os
+import contextlib
 import types
-from typing import Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Sequence
 
-from .. import runner
-from ..db import works_db
-from ..model import BatchRequestOutputItem
-from ..openai import openai_file
+from .. import metrics, progress, runner, tracing
+from ..checkpoint import Checkpoint
+from ..config import global_config
+from ..db import schema, works_db
+from ..embeddings import EmbeddingStore
+from ..export import export, sink_of
+from ..logprobs import LogprobsStore
+from ..model import BatchErrorItem, BatchOutputItem, BatchRequestOutputItem
+from ..openai import pool
+from ..openai.ratelimit import retrying
+from ..openai.upload import OpenAIFile, StreamChunk
+from ..parse import line_offset, parse_file
+from ..pipeline import stage
+from ..utils import process_pool
 
 
 def cron_name(work_id: int) -> str:
@@ -19,47 +33,283 @@ def _concat[T](gens: Iterable[Iterable[T]]) -> Iterable[T]:
         yield from gen
 
 
-def _download(file_ids: Sequence[str], progress: bool = False):
-    pid = os.getpid()
-    file_count = len(file_ids)
+def _report(description: str, chunk: StreamChunk):
+    progress.report(description, chunk.current, chunk.total)
+
+
+def _fetch(
+    file: OpenAIFile,
+    file_id: str,
+    description: str,
+    span: tracing.SpanHandle | None = None,
+) -> Iterator[str]:
+    downloaded = 0
+    try:
+        for chunk in file.retrieve(file_id):
+            downloaded = chunk.current
+            progress.report(description, chunk.current, chunk.total)
 
-    def download_file(idx: int, file_id: str):
-        for chunk in openai_file.retrieve(file_id):
-            if progress:
-                desc = f"Downloading file {idx + 1}/{file_count}"
-                works_db.update_process_status(
-                    pid=pid,
-                    description=desc,
-                    status=chunk,
-                )
+            yield chunk.line
+    finally:
+        metrics.downloaded_bytes.inc(downloaded)
+        if span is not None:
+            span.bytes = (span.bytes or 0) + downloaded
 
-            yield BatchRequestOutputItem.model_validate_json(chunk.line)
+
+def _download_lines(
+    file_ids: Sequence[str],
+    span: tracing.SpanHandle | None = None,
+    phase: str = "download",
+    file: OpenAIFile | None = None,
+) -> Iterable[str]:
+    file_count = len(file_ids)
+    file = file or pool.client().file
 
     yield from _concat(
-        download_file(idx, file_id)  #
+        _fetch(file, file_id, f"{phase} {file_id} ({idx + 1}/{file_count})", span)
         for idx, file_id in enumerate(file_ids)
     )
 
 
+def _download(
+    file_ids: Sequence[str],
+    span: tracing.SpanHandle | None = None,
+    phase: str = "download",
+    file: OpenAIFile | None = None,
+) -> Iterable[BatchRequestOutputItem]:
+    for line in _download_lines(file_ids, span=span, phase=phase, file=file):
+        yield BatchRequestOutputItem.model_validate_json(line)
+
+
+def _parsed[T](
+    file_ids: Sequence[str],
+    parse: Callable[[Iterable[str]], Iterable[T]],
+    file: OpenAIFile,
+    span: tracing.SpanHandle,
+    phase: str,
+    checkpoint: Checkpoint | None = None,
+    depth: int = 0,
+    stateful: bool = False,
+) -> Iterator[T]:
+    """
+    Lines of `file_ids` parsed by `parse`, one item per line. With a `depth`,
+    lines of each file are fetched and parsed in their own stages, at most
+    `depth` items ahead of the consumer. A `stateful` parse writes to a store
+    committed with the checkpoint, it runs in the thread of the consumer so
+    that it is never ahead of the checkpoint.
+    """
+
+    for idx, file_id in enumerate(file_ids):
+        description = f"{phase} {file_id} ({idx + 1}/{len(file_ids)})"
+        lines = _fetch(file, file_id, description, span)
+        if checkpoint is not None:
+            lines = checkpoint.skip(file_id, lines)
+        if depth:
+            lines = stage("fetch", lines, depth)
+
+        items = parse(lines)
+        if depth and not stateful:
+            items = stage("parse", items, depth)
+        # counted as delivered when the consumer asks for the next item
+        if checkpoint is not None:
+            items = checkpoint.track(file_id, items)
+
+        yield from items
+
+
+def _parsed_in_processes(
+    file_ids: Sequence[str],
+    file: OpenAIFile,
+    span: tracing.SpanHandle,
+    processes: ProcessPoolExecutor,
+    workers: int,
+    checkpoint: Checkpoint | None = None,
+) -> Iterator[BatchOutputItem]:
+    """
+    Outputs of `file_ids`, each file downloaded to disk first, then parsed by
+    the `workers` processes of `processes`.
+    """
+
+    spool = Path(global_config.save_path) / "downloads"
+    spool.mkdir(parents=True, exist_ok=True)
+
+    with processes:
+        for idx, file_id in enumerate(file_ids):
+            description = f"download {file_id} ({idx + 1}/{len(file_ids)})"
+            path = spool / f"{file_id}.jsonl"
+            try:
+                with path.open("wb") as f:
+                    downloaded = file.retrieve_to(
+                        file_id,
+                        f,
+                        on_chunk=partial(_report, description),
+                    )
+                metrics.downloaded_bytes.inc(downloaded)
+                span.bytes = (span.bytes or 0) + downloaded
+
+                # lines delivered by earlier checks are skipped unparsed
+                start = 0
+                if checkpoint is not None:
+                    start = line_offset(path, checkpoint.offset(file_id))
+
+                outputs = parse_file(path, processes, workers, start)
+                if checkpoint is not None:
+                    outputs = checkpoint.track(file_id, outputs)
+
+                yield from outputs
+            finally:
+                path.unlink(missing_ok=True)
+
+
 def download(
     cls: type["runner.OpenAIBatchRunner"],
     output_file_ids: Sequence[str],
+    client: pool.Client | None = None,
+    checkpoint: Checkpoint | None = None,
 ):
-    cls.download(
-        item.to_output()  #
-        for item in _download(output_file_ids)
-    )
+    """
+    Download output files owned by `client`, the default client if None,
+    resuming from `checkpoint` if given.
+    """
+
+    # the export of a resumed download keeps its name
+    name = output_file_ids[0] if output_file_ids else ""
+    if checkpoint is not None:
+        output_file_ids = checkpoint.pending(output_file_ids)
+    if not output_file_ids:
+        return
+
+    config = cls.work_config
+    store = None
+    if (embeddings := config.embeddings) is not None:
+        # vectors go to the store, `download` gets the status of each item
+        parse = EmbeddingStore.of_config(embeddings).write
+    elif (logprobs := config.logprobs) is not None:
+        # logprobs are appended to columns, `download` gets the text
+        store = LogprobsStore.of_config(logprobs)
+        parse = store.write
+    else:
+
+        def parse(lines: Iterable[str]) -> Iterable[BatchOutputItem]:
+            for line in lines:
+                yield BatchRequestOutputItem.model_validate_json(line).to_output()
+
+    file = (client or pool.client()).file
+    watch = tracing.Stopwatch()
+    with tracing.span("download") as span:
+        started_at = datetime.now()
+        if (workers := config.parse_workers) and (processes := process_pool(workers)):
+            outputs = _parsed_in_processes(
+                output_file_ids, file, span, processes, workers, checkpoint
+            )
+        else:
+            outputs = _parsed(
+                output_file_ids,
+                parse,
+                file,
+                span,
+                phase="download",
+                checkpoint=checkpoint,
+                depth=config.pipeline_depth,
+                stateful=store is not None,
+            )
+
+        with contextlib.ExitStack() as stack:
+            # columns of logprobs are committed with the checkpoint too
+            if store is not None and checkpoint is not None:
+                stack.enter_context(checkpoint.hooked(output_file_ids, store.commit))
+
+            # with a checkpoint, outputs are exported in a part per checkpoint
+            parts = checkpoint is not None
+            sink = stack.enter_context(sink_of(config.export, name, parts))
+            if sink is not None:
+                outputs = sink.tee(outputs)
+                if checkpoint is not None:
+                    stack.enter_context(checkpoint.hooked(output_file_ids, sink.commit))
+
+            cls.download(watch.wrap(outputs))
+        span.items = watch.items
+        watch.record(
+            started_at,
+            datetime.now(),
+            producer="download.fetch",
+            consumer="download.callback",
+        )
+
+
+def export_work(work: schema.Work, path: Path, row_group_size: int = 100_000) -> int:
+    """
+    Export outputs of the completed batches of `work` to the Parquet file `path`,
+    downloading them again. Return the number of rows.
+    """
+
+    assert work.id is not None
+    work_id = work.id
+
+    def outputs():
+        owned: dict[str, list[str]] = {}
+        for batch in works_db.list_batches(work_id, {schema.BatchState.Done}):
+            output_file_id = batch.output_file_id
+            if not batch.input_file_id:
+                # recorded before the batch table, see `migrate`
+                client = pool.client(batch.credential)
+                output_file_id = retrying(
+                    "batches.retrieve",
+                    partial(client.batches.retrieve, batch.id),
+                    bucket=client.bucket,
+                ).output_file_id
+            if output_file_id is not None:
+                owned.setdefault(batch.credential, []).append(output_file_id)
+
+        for name, file_ids in owned.items():
+            client = pool.client(name)
+            for item in _download(file_ids, phase="export", file=client.file):
+                yield item.to_output()
+
+    return export(outputs(), path, row_group_size)
 
 
 def download_error(
     cls: type["runner.OpenAIBatchRunner"],
     error_file_ids: Sequence[str],
+    client: pool.Client | None = None,
+    checkpoint: Checkpoint | None = None,
 ):
-    cls.download_error(
-        output_item
-        for item in _download(error_file_ids, progress=False)
-        if (output_item := item.to_error_output()) is not None
-    )
+    """
+    Download error files owned by `client`, the default client if None,
+    resuming from `checkpoint` if given.
+    """
+
+    if checkpoint is not None:
+        error_file_ids = checkpoint.pending(error_file_ids)
+    if not error_file_ids:
+        return
+
+    def parse(lines: Iterable[str]) -> Iterable[BatchErrorItem | None]:
+        for line in lines:
+            yield BatchRequestOutputItem.model_validate_json(line).to_error_output()
+
+    file = (client or pool.client()).file
+    watch = tracing.Stopwatch()
+    with tracing.span("download_error") as span:
+        started_at = datetime.now()
+        errors = _parsed(
+            error_file_ids,
+            parse,
+            file,
+            span,
+            phase="download error",
+            checkpoint=checkpoint,
+            depth=cls.work_config.pipeline_depth,
+        )
+        cls.download_error(watch.wrap(error for error in errors if error is not None))
+        span.items = watch.items
+        watch.record(
+            started_at,
+            datetime.now(),
+            producer="download_error.fetch",
+            consumer="download_error.callback",
+        )
 
 
 def load_cls(script: str, cls_name: str) -> type["runner.OpenAIBatchRunner"]:
@@ -0,0 +1,153 @@
+"""
+Lightweight timing spans of the phases of a work, persisted in the `span` table.
+
+Spans are only recorded inside `trace_work`, which binds them to a work;
+elsewhere `span` is a no-op, so phases can be run standalone (tests, benchmarks).
+"""
+
+import contextlib
+import contextvars
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+from .db import schema, works_db
+
+_work_id: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "work_id",
+    default=None,
+)
+_parent_id: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "parent_id",
+    default=None,
+)
+
+
+@dataclass
+class SpanHandle:
+    """Counters of the running span, saved when it ends."""
+
+    items: int | None = None
+    bytes: int | None = None
+
+
+@contextlib.contextmanager
+def trace_work(work_id: int):
+    """Record spans opened in the block for work `work_id`."""
+
+    token = _work_id.set(work_id)
+    try:
+        yield
+    finally:
+        _work_id.reset(token)
+
+
+@contextlib.contextmanager
+def span(
+    name: str,
+    expected: tuple[type[BaseException], ...] = (),
+) -> Iterator[SpanHandle]:
+    """
+    Time the block as a child of the enclosing span.
+
+    Exceptions escaping the block are recorded as errors, except `expected` ones.
+    """
+
+    handle = SpanHandle()
+    if (work_id := _work_id.get()) is None:
+        yield handle
+        return
+
+    db_span = works_db.create_span(
+        schema.Span(
+            work_id=work_id,
+            parent_id=_parent_id.get(),
+            pid=os.getpid(),
+            name=name,
+            started_at=datetime.now(),
+        )
+    )
+    token = _parent_id.set(db_span.id)
+
+    error = None
+    try:
+        yield handle
+    except expected:
+        raise
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _parent_id.reset(token)
+
+        db_span.ended_at = datetime.now()
+        db_span.items = handle.items
+        db_span.bytes = handle.bytes
+        db_span.error = error
+        works_db.update_span(db_span)
+
+
+def record(
+    name: str,
+    started_at: datetime,
+    ended_at: datetime,
+    items: int | None = None,
+    bytes: int | None = None,
+):
+    """Record a span that has already ended, e.g. provider-side batch phases."""
+
+    if (work_id := _work_id.get()) is None:
+        return
+
+    works_db.create_span(
+        schema.Span(
+            work_id=work_id,
+            parent_id=_parent_id.get(),
+            pid=os.getpid(),
+            name=name,
+            started_at=started_at,
+            ended_at=ended_at,
+            items=items,
+            bytes=bytes,
+        )
+    )
+
+
+class Stopwatch:
+    """Accumulate the time spent producing items of wrapped iterables."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.items = 0
+
+    def wrap[T](self, items: Iterable[T]) -> Iterable[T]:
+        it = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.seconds += time.perf_counter() - start
+                return
+
+            self.seconds += time.perf_counter() - start
+            self.items += 1
+            yield item
+
+    def record(
+        self,
+        started_at: datetime,
+        ended_at: datetime,
+        producer: str,
+        consumer: str,
+    ):
+        """
+        Split the time from `started_at` to `ended_at` into a `producer` span,
+        the time spent producing items, and a `consumer` span, the rest.
+        """
+
+        split = started_at + timedelta(seconds=self.seconds)
+        record(producer, started_at=started_at, ended_at=split, items=self.items)
+        record(consumer, started_at=split, ended_at=ended_at)
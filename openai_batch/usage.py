@@ -0,0 +1,126 @@
+"""
+Token usage and estimated cost of the outputs delivered to `Runner.download`.
+
+Usage is counted per output file as outputs are delivered, settled with the
+lines of the file at each checkpoint and added to the batch of the file and to
+its work in the same transaction, so that outputs delivered again after a
+failed check are not counted twice. Costs are estimated from the `prices` of
+the global config.
+
+Counting an output costs a few additions and a cached price lookup. Tokens are
+counted in local buckets, merged into the `request_tokens` histogram of
+`metrics` once settled.
+"""
+
+import bisect
+from dataclasses import dataclass, field
+from typing import Mapping
+
+from . import metrics
+from .config import PriceConfig, global_config
+from .db import schema
+from .model import BatchOutputItem
+
+M = 1_000_000
+
+
+def _buckets() -> list[int]:
+    return [0] * len(metrics.request_tokens.buckets)
+
+
+@dataclass(slots=True)
+class Usage:
+    outputs: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0
+
+    # outputs by bucket of tokens of `metrics.request_tokens`
+    prompt_buckets: list[int] = field(default_factory=_buckets)
+    completion_buckets: list[int] = field(default_factory=_buckets)
+
+    def add(self, other: "Usage"):
+        self.outputs += other.outputs
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+        for idx, count in enumerate(other.prompt_buckets):
+            self.prompt_buckets[idx] += count
+        for idx, count in enumerate(other.completion_buckets):
+            self.completion_buckets[idx] += count
+
+
+def charge(row: schema.Work | schema.Batch, usage: Usage):
+    """Add `usage` to the totals of a work or a batch."""
+
+    row.outputs += usage.outputs
+    row.prompt_tokens += usage.prompt_tokens
+    row.completion_tokens += usage.completion_tokens
+    row.cost += usage.cost
+
+
+def price_of(model: str | None, prices: dict[str, PriceConfig]) -> PriceConfig | None:
+    """Price of `model`, listed by its name or the longest prefix of it"""
+
+    if model is None:
+        return None
+    if (price := prices.get(model)) is not None:
+        return price
+
+    # dated snapshots, such as gpt-4o-mini-2024-07-18, are priced as gpt-4o-mini
+    prefixes = [name for name in prices if model.startswith(name)]
+    return prices[max(prefixes, key=len)] if prefixes else None
+
+
+class Ledger:
+    """Usage of the outputs delivered since the last checkpoint, by file."""
+
+    def __init__(
+        self,
+        prices: dict[str, PriceConfig] | None = None,
+        batch_ids: Mapping[str, str] | None = None,
+    ):
+        self.prices = global_config.prices if prices is None else prices
+        # the batch of each output file, charged along with its work
+        self.batch_ids = batch_ids or {}
+        self.settled: dict[str, Usage] = {}
+        self._prices: dict[str | None, PriceConfig | None] = {}
+        self._buckets = metrics.request_tokens.buckets
+
+    def count(self, usage: Usage, output: BatchOutputItem):
+        """Add the usage of `output` to `usage`."""
+
+        prompt = output.prompt_tokens or 0
+        completion = output.completion_tokens or 0
+        usage.outputs += 1
+        usage.prompt_tokens += prompt
+        usage.completion_tokens += completion
+        usage.prompt_buckets[bisect.bisect_left(self._buckets, prompt)] += 1
+        usage.completion_buckets[bisect.bisect_left(self._buckets, completion)] += 1
+
+        model = output.model
+        if (price := self._prices.get(model)) is None and model not in self._prices:
+            price = self._prices[model] = price_of(model, self.prices)
+        if price is not None:
+            usage.cost += (prompt * price.input + completion * price.output) / M
+
+    def settle(self, file_id: str, usage: Usage):
+        """Make `usage` of `file_id` part of the next checkpoint."""
+
+        if usage.outputs:
+            self.settled.setdefault(file_id, Usage()).add(usage)
+
+    def take(self) -> dict[str, Usage]:
+        """Usage settled since the last call, its histograms merged into `metrics`."""
+
+        settled, self.settled = self.settled, {}
+        for usage in settled.values():
+            metrics.request_tokens.merge(
+                usage.prompt_buckets, usage.prompt_tokens, kind="prompt"
+            )
+            metrics.request_tokens.merge(
+                usage.completion_buckets, usage.completion_tokens, kind="completion"
+            )
+            metrics.cost.inc(usage.cost)
+
+        return settled
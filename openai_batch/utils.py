@@ -1,5 +1,7 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, Iterable, Iterator
 
 
 def recursive_setattr(obj: object, attr: str, value: Any):
@@ -19,9 +21,38 @@ def recursive_getattr(obj: object, attr: str) -> Any:
     return obj
 
 
+def iter_lines(chunks: Iterable[bytes], keep_empty: bool = False) -> Iterator[bytes]:
+    """Lines of a stream of `chunks`, without their newlines."""
+
+    rest = b""
+    for chunk in chunks:
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        yield from (line for line in lines if keep_empty or line)
+
+    if rest:
+        yield rest
+
+
 def to_minutes(delta: timedelta) -> int:
     return int(delta.total_seconds() // 60)
 
 
 def timestamp() -> int:
     return int(datetime.now().timestamp())
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor | None:
+    """
+    Pool of `workers` processes started by a fork server, or spawned where
+    there is none, None for a single worker. Processes are not forked from the
+    caller, whose threads may hold locks the children would inherit. They
+    import the script of the runner as `__mp_main__`, which does not run it.
+    """
+
+    if workers <= 1:
+        return None
+
+    methods = mp.get_all_start_methods()
+    context = mp.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(workers, mp_context=context)
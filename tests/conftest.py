@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+import pytest
+
+from .fake_api import FakeOpenAI
+
+# `openai_batch` reads its config, database and OpenAI client at import time,
+# so everything has to point at the sandbox before the first import.
+_home = tempfile.mkdtemp(prefix="openai_batch_home_")
+_api = FakeOpenAI().start()
+
+os.environ["HOME"] = _home
+os.environ["OPENAI_API_KEY"] = "sk-fake"
+os.environ["OPENAI_BASE_URL"] = _api.base_url
+
+
+@pytest.fixture
+def fake_api():
+    _api.reset()
+    yield _api
+    _api.reset()
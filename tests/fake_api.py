@@ -0,0 +1,624 @@
+"""
+A local in-process stub of the OpenAI Files/Batches API.
+
+Only the subset used by `openai_batch` is implemented. Batches complete as
+soon as they are created (unless `auto_complete` is disabled), and every input
+line is answered by `FakeOpenAI.respond`.
+
+example:
+
+```python
+with FakeOpenAI() as api:
+    client = OpenAI(base_url=api.base_url, api_key="sk-fake")
+    client.batches.list()
+```
+"""
+
+import array
+import base64
+import collections
+import gzip
+import itertools
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+_COPY_SIZE = 1024 * 1024
+
+
+@dataclass
+class Fault:
+    status: int
+    count: int
+    path: str | None = None
+    retry_after: float | None = None
+
+
+@dataclass
+class FakeFile:
+    id: str
+    path: Path
+    filename: str
+    purpose: str
+    created_at: int = field(default_factory=lambda: int(time.time()))
+
+    @property
+    def bytes(self) -> int:
+        return self.path.stat().st_size
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "object": "file",
+            "bytes": self.bytes,
+            "created_at": self.created_at,
+            "filename": self.filename,
+            "purpose": self.purpose,
+            "status": "processed",
+        }
+
+
+class FakeOpenAI:
+    def __init__(self, root: Path | None = None, auto_complete: bool = True):
+        self._tmp = None if root else tempfile.mkdtemp(prefix="fake_openai_")
+        self.root = Path(root or self._tmp)
+        self.auto_complete = auto_complete
+        # how file contents are sent, to exercise both paths of clients
+        self.gzip_content = False
+        self.chunked_content = False
+        # batches over this many enqueued tokens (a token per 4 bytes) are rejected
+        self.enqueued_token_limit: int | None = None
+
+        self.files: dict[str, FakeFile] = {}
+        self.batches: dict[str, dict[str, Any]] = {}
+        self.calls: collections.Counter[tuple[str, str]] = collections.Counter()
+        self.faults: list[Fault] = []
+
+        self._ids = itertools.count()
+        self._lock = threading.RLock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.api = self  # type: ignore
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def start(self) -> "FakeOpenAI":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._tmp:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def __enter__(self) -> "FakeOpenAI":
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def reset(self):
+        with self._lock:
+            for file in self.files.values():
+                file.path.unlink(missing_ok=True)
+            self.files.clear()
+            self.batches.clear()
+            self.calls.clear()
+            self.faults.clear()
+            self.auto_complete = True
+            self.gzip_content = False
+            self.chunked_content = False
+            self.enqueued_token_limit = None
+
+    # ------------------------------ test controls ------------------------------ #
+
+    def inject(
+        self,
+        status: int,
+        count: int = 1,
+        path: str | None = None,
+        retry_after: float | None = None,
+    ):
+        """Answer the next `count` requests (matching `path` prefix) with `status`."""
+
+        with self._lock:
+            self.faults.append(Fault(status, count, path, retry_after))
+
+    def complete(self, batch_id: str):
+        with self._lock:
+            batch = self.batches[batch_id]
+            input_file = self.files[batch["input_file_id"]]
+            output_file = self._new_file("batch_output", f"{batch_id}_output.jsonl")
+            total = 0
+            with input_file.path.open("rb") as src, output_file.path.open("wb") as dst:
+                for total, line in enumerate(src, start=1):
+                    dst.write(self._answer(total, line, batch["endpoint"]))
+
+            batch.update(
+                status="completed",
+                output_file_id=output_file.id,
+                completed_at=int(time.time()),
+                request_counts={"total": total, "completed": total, "failed": 0},
+            )
+
+    def fail(self, batch_id: str, message: str = "failed by fake api"):
+        with self._lock:
+            batch = self.batches[batch_id]
+            error_file = self._new_file("batch_output", f"{batch_id}_error.jsonl")
+            error = {"code": "fake_error", "message": message}
+            with self.files[batch["input_file_id"]].path.open("rb") as src:
+                lines = [
+                    json.dumps(
+                        {
+                            "id": f"batch_req_{idx}",
+                            "custom_id": json.loads(line)["custom_id"],
+                            "response": None,
+                            "error": error,
+                        }
+                    )
+                    for idx, line in enumerate(src)
+                ]
+            error_file.path.write_text("".join(f"{line}\n" for line in lines))
+            batch.update(
+                status="failed",
+                error_file_id=error_file.id,
+                failed_at=int(time.time()),
+            )
+
+    # -------------------------------- responses -------------------------------- #
+
+    def respond(self, url: str, body: dict[str, Any]) -> dict[str, Any]:
+        """Response body of a single request, shared by batches and direct calls."""
+
+        model = body.get("model", "gpt-3.5-turbo")
+        if url.endswith("/embeddings"):
+            inputs = body["input"]
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            dimensions = body.get("dimensions", 8)
+            vectors = [
+                [float(len(text) + i) for i in range(dimensions)] for text in inputs
+            ]
+            data = [
+                {
+                    "object": "embedding",
+                    "index": idx,
+                    "embedding": (
+                        base64.b64encode(array.array("f", vector).tobytes()).decode()
+                        if body.get("encoding_format") == "base64"
+                        else vector
+                    ),
+                }
+                for idx, vector in enumerate(vectors)
+            ]
+            tokens = sum(len(text) for text in inputs) // 4
+            return {
+                "object": "list",
+                "model": model,
+                "data": data,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            }
+
+        messages = body.get("messages") or [{"content": ""}]
+        content = messages[-1].get("content") or ""
+        content = content if isinstance(content, str) else json.dumps(content)
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4
+
+        logprobs = None
+        if body.get("logprobs"):
+            # every character is a token, the `j`-th alternative of the `i`-th
+            # token is its character repeated `j + 2` times
+            def token(text: str, logprob: float) -> dict[str, Any]:
+                return {"token": text, "logprob": logprob, "bytes": list(text.encode())}
+
+            logprobs = {
+                "content": [
+                    {
+                        **token(char, -i / 10),
+                        "top_logprobs": [
+                            token(char * (j + 2), -i / 10 - j - 1)
+                            for j in range(body.get("top_logprobs") or 0)
+                        ],
+                    }
+                    for i, char in enumerate(content)
+                ]
+            }
+
+        return {
+            "id": f"chatcmpl-{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                    "logprobs": logprobs,
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": prompt_tokens + len(content) // 4,
+            },
+        }
+
+    def _answer(self, idx: int, line: bytes, endpoint: str) -> bytes:
+        request = json.loads(line)
+        output = {
+            "id": f"batch_req_{idx}",
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "request_id": f"req_{idx}",
+                "body": self.respond(endpoint, request["body"]),
+            },
+            "error": None,
+        }
+        return f"{json.dumps(output)}\n".encode()
+
+    # -------------------------------- internals -------------------------------- #
+
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}-{next(self._ids):08d}"
+
+    def _new_file(self, purpose: str, filename: str) -> FakeFile:
+        file_id = self._new_id("file")
+        file = FakeFile(
+            id=file_id,
+            path=self.root / file_id,
+            filename=filename,
+            purpose=purpose,
+        )
+        file.path.touch()
+        self.files[file_id] = file
+        return file
+
+    def enqueued_tokens(self) -> int:
+        with self._lock:
+            return sum(
+                self.files[batch["input_file_id"]].path.stat().st_size // 4
+                for batch in self.batches.values()
+                if batch["status"] in ("validating", "in_progress")
+            )
+
+    def _create_batch(self, body: dict[str, Any]) -> dict[str, Any]:
+        with self._lock:
+            if body["input_file_id"] not in self.files:
+                raise KeyError(body["input_file_id"])
+
+            tokens = self.files[body["input_file_id"]].path.stat().st_size // 4
+            over_limit = (
+                self.enqueued_token_limit is not None
+                and self.enqueued_tokens() + tokens > self.enqueued_token_limit
+            )
+
+            batch_id = self._new_id("batch")
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": body["endpoint"],
+                "input_file_id": body["input_file_id"],
+                "completion_window": body["completion_window"],
+                "status": "validating",
+                "created_at": int(time.time()),
+                "metadata": body.get("metadata"),
+            }
+            if over_limit:
+                self.batches[batch_id].update(
+                    status="failed",
+                    failed_at=int(time.time()),
+                    errors={
+                        "object": "list",
+                        "data": [
+                            {
+                                "code": "token_limit_exceeded",
+                                "message": "Enqueued token limit reached",
+                            }
+                        ],
+                    },
+                )
+            elif self.auto_complete:
+                self.complete(batch_id)
+
+            return self.batches[batch_id]
+
+    def _take_fault(self, path: str) -> Fault | None:
+        with self._lock:
+            for fault in self.faults:
+                if fault.path is None or path.startswith(fault.path):
+                    fault.count -= 1
+                    if fault.count <= 0:
+                        self.faults.remove(fault)
+                    return fault
+
+        return None
+
+
+def _list_page(items: list[dict[str, Any]], query: dict[str, list[str]]):
+    limit = int(query.get("limit", ["20"])[0])
+    if after := query.get("after", [None])[0]:
+        ids = [item["id"] for item in items]
+        items = items[ids.index(after) + 1 :] if after in ids else []
+
+    page = items[:limit]
+    return {
+        "object": "list",
+        "data": page,
+        "first_id": page[0]["id"] if page else None,
+        "last_id": page[-1]["id"] if page else None,
+        "has_more": len(items) > limit,
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def api(self) -> FakeOpenAI:
+        return self.server.api  # type: ignore
+
+    def log_message(self, format, *args):
+        pass
+
+    def _route(self) -> tuple[str, dict[str, list[str]]]:
+        url = urlsplit(self.path)
+        path = url.path.removeprefix("/v1")
+        return path, parse_qs(url.query)
+
+    def _send_json(self, obj: Any, status: int = HTTPStatus.OK, headers=None):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str, headers=None):
+        self._send_json(
+            {"error": {"message": message, "type": "fake_error", "code": None}},
+            status=status,
+            headers=headers,
+        )
+
+    def _send_file(self, file: FakeFile):
+        accept_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        if not (self.api.gzip_content and accept_gzip) and not self.api.chunked_content:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(file.bytes))
+            self.end_headers()
+            with file.path.open("rb") as f:
+                shutil.copyfileobj(f, self.wfile, _COPY_SIZE)
+            return
+
+        data = file.path.read_bytes()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/octet-stream")
+        if self.api.gzip_content and accept_gzip:
+            data = gzip.compress(data)
+            self.send_header("Content-Encoding", "gzip")
+        if self.api.chunked_content:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(data), _COPY_SIZE):
+                chunk = data[start : start + _COPY_SIZE]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def _read_body(self, dst) -> None:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while size := int(self.rfile.readline().strip().split(b";")[0], 16):
+                _copy(self.rfile, dst, size)
+                self.rfile.readline()
+            self.rfile.readline()
+        else:
+            _copy(self.rfile, dst, int(self.headers.get("Content-Length", 0)))
+
+    def _read_json(self) -> dict[str, Any]:
+        with tempfile.TemporaryFile() as f:
+            self._read_body(f)
+            f.seek(0)
+            return json.loads(f.read() or b"{}")
+
+    def _dispatch(self, method: str):
+        path, query = self._route()
+        route = re.sub(r"/(file|batch)-\d+", r"/{\1}", path)
+        self.api.calls[(method, route)] += 1
+
+        if fault := self.api._take_fault(path):
+            if method in ("POST", "PUT"):
+                self._read_body(_Null())
+            headers = {}
+            if fault.retry_after is not None:
+                headers["Retry-After"] = str(fault.retry_after)
+            return self._send_error(fault.status, "injected fault", headers)
+
+        handler = getattr(self, f"_{method.lower()}_{_generic(route)}", None)
+        if handler is None:
+            if method in ("POST", "PUT"):
+                self._read_body(_Null())
+            return self._send_error(HTTPStatus.NOT_FOUND, f"unknown route {path}")
+
+        parts = [p for p in path.split("/") if p.startswith(("file-", "batch-"))]
+        try:
+            handler(query, *parts)
+        except KeyError as e:
+            self._send_error(HTTPStatus.NOT_FOUND, f"not found: {e}")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    # ---------------------------------- files ---------------------------------- #
+
+    def _post_files(self, query):
+        with tempfile.TemporaryFile(dir=self.api.root) as body:
+            self._read_body(body)
+            body.flush()
+            boundary = re.search(r"boundary=\"?([^\";]+)", self.headers["Content-Type"])
+            assert boundary is not None
+            with self.api._lock:
+                file = self.api._new_file("batch", "upload.jsonl")
+            fields = _parse_multipart(body, boundary.group(1).encode(), file.path)
+
+        file.purpose = fields.get("purpose", "batch")
+        file.filename = fields.get("filename", file.filename)
+        self._send_json(file.to_json())
+
+    def _get_files(self, query):
+        files = [f.to_json() for f in self.api.files.values()]
+        if purpose := query.get("purpose", [None])[0]:
+            files = [f for f in files if f["purpose"] == purpose]
+        self._send_json(_list_page(files, {"limit": ["10000"], **query}))
+
+    def _get_files_file(self, query, file_id):
+        self._send_json(self.api.files[file_id].to_json())
+
+    def _get_files_file_content(self, query, file_id):
+        self._send_file(self.api.files[file_id])
+
+    def _delete_files_file(self, query, file_id):
+        with self.api._lock:
+            file = self.api.files.pop(file_id)
+        file.path.unlink(missing_ok=True)
+        self._send_json({"id": file_id, "object": "file", "deleted": True})
+
+    # --------------------------------- batches --------------------------------- #
+
+    def _post_batches(self, query):
+        self._send_json(self.api._create_batch(self._read_json()))
+
+    def _get_batches(self, query):
+        batches = sorted(
+            self.api.batches.values(),
+            key=lambda batch: batch["id"],
+            reverse=True,
+        )
+        self._send_json(_list_page(batches, query))
+
+    def _get_batches_batch(self, query, batch_id):
+        self._send_json(self.api.batches[batch_id])
+
+    def _post_batches_batch_cancel(self, query, batch_id):
+        self._read_body(_Null())
+        with self.api._lock:
+            batch = self.api.batches[batch_id]
+            if batch["status"] in ("validating", "in_progress", "finalizing"):
+                batch.update(status="cancelled", cancelled_at=int(time.time()))
+        self._send_json(batch)
+
+    # ------------------------------- completions ------------------------------- #
+
+    # ------------------------------ test controls ------------------------------ #
+
+    def _post__fake_complete(self, query):
+        """Complete every pending batch, for clients running in another process."""
+
+        self._read_body(_Null())
+        with self.api._lock:
+            pending = [
+                batch_id
+                for batch_id, batch in self.api.batches.items()
+                if batch["status"] == "validating"
+            ]
+            for batch_id in pending:
+                self.api.complete(batch_id)
+        self._send_json({"completed": pending})
+
+    def _post_chat_completions(self, query):
+        self._send_json(self.api.respond("/v1/chat/completions", self._read_json()))
+
+    def _post_embeddings(self, query):
+        self._send_json(self.api.respond("/v1/embeddings", self._read_json()))
+
+
+def _generic(route: str) -> str:
+    return (
+        route.strip("/")
+        .replace("{file}", "file")
+        .replace("{batch}", "batch")
+        .replace("/", "_")
+    )
+
+
+class _Null:
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+
+def _copy(src, dst, size: int):
+    while size > 0:
+        chunk = src.read(min(size, _COPY_SIZE))
+        if not chunk:
+            break
+        dst.write(chunk)
+        size -= len(chunk)
+
+
+def _parse_multipart(body, boundary: bytes, file_path: Path) -> dict[str, str]:
+    """Extract form fields from a multipart body, writing the file part to `file_path`."""
+
+    fields: dict[str, str] = {}
+    if os.fstat(body.fileno()).st_size == 0:
+        return fields
+
+    with mmap.mmap(body.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        delimiter = b"--" + boundary
+        start = data.find(delimiter)
+        while start != -1:
+            header_start = start + len(delimiter)
+            if data[header_start : header_start + 2] == b"--":
+                break
+            header_end = data.find(b"\r\n\r\n", header_start)
+            end = data.find(b"\r\n" + delimiter, header_end)
+            headers = data[header_start:header_end].decode()
+            name = re.search(r'name="([^"]*)"', headers)
+            filename = re.search(r'filename="([^"]*)"', headers)
+
+            if name and name.group(1) == "file":
+                data.seek(header_end + 4)
+                with file_path.open("wb") as f:
+                    _copy(data, f, end - header_end - 4)
+                if filename:
+                    fields["filename"] = filename.group(1)
+            elif name:
+                fields[name.group(1)] = data[header_end + 4 : end].decode()
+
+            start = end + 2 if end != -1 else -1
+
+    return fields
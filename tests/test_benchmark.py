@@ -0,0 +1,20 @@
+from benchmarks import pipeline, upload
+
+
+def test_pipeline_benchmark():
+    report = pipeline.run([100], content_size=10)
+
+    (result,) = report["results"]
+    phases = {phase["phase"]: phase for phase in result["phases"]}
+    assert list(phases) == ["transform", "upload", "check", "download"]
+    assert phases["download"]["items"] == 100
+    assert all(phase["peak_rss_mb"] > 0 for phase in phases.values())
+
+
+def test_upload_benchmark():
+    report = upload.run(size_mb=1, repeat=1)
+
+    results = {result["mode"]: result for result in report["results"]}
+    assert list(results) == ["read", "mmap"]
+    assert all(result["bytes"] > 0 for result in results.values())
+    assert all(result["cpu_seconds_per_gb"] > 0 for result in results.values())
@@ -0,0 +1,154 @@
+import json
+from typing import Iterable
+
+import pytest
+
+from openai_batch.db import schema, works_db
+from openai_batch.model import (
+    BatchInputItem,
+    BatchOutputItem,
+    ExportConfig,
+    LogprobsConfig,
+    WorkConfig,
+)
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+from openai_batch.status import checked, created
+from openai_batch.status.exception import StatusInterrupt
+
+
+class CrashingRunner(OpenAIBatchRunner):
+    work_config = WorkConfig(allow_same_dataset=True, checkpoint_interval=10)
+    # outputs received since the last flush are lost by a crash
+    received: list[str] = []
+    written: list[str] = []
+    crash_at: int | None = None
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        return []
+
+    @classmethod
+    def download(cls, output: Iterable[BatchOutputItem]):
+        for item in output:
+            if len(cls.written) + len(cls.received) == cls.crash_at:
+                cls.received.clear()
+                raise RuntimeError("crashed")
+            cls.received.append(item.id)
+
+    @classmethod
+    def flush(cls):
+        cls.written.extend(cls.received)
+        cls.received.clear()
+
+
+def _submitted(work: schema.Work, logprobs: bool = False):
+    assert work.id is not None
+
+    # 3 shards of 20 lines
+    archive = ShardArchive.of_work(work.uuid, compression="none")
+    with archive.writer(max_size=4000) as writer:
+        for idx in range(60):
+            line = {
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "messages": [{"role": "user", "content": "hi"}],
+                    "logprobs": logprobs,
+                },
+            }
+            writer.write(f"{json.dumps(line):<199}\n".encode())
+    archive.commit(writer.shards, dataset_hash=None)
+    assert len(archive.shards) == 3
+
+    result = created.upload(CrashingRunner.work_config, archive)
+    created.record(work.id, result)
+
+
+def test_exactly_once(fake_api):
+    work = create_work(CrashingRunner)
+    assert work.id is not None
+    _submitted(work)
+
+    CrashingRunner.crash_at = 35
+    with pytest.raises(RuntimeError):
+        checked.to_checked(work, CrashingRunner)
+
+    work = works_db.get_work(work.id)
+    assert work is not None
+    assert len(work.delivered_file_ids) == 1
+    assert list(work.download_offsets.values()) == [10]
+    assert len(CrashingRunner.written) == 30
+
+    contents = fake_api.calls[("GET", "/files/{file}/content")]
+    CrashingRunner.crash_at = None
+    with pytest.raises(StatusInterrupt):
+        checked.to_checked(work, CrashingRunner)
+
+    # the delivered file was not downloaded again
+    assert fake_api.calls[("GET", "/files/{file}/content")] - contents == 2
+    assert sorted(map(int, CrashingRunner.written)) == list(range(60))
+
+
+def test_resumed_export(tmp_path, fake_api, monkeypatch: pytest.MonkeyPatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    config = CrashingRunner.work_config.model_copy(
+        update={"export": ExportConfig(path=str(tmp_path), row_group_size=8)}
+    )
+    monkeypatch.setattr(CrashingRunner, "work_config", config)
+    monkeypatch.setattr(CrashingRunner, "written", [])
+    work = create_work(CrashingRunner)
+    assert work.id is not None
+    _submitted(work)
+
+    CrashingRunner.crash_at = 35
+    with pytest.raises(RuntimeError):
+        checked.to_checked(work, CrashingRunner)
+
+    # the outputs before the last checkpoint stay exported
+    (path,) = tmp_path.iterdir()
+    assert pq.read_table(path).num_rows == 30
+
+    work = works_db.get_work(work.id)
+    assert work is not None
+    CrashingRunner.crash_at = None
+    with pytest.raises(StatusInterrupt):
+        checked.to_checked(work, CrashingRunner)
+
+    # the resumed download adds parts under the same name
+    assert list(tmp_path.iterdir()) == [path]
+    assert sorted(map(int, pq.read_table(path)["id"].to_pylist())) == list(range(60))
+
+
+def test_resumed_logprobs(tmp_path, fake_api, monkeypatch: pytest.MonkeyPatch):
+    pytest.importorskip("numpy")
+    from openai_batch.logprobs import LogprobsStore
+
+    logprobs = LogprobsConfig(path=str(tmp_path))
+    config = CrashingRunner.work_config.model_copy(update={"logprobs": logprobs})
+    monkeypatch.setattr(CrashingRunner, "work_config", config)
+    monkeypatch.setattr(CrashingRunner, "written", [])
+    work = create_work(CrashingRunner)
+    assert work.id is not None
+    _submitted(work, logprobs=True)
+
+    CrashingRunner.crash_at = 35
+    with pytest.raises(RuntimeError):
+        checked.to_checked(work, CrashingRunner)
+
+    # the columns of outputs after the last checkpoint are dropped
+    store = LogprobsStore.of_config(logprobs)
+    columns = store.load()
+    assert len(columns.ids) == 30
+    assert len(columns.logprob) == 30 * len("hi")
+
+    work = works_db.get_work(work.id)
+    assert work is not None
+    CrashingRunner.crash_at = None
+    with pytest.raises(StatusInterrupt):
+        checked.to_checked(work, CrashingRunner)
+
+    columns = store.load()
+    assert sorted(map(int, columns.ids)) == list(range(60))
+    assert columns.offsets.tolist() == list(range(0, 121, 2))
@@ -0,0 +1,110 @@
+import io
+import json
+from datetime import timedelta
+from typing import Iterable
+
+import openai
+import pytest
+
+from openai_batch import cleanup
+from openai_batch.db import schema, works_db
+from openai_batch.model import BatchInputItem, BatchOutputItem, WorkConfig
+from openai_batch.openai import openai_file
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+from openai_batch.status import checked, created
+from openai_batch.status.exception import StatusInterrupt
+
+
+class CleanUpRunner(OpenAIBatchRunner):
+    work_config = WorkConfig(allow_same_dataset=True)
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        return []
+
+    @staticmethod
+    def download(output: Iterable[BatchOutputItem]):
+        pass
+
+
+def _work(tmp_path, status: schema.WorkStatus, shards: int = 3) -> schema.Work:
+    archive = ShardArchive(tmp_path / str(status.value), compression="none")
+    with archive.writer(max_size=300) as writer:
+        for idx in range(shards):
+            line = {
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"messages": [{"role": "user", "content": "hi"}]},
+            }
+            writer.write(f"{json.dumps(line):<199}\n".encode())
+    archive.commit(writer.shards, dataset_hash=None)
+
+    work = create_work(CleanUpRunner)
+    assert work.id is not None
+    created.record(work.id, created.upload(CleanUpRunner.work_config, archive))
+    # batches completed by the fake API are marked done
+    with pytest.raises(StatusInterrupt):
+        checked.to_checked(work, CleanUpRunner)
+
+    return works_db.update_work_status(work.id, status)
+
+
+def _files(work: schema.Work) -> set[str]:
+    assert work.id is not None
+    return {
+        file_id
+        for batch in works_db.list_batches(work.id)
+        for file_id in (batch.input_file_id, batch.output_file_id)
+        if file_id is not None
+    }
+
+
+def test_clean_up_resumes(tmp_path, fake_api):
+    work = _work(tmp_path, schema.WorkStatus.Checked)
+    # input and output of each batch
+    assert len(fake_api.files) == 6
+
+    fake_api.inject(400, count=1, path="/files")
+    with pytest.raises(openai.BadRequestError):
+        cleanup.clean_up(work)
+
+    assert work.id is not None
+    work = works_db.get_work(work.id)
+    assert work is not None
+    deleted = set(work.deleted_file_ids)
+    assert deleted.isdisjoint(fake_api.files)
+
+    assert cleanup.clean_up(work) == 6 - len(deleted)
+    assert not fake_api.files
+    # files deleted by the first attempt were not deleted again
+    assert fake_api.calls[("DELETE", "/files/{file}")] == 6 + 1
+
+
+def test_find_orphans(tmp_path, fake_api):
+    completed = _work(tmp_path, schema.WorkStatus.Completed, shards=2)
+    unfinished = _work(tmp_path, schema.WorkStatus.Checked, shards=1)
+    # an input whose batch was never created, and a file of another tool
+    unused = openai_file.upload(
+        io.BytesIO(b"{}\n"), purpose="batch", filename="shard-00007.jsonl"
+    )
+    other = openai_file.upload(
+        io.BytesIO(b"{}\n"), purpose="batch", filename="mine.jsonl"
+    )
+
+    for file in fake_api.files.values():
+        file.created_at -= 3600
+
+    orphans = cleanup.find_orphans(older_than=timedelta(minutes=1))
+    orphan_ids = {orphan.file.id for orphan in orphans}
+
+    completed_files = _files(completed)
+    assert orphan_ids == completed_files | {unused.id}
+
+    # young files are kept
+    assert not cleanup.find_orphans(older_than=timedelta(days=1))
+
+    assert cleanup.gc(orphans) == 5
+    # files of the unfinished work, and `other`
+    assert set(fake_api.files) == {other.id, *_files(unfinished)}
@@ -0,0 +1,128 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from openai_batch import BatchClient, metrics
+from openai_batch.client import _read
+from openai_batch.db import schema, works_db
+from openai_batch.exception import OpenAIBatchException
+from openai_batch.model import BatchInputItem, BatchOutputItem, WorkConfig
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+
+
+def _items(count: int):
+    for idx in range(count):
+        yield BatchInputItem(
+            id=str(idx),
+            messages=[{"role": "user", "content": "x" * idx}],
+        )
+
+
+CONFIG = WorkConfig(allow_same_dataset=True, check_interval=timedelta(seconds=0.01))
+
+
+def test_submit_and_wait(fake_api):
+    fake_api.auto_complete = False
+    client = BatchClient()
+    handles = [client.submit(_items(20), CONFIG) for _ in range(3)]
+    assert [handle.status() for handle in handles] == [schema.WorkStatus.Checked] * 3
+    assert list(handles[0].results()) == []
+
+    async def main():
+        waiting = [asyncio.create_task(handle.wait()) for handle in handles]
+        await asyncio.sleep(0.05)
+        assert not any(task.done() for task in waiting)
+
+        for batch_id in list(fake_api.batches):
+            fake_api.complete(batch_id)
+        return await asyncio.gather(*waiting)
+
+    assert asyncio.run(main()) == [schema.WorkStatus.Completed] * 3
+    # stopped works are not kept by the client
+    assert not (client._due or client._locks or client._runners)
+    for handle in handles:
+        assert [output.id for output in handle.results()] == [
+            str(idx) for idx in range(20)
+        ]
+        assert list(handle.errors()) == []
+
+    # the work is found again by another client
+    handle = BatchClient().handle(handles[0].id)
+    assert asyncio.run(handle.wait()) == schema.WorkStatus.Completed
+    assert len(list(handle.results())) == 20
+
+
+class ScriptRunner(OpenAIBatchRunner):
+    @staticmethod
+    def upload():
+        return []
+
+    @staticmethod
+    def download(output):
+        pass
+
+
+def test_handle_of_script_work():
+    work = create_work(ScriptRunner)
+    assert work.id is not None
+    with pytest.raises(OpenAIBatchException, match="checked by its script"):
+        BatchClient().handle(work.id)
+
+
+def test_submit_invalid_input(fake_api):
+    client = BatchClient()
+    items = [*_items(5), *_items(1)]  # a duplicate id fails the preflight
+    handle = client.submit(items, CONFIG)
+
+    assert handle.status() == schema.WorkStatus.Failed
+    assert asyncio.run(handle.wait()) == schema.WorkStatus.Failed
+    assert fake_api.calls[("POST", "/files")] == 0
+    assert not (client._due or client._locks or client._runners)
+    work = works_db.get_work(handle.id)
+    assert work is not None
+    assert not ShardArchive.of_work(work.uuid).root.exists()
+
+
+def test_asubmit(fake_api):
+    client = BatchClient()
+
+    async def main():
+        handle = await client.asubmit(_items(5), CONFIG)
+        return await handle.wait(), handle
+
+    status, handle = asyncio.run(main())
+    assert status == schema.WorkStatus.Completed
+    assert len(list(handle.results())) == 5
+
+
+def test_metrics_of_works(tmp_path, fake_api, monkeypatch):
+    monkeypatch.setattr(
+        metrics,
+        "global_config",
+        metrics.global_config.model_copy(
+            update={"metrics_textfile_dir": str(tmp_path)}
+        ),
+    )
+    client = BatchClient()
+    handles = [client.submit(_items(5), CONFIG) for _ in range(2)]
+
+    for handle in handles:
+        text = (tmp_path / f"openai_batch_work_{handle.id}.prom").read_text()
+        assert (
+            f'openai_batch_transformed_items_total{{work_id="{handle.id}"}} 5' in text
+        )
+
+
+def test_results_of_earlier_versions(tmp_path):
+    # the custom id was written as `batch_id` and the request id as `id`
+    path = tmp_path / "1.outputs.jsonl"
+    path.write_text('{"batch_id": "1", "id": "batch_req_1", "status": "success"}\n')
+
+    (output,) = _read(path, BatchOutputItem)
+    assert output.request_id == "batch_req_1"
+    assert output.id == "1"
+
+    with pytest.deprecated_call():
+        assert output.batch_id == "1"
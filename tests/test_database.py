@@ -0,0 +1,123 @@
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+from openai_batch.config import global_config
+from openai_batch.db import schema, works_db
+from openai_batch.db.database import MIGRATIONS, OpenAIBatchDatabase
+from openai_batch.shard import ShardArchive
+
+
+def _work() -> schema.Work:
+    return works_db.create_work(
+        schema.Work(interpreter_path="", script="", class_name="", work_dir="")
+    )
+
+
+def test_delete_work_with_batches():
+    work = _work()
+    assert work.id is not None
+    works_db.add_batches(
+        schema.Batch(
+            id=f"batch_{work.id}_{idx}",
+            work_id=work.id,
+            status="in_progress",
+            input_file_id=f"file-{idx}",
+        )
+        for idx in range(3)
+    )
+    assert len(works_db.list_batches(work.id)) == 3
+
+    assert works_db.delete_work(work.id) is not None
+    assert works_db.get_work(work.id) is None
+    assert works_db.list_batches(work.id) == []
+
+
+def _archive(archive: ShardArchive) -> ShardArchive:
+    with archive.writer() as writer:
+        writer.write(b"{}\n")
+    archive.commit(writer.shards, dataset_hash=None)
+    return archive
+
+
+def test_delete_work_with_shards():
+    work = _work()
+    assert work.id is not None
+    archive = _archive(ShardArchive.of_work(work.uuid))
+
+    assert works_db.delete_work(work.id) is not None
+    assert not archive.root.exists()
+
+
+def test_shards_of_another_work():
+    work, other = _work(), _work()
+    archive = _archive(ShardArchive.of_work(work.uuid))
+    assert ShardArchive.of_work(work.uuid).load()
+
+    # shards left under the name of another work are not reused
+    archive.root.rename(ShardArchive.of_work(other.uuid).root)
+    assert not ShardArchive.of_work(other.uuid).load()
+
+
+# tables written by the first version, before `migrate`
+FIRST_VERSION = [
+    """
+    CREATE TABLE work (
+        id INTEGER NOT NULL,
+        created_at DATETIME NOT NULL,
+        updated_at DATETIME NOT NULL,
+        name VARCHAR,
+        dataset_hash VARCHAR,
+        status VARCHAR(9) NOT NULL,
+        interpreter_path VARCHAR NOT NULL,
+        script VARCHAR NOT NULL,
+        class_name VARCHAR NOT NULL,
+        work_dir VARCHAR NOT NULL,
+        undone_batch_ids JSON,
+        done_batch_ids JSON,
+        PRIMARY KEY (id),
+        UNIQUE (dataset_hash)
+    )
+    """,
+    """
+    INSERT INTO work VALUES (
+        1, '2024-07-01 12:00:00.000000', '2024-07-01 12:00:00.000000', 'old',
+        NULL, 'Checked', 'python', '', 'Runner', '/tmp',
+        '["batch_undone"]', '["batch_done"]'
+    ), (
+        2, '2024-07-01 12:00:00.000000', '2024-07-01 12:00:00.000000', 'done',
+        NULL, 'Completed', 'python', '', 'Runner', '/tmp', '[]', '[]'
+    )
+    """,
+]
+
+
+def test_migrate_first_version(tmp_path):
+    path = tmp_path / "works.sqlite"
+    with sqlite3.connect(path) as conn:
+        for statement in FIRST_VERSION:
+            conn.execute(statement)
+
+    # shards were kept in directories named by the id of their work
+    shards = Path(global_config.save_path) / "shards"
+    for name in ("1", "2", "3"):
+        _archive(ShardArchive(shards / name))
+
+    db = OpenAIBatchDatabase(path)
+    work, done = db.list_works()
+    assert work.uuid and work.uuid != done.uuid
+    assert ShardArchive.of_work(work.uuid).load()
+    assert not any((shards / name).exists() for name in ("1", "2", "3"))
+    assert work.status == schema.WorkStatus.Checked
+    assert (work.pending_shards, work.download_offsets, work.outputs) == ([], {}, 0)
+    assert work.config is None and work.snapshot_at is None
+
+    batches = {batch.id: batch for batch in db.list_batches(1)}
+    assert batches["batch_undone"].state == schema.BatchState.Undone
+    assert batches["batch_done"].state == schema.BatchState.Done
+    assert batches["batch_done"].created_at == datetime(2024, 7, 1, 12)
+
+    # migrated once
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone() == (len(MIGRATIONS),)
+    assert len(OpenAIBatchDatabase(path).list_batches(1)) == 2
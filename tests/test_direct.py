@@ -0,0 +1,110 @@
+import asyncio
+import time
+from typing import Iterable
+
+import pytest
+
+from openai_batch.db import schema, works_db
+from openai_batch.model import (
+    BatchInputItem,
+    BatchOutputItem,
+    BatchRequestInputItem,
+    DirectConfig,
+    WorkConfig,
+)
+from openai_batch.openai.direct import TokenBucket, execute
+from openai_batch.runner import OpenAIBatchRunner
+from openai_batch.status.direct import from_created_direct
+from openai_batch.status.exception import StatusInterrupt
+
+
+def _requests(count: int) -> Iterable[BatchRequestInputItem]:
+    config = WorkConfig()
+    for idx in range(count):
+        item = BatchInputItem(
+            id=str(idx),
+            messages=[{"role": "user", "content": f"hello {idx}"}],
+        )
+        yield BatchRequestInputItem.from_input(config, item)
+
+
+def test_token_bucket():
+    async def acquire_all():
+        bucket = TokenBucket(rate=50, capacity=1)
+        for _ in range(10):
+            await bucket.acquire()
+
+    start = time.monotonic()
+    asyncio.run(acquire_all())
+    assert time.monotonic() - start >= 9 / 50
+
+
+def test_execute(fake_api):
+    config = DirectConfig(base_url=fake_api.base_url, concurrency=4)
+    outputs = list(execute(_requests(50), config))
+
+    assert sorted(int(output.custom_id) for output in outputs) == list(range(50))
+    for output in outputs:
+        assert output.response is not None
+        assert output.response.body.choices[0].message.content == (
+            f"hello {output.custom_id}"
+        )
+
+
+def test_execute_retries(fake_api):
+    fake_api.inject(429, count=3, path="/chat/completions", retry_after=0.01)
+    config = DirectConfig(base_url=fake_api.base_url, concurrency=1, max_retries=3)
+
+    (output,) = execute(_requests(1), config)
+
+    assert output.error is None
+    assert fake_api.calls[("POST", "/chat/completions")] == 4
+
+
+def test_execute_failed(fake_api):
+    fake_api.inject(400, count=1, path="/chat/completions")
+    config = DirectConfig(base_url=fake_api.base_url, max_retries=0)
+
+    (output,) = execute(_requests(1), config)
+
+    assert output.error is not None
+    assert output.error.code == "400"
+    assert output.to_output().status == "failed"
+
+
+def test_from_created_direct(fake_api):
+    delivered: list[BatchOutputItem] = []
+
+    class DirectRunner(OpenAIBatchRunner):
+        work_config = WorkConfig(
+            backend="direct",
+            direct=DirectConfig(base_url=fake_api.base_url),
+        )
+
+        @staticmethod
+        def upload() -> Iterable[BatchInputItem]:
+            for idx in range(10):
+                yield BatchInputItem(
+                    id=str(idx),
+                    messages=[{"role": "user", "content": "hi"}],
+                )
+
+        @staticmethod
+        def download(output: Iterable[BatchOutputItem]):
+            delivered.extend(output)
+
+    work = works_db.create_work(
+        schema.Work(interpreter_path="", script="", class_name="", work_dir="")
+    )
+    with pytest.raises(StatusInterrupt) as interrupt:
+        from_created_direct(work, DirectRunner)
+
+    assert interrupt.value.status == schema.WorkStatus.Completed
+    assert len(delivered) == 10
+    assert all(item.status == "success" for item in delivered)
+
+    assert work.id is not None
+    work = works_db.get_work(work.id)
+    assert work is not None
+    assert work.outputs == 10
+    assert work.prompt_tokens == sum(item.prompt_tokens or 0 for item in delivered)
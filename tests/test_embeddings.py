@@ -0,0 +1,119 @@
+import base64
+import json
+
+import pytest
+
+from openai_batch.model import (
+    BatchOutputItem,
+    EmbeddingInputItem,
+    EmbeddingsConfig,
+    WorkConfig,
+)
+from openai_batch.shard import ShardArchive
+from openai_batch.status import created, utils
+
+np = pytest.importorskip("numpy")
+
+from openai_batch.embeddings import EmbeddingStore  # noqa: E402
+
+
+def _line(custom_id: str, embedding) -> str:
+    return json.dumps(
+        {
+            "id": f"batch_req_{custom_id}",
+            "custom_id": custom_id,
+            "response": {
+                "status_code": 200,
+                "request_id": "req",
+                "body": {
+                    "object": "list",
+                    "model": "text-embedding-3-small",
+                    "data": [
+                        {"object": "embedding", "index": 0, "embedding": embedding}
+                    ],
+                    "usage": {"prompt_tokens": 1, "total_tokens": 1},
+                },
+            },
+            "error": None,
+        }
+    )
+
+
+def test_store(tmp_path):
+    store = EmbeddingStore(tmp_path / "embeddings.npy")
+    with store.ids_writer() as write_id:
+        for custom_id in ("a", "b", "c", "d"):
+            write_id(custom_id)
+
+    vectors = np.arange(12, dtype=np.float32).reshape(4, 3)
+    lines = [
+        _line("c", base64.b64encode(vectors[2].tobytes()).decode()),
+        _line("a", vectors[0].tolist()),
+        json.dumps(
+            {
+                "id": "batch_req_b",
+                "custom_id": "b",
+                "response": None,
+                "error": {"code": "bad_request", "message": "too long"},
+            }
+        ),
+    ]
+    outputs = list(store.write(lines))
+
+    assert [(output.id, output.status) for output in outputs] == [
+        ("c", "success"),
+        ("a", "success"),
+        ("b", "failed"),
+    ]
+
+    # outputs of later batches are added to the same array
+    assert [
+        output.status for output in store.write([_line("d", vectors[3].tolist())])
+    ] == ["success"]
+
+    embeddings, mask = store.load()
+    assert mask.tolist() == [True, False, True, True]
+    assert np.array_equal(embeddings[mask], vectors[mask])
+
+
+@pytest.mark.parametrize("encoding_format", ["base64", "float"])
+def test_download(tmp_path, fake_api, encoding_format):
+    config = WorkConfig(
+        endpoint="/v1/embeddings",
+        allow_same_dataset=True,
+        embeddings=EmbeddingsConfig(path=str(tmp_path / "embeddings.npy")),
+    )
+    items = [
+        EmbeddingInputItem(
+            id=f"item-{idx}",
+            input="x" * idx,
+            dimensions=4,
+            encoding_format=encoding_format,
+        )
+        for idx in range(20)
+    ]
+
+    archive = ShardArchive(tmp_path / "shards")
+    created.transform(config, items, archive)
+    (batch_id,) = created.upload(config, archive).batch_ids
+
+    class Runner:
+        work_config = config
+        outputs: list[BatchOutputItem] = []
+
+        @classmethod
+        def download(cls, output):
+            cls.outputs.extend(output)
+
+    utils.download(Runner, [fake_api.batches[batch_id]["output_file_id"]])  # type: ignore
+
+    assert [output.id for output in Runner.outputs] == [item.id for item in items]
+    embeddings, mask = EmbeddingStore.of_config(config.embeddings).load()  # type: ignore
+    assert mask.all()
+    # the fake embeds a text of length `n` as [n, n + 1, ...]
+    assert np.array_equal(embeddings, np.arange(20)[:, None] + np.arange(4))
+
+
+def test_config():
+    with pytest.raises(ValueError):
+        WorkConfig(embeddings=EmbeddingsConfig(path="embeddings.npy"))
@@ -0,0 +1,127 @@
+import itertools
+from typing import Iterable
+
+import pytest
+from typer.testing import CliRunner
+
+from openai_batch.cli import app
+from openai_batch.db import schema
+from openai_batch.model import BatchInputItem, BatchOutputItem, ExportConfig, WorkConfig
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+from openai_batch.status import checked, created
+from openai_batch.status.exception import StatusInterrupt
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from openai_batch.export import ParquetSink, export  # noqa: E402
+
+
+def _outputs(count: int) -> Iterable[BatchOutputItem]:
+    for idx in range(count):
+        yield BatchOutputItem(
+            request_id="batch_req",
+            id=str(idx),
+            status="success" if idx % 3 else "failed",
+            response=str(idx) if idx % 3 else None,
+            error=None if idx % 3 else "failed",
+            prompt_tokens=idx,
+        )
+
+
+def test_sink(tmp_path):
+    path = tmp_path / "outputs.parquet"
+    assert export(_outputs(25), path, row_group_size=10) == 25
+
+    file = pq.ParquetFile(path)
+    assert [file.metadata.row_group(i).num_rows for i in range(3)] == [10, 10, 5]
+
+    table = file.read()
+    assert table["id"].to_pylist() == [str(idx) for idx in range(25)]
+    assert table["status"].to_pylist()[:3] == ["failed", "success", "success"]
+    assert table["completion_tokens"].null_count == 25
+
+
+def test_sink_discarded_on_error(tmp_path):
+    path = tmp_path / "outputs.parquet"
+    with pytest.raises(RuntimeError):
+        with ParquetSink(path) as sink:
+            sink.write(next(iter(_outputs(1))))
+            raise RuntimeError
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sink_parts(tmp_path):
+    path = tmp_path / "outputs"
+    outputs = iter(_outputs(25))
+    with pytest.raises(RuntimeError):
+        with ParquetSink(path, parts=True) as sink:
+            for output in itertools.islice(outputs, 10):
+                sink.write(output)
+            sink.commit()
+            sink.commit()  # nothing written since
+            sink.write(next(outputs))
+            raise RuntimeError
+
+    # outputs after the last commit are discarded
+    assert [part.name for part in path.iterdir()] == ["part-00000.parquet"]
+
+    with ParquetSink(path, parts=True) as sink:
+        for output in outputs:
+            sink.write(output)
+
+    assert sorted(part.name for part in path.iterdir()) == [
+        "part-00000.parquet",
+        "part-00001.parquet",
+    ]
+    ids = pq.read_table(path)["id"].to_pylist()
+    assert ids == [str(idx) for idx in range(25) if idx != 10]
+
+
+class ExportRunner(OpenAIBatchRunner):
+    outputs: list[BatchOutputItem] = []
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        for idx in range(30):
+            yield BatchInputItem(
+                id=str(idx),
+                messages=[{"role": "user", "content": "x" * idx}],
+            )
+
+    @classmethod
+    def download(cls, output: Iterable[BatchOutputItem]):
+        cls.outputs.extend(output)
+
+
+def test_export_while_downloading(tmp_path, fake_api):
+    ExportRunner.work_config = WorkConfig(
+        allow_same_dataset=True,
+        export=ExportConfig(path=str(tmp_path / "export"), row_group_size=8),
+    )
+    work = create_work(ExportRunner)
+    assert work.id is not None
+
+    archive = ShardArchive(tmp_path / "shards")
+    created.transform(ExportRunner.work_config, ExportRunner.upload(), archive)
+    created.record(work.id, created.upload(ExportRunner.work_config, archive))
+
+    with pytest.raises(StatusInterrupt) as interrupt:
+        checked.to_checked(work, ExportRunner)
+    assert interrupt.value.status == schema.WorkStatus.Completed
+
+    (path,) = (tmp_path / "export").iterdir()
+    table = pq.read_table(path)
+    assert table["id"].to_pylist() == [output.id for output in ExportRunner.outputs]
+    assert table["response"].to_pylist() == ["x" * idx for idx in range(30)]
+    assert table["completion_tokens"].to_pylist() == [idx // 4 for idx in range(30)]
+
+    # the command downloads the outputs again
+    output = tmp_path / "work.parquet"
+    result = CliRunner().invoke(app, ["export", str(work.id), "-o", str(output)])
+    assert result.exit_code == 0, result.output
+    assert pq.read_table(output).equals(table)
+
+    result = CliRunner().invoke(app, ["inspect", str(work.id), "--batches"])
+    assert result.exit_code == 0, result.output
@@ -0,0 +1,166 @@
+import json
+import math
+from typing import Sequence
+
+import pytest
+
+from openai_batch.model import (
+    BatchInputItem,
+    BatchOutputItem,
+    LogprobsConfig,
+    WorkConfig,
+)
+from openai_batch.shard import ShardArchive
+from openai_batch.status import created, utils
+
+np = pytest.importorskip("numpy")
+
+from openai_batch.logprobs import LogprobsStore  # noqa: E402
+
+
+def _token(text: str, logprob: float, top: Sequence[tuple[str, float]] = ()):
+    return {
+        "token": text,
+        "logprob": logprob,
+        "bytes": list(text.encode()),
+        "top_logprobs": [
+            {"token": t, "logprob": p, "bytes": list(t.encode())} for t, p in top
+        ],
+    }
+
+
+def _line(custom_id: str, content: list[dict]) -> str:
+    text = "".join(token["token"] for token in content)
+    return json.dumps(
+        {
+            "id": f"batch_req_{custom_id}",
+            "custom_id": custom_id,
+            "response": {
+                "status_code": 200,
+                "request_id": "req",
+                "body": {
+                    "id": "chatcmpl",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": "gpt-4o-mini",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                            "logprobs": {"content": content},
+                        }
+                    ],
+                },
+            },
+            "error": None,
+        }
+    )
+
+
+def test_store(tmp_path):
+    store = LogprobsStore(tmp_path / "logprobs", top_logprobs=2)
+
+    lines = [
+        _line("a", [_token("Hi", -0.5, [("Hi", -0.5), ("Hey", -1.5)])]),
+        json.dumps(
+            {
+                "id": "batch_req_b",
+                "custom_id": "b",
+                "response": None,
+                "error": {"code": "bad_request", "message": "too long"},
+            }
+        ),
+        _line("c", [_token("é", -0.25, [("é", -0.25)]), _token("!", -1, [])]),
+    ]
+    outputs = list(store.write(lines))
+
+    assert [(output.id, output.status, output.response) for output in outputs] == [
+        ("a", "success", "Hi"),
+        ("b", "failed", None),
+        ("c", "success", "é!"),
+    ]
+
+    # outputs of later batches are appended
+    list(store.write([_line("d", [_token("x", -2)])]))
+
+    columns = store.load()
+    assert columns.ids == ["a", "c", "d"]
+    assert columns.offsets.tolist() == [0, 1, 3, 4]
+    assert [columns.tokens(i) for i in range(3)] == [["Hi"], ["é", "!"], ["x"]]
+    assert columns.logprobs(1).tolist() == [-0.25, -1]
+
+    top = columns.top_logprob.tolist()
+    assert top[0] == [-0.5, -1.5]
+    assert top[1][0] == -0.25 and math.isnan(top[1][1])
+    assert columns.top_token_offsets.tolist() == [[2, 5], [7, 7], [7, 7], [7, 7]]
+    assert columns.top_token_bytes.tobytes() == "HiHeyé".encode()
+
+
+def test_store_top_logprobs_mismatch(tmp_path):
+    list(LogprobsStore(tmp_path, top_logprobs=1).write([]))
+
+    with pytest.raises(Exception, match="top logprobs"):
+        list(LogprobsStore(tmp_path, top_logprobs=2).write([]))
+
+
+def test_download(tmp_path, fake_api):
+    config = WorkConfig(
+        allow_same_dataset=True,
+        logprobs=LogprobsConfig(path=str(tmp_path / "logprobs"), top_logprobs=3),
+    )
+    items = [
+        BatchInputItem(
+            id=f"item-{idx}",
+            messages=[{"role": "user", "content": "x" * idx}],
+            logprobs=True,
+            top_logprobs=idx % 5,
+        )
+        for idx in range(20)
+    ]
+
+    archive = ShardArchive(tmp_path / "shards")
+    created.transform(config, items, archive)
+    (batch_id,) = created.upload(config, archive).batch_ids
+
+    class Runner:
+        work_config = config
+        outputs: list[BatchOutputItem] = []
+
+        @classmethod
+        def download(cls, output):
+            cls.outputs.extend(output)
+
+    utils.download(Runner, [fake_api.batches[batch_id]["output_file_id"]])  # type: ignore
+
+    assert [output.response for output in Runner.outputs] == [
+        "x" * idx for idx in range(20)
+    ]
+
+    columns = LogprobsStore.of_config(config.logprobs).load()  # type: ignore
+    assert columns.ids == [item.id for item in items]
+    assert np.diff(columns.offsets).tolist() == list(range(20))
+    assert columns.tokens(3) == ["x"] * 3
+    assert np.allclose(columns.logprobs(3), [0, -0.1, -0.2])
+
+    # the fake gives `top_logprobs` alternatives, truncated or padded to 3
+    start = columns.offsets[4]
+    assert np.allclose(columns.top_logprob[start], [-1, -2, -3])
+    assert np.isnan(columns.top_logprob[columns.offsets[1], 1:]).all()
+
+
+def test_config():
+    with pytest.raises(ValueError):
+        WorkConfig(
+            endpoint="/v1/embeddings",
+            logprobs=LogprobsConfig(path="logprobs"),
+        )
+
+
+def test_store_without_top_logprobs(tmp_path):
+    store = LogprobsStore(tmp_path)
+    list(store.write([_line("a", [_token("a", -1), _token("b", -2)])]))
+
+    columns = store.load()
+    assert columns.tokens(0) == ["a", "b"]
+    assert columns.top_logprob.shape == (2, 0)
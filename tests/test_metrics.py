@@ -0,0 +1,99 @@
+import urllib.request
+
+from openai_batch import metrics
+from openai_batch.model import BatchInputItem, WorkConfig
+from openai_batch.shard import ShardArchive
+from openai_batch.status import created
+
+
+def test_exposition():
+    registry = metrics.Registry()
+    registry.const_labels["work_id"] = "1"
+    counter = metrics.Counter("items", "Items.", registry=registry)
+    histogram = metrics.Histogram(
+        "latency_seconds",
+        "Latency.",
+        labelnames=("endpoint",),
+        buckets=(0.1, 1.0),
+        registry=registry,
+    )
+
+    counter.inc(3)
+    histogram.observe(0.5, endpoint="files.upload")
+    histogram.observe(2, endpoint="files.upload")
+
+    text = registry.exposition()
+    assert "# TYPE items_total counter" in text
+    assert 'items_total{work_id="1"} 3' in text
+    assert (
+        'latency_seconds_bucket{work_id="1",endpoint="files.upload",le="0.1"} 0' in text
+    )
+    assert (
+        'latency_seconds_bucket{work_id="1",endpoint="files.upload",le="1"} 1' in text
+    )
+    assert (
+        'latency_seconds_bucket{work_id="1",endpoint="files.upload",le="+Inf"} 2'
+        in text
+    )
+    assert 'latency_seconds_sum{work_id="1",endpoint="files.upload"} 2.5' in text
+
+
+def test_exporters(tmp_path):
+    registry = metrics.Registry()
+    metrics.Gauge("up", "Up.", registry=registry).set(1)
+
+    server = metrics.serve(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as resp:
+            assert "up 1" in resp.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    path = tmp_path / "openai_batch.prom"
+    metrics.write_textfile(path, registry=registry)
+    assert "up 1" in path.read_text()
+
+
+def test_works_of_one_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        metrics,
+        "global_config",
+        metrics.global_config.model_copy(
+            update={"metrics_textfile_dir": str(tmp_path)}
+        ),
+    )
+    registry = metrics.Registry()
+    counter = metrics.Counter("items", "Items.", registry=registry)
+
+    with metrics.exporting(1, registry=registry):
+        counter.inc(1)
+        with metrics.exporting(2, registry=registry):
+            counter.inc(2)
+        counter.inc(1)
+
+    text = registry.exposition()
+    assert 'items_total{work_id="1"} 2' in text
+    assert 'items_total{work_id="2"} 2' in text
+
+    text = (tmp_path / "openai_batch_work_2.prom").read_text()
+    assert 'items_total{work_id="2"} 2' in text
+    assert 'work_id="1"' not in text
+
+
+def test_pipeline_metrics(tmp_path, fake_api):
+    config = WorkConfig()
+    items = (
+        BatchInputItem(id=str(idx), messages=[{"role": "user", "content": "hi"}])
+        for idx in range(10)
+    )
+    transformed = metrics.transformed_items.get()
+    uploads = metrics.api_latency.count(endpoint="files.upload")
+
+    archive = ShardArchive(tmp_path)
+    created.transform(config, items, archive)
+    created.upload(config, archive)
+
+    assert metrics.transformed_items.get() == transformed + 10
+    assert metrics.api_latency.count(endpoint="files.upload") == uploads + 1
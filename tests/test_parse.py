@@ -0,0 +1,117 @@
+import itertools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable
+
+import pytest
+
+from openai_batch.model import BatchInputItem, BatchOutputItem, WorkConfig
+from openai_batch.parse import line_offset, parse_file, split
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+from openai_batch.status import checked, created
+from openai_batch.status.exception import StatusInterrupt
+
+
+def output_line(idx: int) -> str:
+    line = {
+        "id": f"batch_req_{idx}",
+        "custom_id": str(idx),
+        "response": {
+            "status_code": 200,
+            "request_id": f"req_{idx}",
+            "body": {
+                "id": f"chatcmpl-{idx}",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "gpt-4o-mini",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"answer {idx}"},
+                        "finish_reason": "stop",
+                    }
+                ],
+            },
+        },
+        "error": None,
+    }
+    return json.dumps(line) + "\n"
+
+
+def test_split(tmp_path: Path):
+    path = tmp_path / "output.jsonl"
+    path.write_text("".join(f"line {idx}\n" for idx in range(100)))
+    data = path.read_bytes()
+
+    ranges = split(path, size=64)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in itertools.pairwise(ranges):
+        assert end == start and data[end - 1 : end] == b"\n"
+
+    assert line_offset(path, 0) == 0
+    assert line_offset(path, 10) == data.index(b"line 10")
+    assert line_offset(path, 100) == len(data)
+
+
+def test_parse_file(tmp_path: Path):
+    path = tmp_path / "output.jsonl"
+    path.write_text("".join(output_line(idx) for idx in range(200)))
+
+    with ThreadPoolExecutor(2) as executor:
+        outputs = list(parse_file(path, executor, workers=2))
+        assert [output.id for output in outputs] == [str(idx) for idx in range(200)]
+        assert outputs[7].response == "answer 7"
+        assert outputs[7].request_id == "batch_req_7"
+
+        start = line_offset(path, 150)
+        outputs = list(parse_file(path, executor, workers=2, start=start))
+        assert [output.id for output in outputs] == [str(i) for i in range(150, 200)]
+
+
+class ParallelRunner(OpenAIBatchRunner):
+    work_config = WorkConfig(allow_same_dataset=True, parse_workers=2)
+    received: list[str] = []
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        return []
+
+    @classmethod
+    def download(cls, output: Iterable[BatchOutputItem]):
+        cls.received.extend(item.id for item in output)
+
+
+def test_parallel_download(fake_api, monkeypatch: pytest.MonkeyPatch):
+    parsed: list[Path] = []
+
+    def spy(path: Path, *args, **kwargs):
+        parsed.append(path)
+        return parse_file(path, *args, **kwargs)
+
+    monkeypatch.setattr("openai_batch.status.utils.parse_file", spy)
+    work = create_work(ParallelRunner)
+    assert work.id is not None
+
+    archive = ShardArchive.of_work(work.uuid, compression="none")
+    with archive.writer(max_size=4000) as writer:
+        for idx in range(60):
+            line = {
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"messages": [{"role": "user", "content": "hi"}]},
+            }
+            writer.write(f"{json.dumps(line):<199}\n".encode())
+    archive.commit(writer.shards, dataset_hash=None)
+
+    result = created.upload(ParallelRunner.work_config, archive)
+    created.record(work.id, result)
+
+    with pytest.raises(StatusInterrupt):
+        checked.to_checked(work, ParallelRunner)
+    assert sorted(map(int, ParallelRunner.received)) == list(range(60))
+    assert len(parsed) == len(result.shards)
+    # spooled outputs are removed once delivered
+    assert not any(path.exists() for path in parsed)
@@ -0,0 +1,129 @@
+import json
+import threading
+from typing import Iterable
+
+import pytest
+
+from openai_batch import metrics
+from openai_batch.db import works_db
+from openai_batch.model import (
+    BatchErrorItem,
+    BatchInputItem,
+    BatchOutputItem,
+    WorkConfig,
+)
+from openai_batch.pipeline import stage
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+from openai_batch.status import checked, created
+from openai_batch.status.exception import StatusInterrupt
+
+
+def test_stage_backpressure():
+    produced = []
+
+    def source():
+        for idx in range(100):
+            produced.append(idx)
+            yield idx
+
+    items = stage("test", source(), maxsize=2)
+    assert next(items) == 0
+    # the queue is full, and one more item waits to be put
+    while len(produced) < 4:
+        pass
+    assert len(produced) == 4
+
+    assert list(items) == list(range(1, 100))
+    assert metrics.stage_items.get(stage="test") >= 100
+
+
+def test_stage_error_and_close():
+    def failing():
+        yield 1
+        raise ValueError("source failed")
+
+    items = stage("test", failing(), maxsize=2)
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="source failed"):
+        next(items)
+
+    threads = threading.active_count()
+    items = stage("test", iter(range(100)), maxsize=2)
+    next(items)
+    items.close()
+    assert threading.active_count() == threads
+
+
+class PipelinedRunner(OpenAIBatchRunner):
+    work_config = WorkConfig(
+        allow_same_dataset=True, pipeline_depth=4, checkpoint_interval=10
+    )
+    received: list[str] = []
+    written: list[str] = []
+    errors: list[str] = []
+    crash_at: int | None = None
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        return []
+
+    @classmethod
+    def download(cls, output: Iterable[BatchOutputItem]):
+        for item in output:
+            if len(cls.written) + len(cls.received) == cls.crash_at:
+                cls.received.clear()
+                raise RuntimeError("crashed")
+            cls.received.append(item.id)
+
+    @classmethod
+    def download_error(cls, output: Iterable[BatchErrorItem]):
+        cls.errors.extend(item.id for item in output)
+
+    @classmethod
+    def flush(cls):
+        cls.written.extend(cls.received)
+        cls.received.clear()
+
+
+def test_pipelined_download(fake_api):
+    fake_api.auto_complete = False
+    work = create_work(PipelinedRunner)
+    assert work.id is not None
+
+    # 4 shards of 20 lines, the last one failing
+    archive = ShardArchive.of_work(work.uuid, compression="none")
+    with archive.writer(max_size=4000) as writer:
+        for idx in range(80):
+            line = {
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"messages": [{"role": "user", "content": "hi"}]},
+            }
+            writer.write(f"{json.dumps(line):<199}\n".encode())
+    archive.commit(writer.shards, dataset_hash=None)
+
+    result = created.upload(PipelinedRunner.work_config, archive)
+    created.record(work.id, result)
+    for batch_id, shard in result.shards.items():
+        if shard == archive.shards[-1].name:
+            fake_api.fail(batch_id)
+        else:
+            fake_api.complete(batch_id)
+
+    PipelinedRunner.crash_at = 35
+    with pytest.raises(RuntimeError):
+        checked.to_checked(work, PipelinedRunner)
+    assert len(PipelinedRunner.written) == 30
+
+    PipelinedRunner.crash_at = None
+    work = works_db.get_work(work.id)
+    assert work is not None
+    with pytest.raises(StatusInterrupt):
+        checked.to_checked(work, PipelinedRunner)
+
+    # stages read ahead of the callback, only delivered outputs are checkpointed
+    assert sorted(map(int, PipelinedRunner.written)) == list(range(60))
+    assert sorted(map(int, set(PipelinedRunner.errors))) == list(range(60, 80))
+    assert metrics.stage_items.get(stage="parse") >= 60
@@ -0,0 +1,101 @@
+import collections
+import json
+from typing import Iterable
+
+import pytest
+
+from openai_batch.config import CredentialConfig
+from openai_batch.model import BatchInputItem, BatchOutputItem, WorkConfig
+from openai_batch.openai import pool
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+from openai_batch.status import checked, created
+from openai_batch.status.exception import StatusInterrupt
+
+from .fake_api import FakeOpenAI
+
+
+def test_assign():
+    assert pool.assign({}, [1, 2]) == [pool.DEFAULT] * 2
+
+    names = pool.assign({"a": 3, "b": 1}, [10] * 40)
+    assert collections.Counter(names) == {"a": 30, "b": 10}
+
+    # bytes are spread, not shards
+    names = pool.assign({"a": 1, "b": 1}, [30, 10, 10, 10])
+    assert names == ["a", "b", "b", "b"]
+
+    # bytes assigned earlier count, such as those of batches in flight
+    assert pool.assign({"a": 1, "b": 1}, [10, 10], {"a": 30}) == ["b", "b"]
+
+
+@pytest.fixture
+def other_api(monkeypatch):
+    api = FakeOpenAI().start()
+    credentials = {"other": CredentialConfig(api_key="sk-other", base_url=api.base_url)}
+    monkeypatch.setattr(
+        pool,
+        "global_config",
+        pool.global_config.model_copy(update={"credentials": credentials}),
+    )
+    pool.client.cache_clear()
+
+    yield api
+
+    pool.client.cache_clear()
+    api.stop()
+
+
+class PoolRunner(OpenAIBatchRunner):
+    work_config = WorkConfig(
+        allow_same_dataset=True,
+        credentials={pool.DEFAULT: 1, "other": 3},
+    )
+    outputs: list[BatchOutputItem] = []
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        return []
+
+    @classmethod
+    def download(cls, output: Iterable[BatchOutputItem]):
+        cls.outputs.extend(output)
+
+
+def test_routing(tmp_path, fake_api, other_api):
+    archive = ShardArchive(tmp_path, compression="none")
+    with archive.writer(max_size=2000) as writer:
+        for idx in range(80):
+            line = {
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-4o-mini",
+                    "messages": [{"role": "user", "content": "hi"}],
+                },
+            }
+            writer.write(f"{json.dumps(line):<199}\n".encode())
+    archive.commit(writer.shards, dataset_hash=None)
+    assert len(archive.shards) == 8
+
+    result = created.upload(PoolRunner.work_config, archive)
+    assert collections.Counter(result.credentials.values()) == {
+        pool.DEFAULT: 2,
+        "other": 6,
+    }
+    assert len(fake_api.batches) == 2 and len(other_api.batches) == 6
+
+    # batches are only found by their owner
+    assert len(checked.check(result.batch_ids).not_found_ids) == 6
+    assert not checked.check(result.batch_ids, result.credentials).not_found_ids
+
+    work = create_work(PoolRunner)
+    assert work.id is not None
+    created.record(work.id, result)
+
+    with pytest.raises(StatusInterrupt):
+        checked.to_checked(work, PoolRunner)
+
+    assert sorted(int(output.id) for output in PoolRunner.outputs) == list(range(80))
+    assert other_api.calls[("GET", "/files/{file}/content")] == 6
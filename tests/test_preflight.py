@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from openai_batch.exception import OpenAIBatchException
+from openai_batch.model import PreflightConfig, WorkConfig
+from openai_batch.preflight import check_line, preflight
+from openai_batch.shard import ShardArchive
+
+
+def _line(custom_id: str, **body) -> bytes:
+    request = {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": "gpt-4o-mini",
+            "messages": [{"role": "user", "content": "hi"}],
+            **body,
+        },
+    }
+    return f"{json.dumps(request)}\n".encode()
+
+
+def test_check_line():
+    config = PreflightConfig(max_request_tokens=100, models=["gpt-4o-mini"])
+    endpoint = "/v1/chat/completions"
+
+    assert check_line(_line("0").strip(), endpoint, config) == ("0", None)
+    assert check_line(b"{", endpoint, config)[1].startswith("invalid JSON")
+    assert check_line(b"[]", endpoint, config)[1] == "request is not a JSON object"
+    assert check_line(_line(""), endpoint, config)[1] == "missing custom_id"
+
+    _, error = check_line(_line("0"), "/v1/embeddings", config)
+    assert error == "url '/v1/chat/completions' is not /v1/embeddings"
+    _, error = check_line(_line("0", model="gpt-4o"), endpoint, config)
+    assert error == "model 'gpt-4o' is not one of ['gpt-4o-mini']"
+    _, error = check_line(
+        _line("0", model="text-embedding-3-small"), endpoint, PreflightConfig()
+    )
+    assert error == "model 'text-embedding-3-small' does not serve " + endpoint
+    _, error = check_line(_line("0", max_tokens=100), endpoint, config)
+    assert error is not None and error.endswith("over 100")
+
+    line = _line("0", messages=None)
+    assert check_line(line, endpoint, config) == ("0", None)
+    request = json.loads(line)
+    del request["body"]["messages"]
+    _, error = check_line(json.dumps(request).encode(), endpoint, config)
+    assert error == "body misses messages for /v1/chat/completions"
+
+    _, error = check_line(_line("0"), endpoint, PreflightConfig(max_line_size=10))
+    assert error is not None and error.endswith("bytes over 10")
+
+
+def test_preflight(tmp_path):
+    archive = ShardArchive(tmp_path, compression="gzip")
+    with archive.writer(max_size=1000) as writer:
+        for idx in range(20):
+            writer.write(_line(str(idx)))
+    archive.commit(writer.shards, dataset_hash=None)
+    assert len(archive.shards) > 1
+
+    config = WorkConfig(preflight=PreflightConfig(workers=2))
+    preflight(config, archive)
+
+    with archive.writer(max_size=1000) as writer:
+        for idx in range(20):
+            writer.write(_line(str(idx)))
+        writer.write(b"not json\n")
+        writer.write(_line("3"))
+    archive.commit(writer.shards, dataset_hash=None)
+
+    with pytest.raises(OpenAIBatchException) as info:
+        preflight(config, archive)
+
+    last = archive.shards[-1].name
+    lines = info.value.message.splitlines()
+    assert lines[0].startswith("Preflight found 2 invalid requests")
+    assert lines[1].startswith(f"{last}:")
+    assert "invalid JSON" in lines[1]
+    assert "(3): duplicate custom_id, first at shard-00000.jsonl.gz:4" in lines[2]
+
+    # skipped without a config
+    preflight(WorkConfig(preflight=None), archive)
@@ -0,0 +1,60 @@
+import pytest
+
+from openai_batch import progress
+
+pytestmark = pytest.mark.skipif(
+    not progress.SUPPORTED,
+    reason="requires Unix domain sockets",
+)
+
+
+def test_reporting(tmp_path):
+    with progress.Listener(directory=tmp_path) as listener:
+        reporter = progress.Reporter(work_id=1, directory=tmp_path)
+        reporter.report("upload", 10, 100)
+        reporter.report("upload", 20, 100)  # throttled
+        reporter.report("upload", 100, 100)  # done, never throttled
+        reporter.close()
+
+        events = listener.receive(timeout=1)
+
+    assert [(event["kind"], event.get("current")) for event in events] == [
+        ("progress", 10),
+        ("progress", 100),
+        ("exit", None),
+    ]
+    assert not (tmp_path / listener.path.name).exists()
+
+
+def test_reporting_without_listener(tmp_path):
+    reporter = progress.Reporter(work_id=1, directory=tmp_path / "missing")
+    reporter.report("upload", 10, 100)
+    reporter.close()
+
+
+def test_board():
+    board = progress.Board(smoothing=0.5)
+    board.add_work(1, "work", "checked")
+
+    def event(current: int, time: float):
+        return {
+            "kind": "progress",
+            "work_id": 1,
+            "pid": 42,
+            "phase": "download",
+            "current": current,
+            "total": 1000,
+            "unit": "B",
+            "time": time,
+        }
+
+    board.update([event(0, 0), event(100, 1)])
+    assert board.works[1].processes[42].rate == 100
+    assert board.works[1].processes[42].eta == 9
+
+    board.update([event(400, 2)])
+    assert board.works[1].processes[42].rate == 200
+
+    board.update([{"kind": "exit", "work_id": 1, "pid": 42, "time": 3}])
+    assert board.works[1].processes == {}
+    assert board.works[1].name == "work"
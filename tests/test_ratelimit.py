@@ -0,0 +1,85 @@
+import io
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from openai_batch import metrics
+from openai_batch.openai import openai_batches, openai_file
+from openai_batch.openai.ratelimit import SharedTokenBucket, retry_after, retrying
+
+
+def test_upload_retries_throttled(fake_api):
+    throttled = metrics.api_throttled.get(endpoint="files.upload")
+    fake_api.inject(429, count=2, path="/files", retry_after=0.1)
+
+    file = openai_file.upload(io.BytesIO(b'{"a": 1}\n'), purpose="batch")
+
+    assert file.id in fake_api.files
+    assert fake_api.calls[("POST", "/files")] == 3
+    assert metrics.api_throttled.get(endpoint="files.upload") == throttled + 2
+
+
+def test_upload_raises_client_errors(fake_api):
+    fake_api.inject(400, count=1, path="/files")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        openai_file.upload(io.BytesIO(b'{"a": 1}\n'), purpose="batch")
+
+    assert fake_api.calls[("POST", "/files")] == 1
+
+
+def test_batches_list_retries_throttled(fake_api):
+    fake_api.inject(429, count=1, path="/batches", retry_after=0.1)
+
+    page = retrying("batches.list", lambda: openai_batches.list(limit=10))
+
+    assert page.data == []
+    assert fake_api.calls[("GET", "/batches")] == 2
+
+
+def test_retry_gives_up(fake_api):
+    fake_api.inject(503, count=3, path="/batches", retry_after=0)
+
+    with pytest.raises(openai.InternalServerError):
+        retrying("batches.list", openai_batches.list, max_retries=2)
+
+    assert fake_api.calls[("GET", "/batches")] == 3
+
+
+def test_shared_bucket(tmp_path):
+    path = tmp_path / "rate_limit.sqlite"
+    # two buckets on the same database, as two processes would have
+    buckets = [SharedTokenBucket(path, rate=20, capacity=1) for _ in range(2)]
+
+    def acquire(bucket: SharedTokenBucket):
+        for _ in range(5):
+            bucket.acquire()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=acquire, args=(b,)) for b in buckets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 10 tokens, 1 at once and 20 per second
+    assert time.perf_counter() - start >= 9 / 20 * 0.9
+
+
+def test_pause(tmp_path):
+    path = tmp_path / "rate_limit.sqlite"
+    SharedTokenBucket(path, rate=100, capacity=10).pause(0.2)
+
+    start = time.perf_counter()
+    SharedTokenBucket(path, rate=100, capacity=10).acquire()
+    assert time.perf_counter() - start >= 0.15
+
+
+def test_retry_after():
+    assert retry_after(httpx.Headers({"Retry-After": "2"})) == 2
+    assert retry_after(httpx.Headers({"retry-after-ms": "250"})) == 0.25
+    assert retry_after(httpx.Headers({"Retry-After": "soon"})) is None
+    assert retry_after(httpx.Headers()) is None
@@ -0,0 +1,134 @@
+import collections
+import json
+from typing import Iterable
+
+import pytest
+
+from openai_batch.config import CredentialConfig
+from openai_batch.db import schema, works_db
+from openai_batch.model import BatchInputItem, BatchOutputItem, WorkConfig
+from openai_batch.openai import pool
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import Shard, ShardArchive
+from openai_batch.status import checked, created
+from openai_batch.status.exception import StatusInterrupt
+
+
+def test_window():
+    shards = [Shard(name=str(idx), size=400, lines=1) for idx in range(5)]
+    default = pool.DEFAULT
+
+    assert created.window(shards, None) == [default] * 5
+    assert len(created.window(shards, 250)) == 2
+    assert len(created.window(shards, 250, in_flight={default: 100})) == 1
+    assert len(created.window(shards, 250, in_flight={default: 200})) == 0
+    # a shard over the quota is submitted alone
+    assert len(created.window(shards, 50)) == 1
+    assert len(created.window(shards, 50, in_flight={default: 1})) == 0
+
+
+def test_window_refills_by_weight():
+    shards = [Shard(name=str(idx), size=400, lines=1) for idx in range(8)]
+    weights = {"a": 1, "b": 1}
+
+    # one shard per refill, the credentials still alternate
+    in_flight: collections.Counter[str] = collections.Counter()
+    names = []
+    for shard in shards:
+        (name,) = created.window([shard], None, weights, in_flight)
+        in_flight[name] += shard.tokens
+        names.append(name)
+    assert names == ["a", "b"] * 4
+
+
+def test_window_quota_by_organization(monkeypatch: pytest.MonkeyPatch):
+    shards = [Shard(name=str(idx), size=400, lines=1) for idx in range(8)]
+    weights = {"a": 1, "b": 1}
+
+    # each organization enqueues up to the quota
+    assert created.window(shards, 250, weights) == ["a", "b", "a", "b"]
+    assert created.window(shards, 250, weights, {"a": 200}) == ["b", "b"]
+
+    # credentials of the same organization share it
+    credentials = {
+        name: CredentialConfig(api_key=f"sk-{name}", organization="org")
+        for name in weights
+    }
+    monkeypatch.setattr(
+        pool,
+        "global_config",
+        pool.global_config.model_copy(update={"credentials": credentials}),
+    )
+    assert created.window(shards, 250, weights) == ["a", "b"]
+
+
+class RollingRunner(OpenAIBatchRunner):
+    # 3 shards under the quota, but the provider only takes 2 at once
+    work_config = WorkConfig(allow_same_dataset=True, max_enqueued_tokens=1500)
+    outputs: list[BatchOutputItem] = []
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        return []
+
+    @classmethod
+    def download(cls, output: Iterable[BatchOutputItem]):
+        cls.outputs.extend(output)
+
+
+def test_rolling(fake_api):
+    fake_api.auto_complete = False
+    fake_api.enqueued_token_limit = 1000
+
+    work = create_work(RollingRunner)
+    assert work.id is not None
+
+    # 8 shards of 500 tokens
+    archive = ShardArchive.of_work(work.uuid, compression="none")
+    with archive.writer(max_size=2000) as writer:
+        for idx in range(80):
+            line = {
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"messages": [{"role": "user", "content": "hi"}]},
+            }
+            writer.write(f"{json.dumps(line):<199}\n".encode())
+    archive.commit(writer.shards, dataset_hash=None)
+
+    config = RollingRunner.work_config
+    count = len(created.window(archive.shards, config.max_enqueued_tokens))
+    result = created.upload(config, archive, archive.shards[:count])
+    created.record(work.id, result)
+    with works_db.update_work(work.id) as work:
+        work.pending_shards = [shard.name for shard in archive.shards[count:]]
+
+    assert len(work.pending_shards) == 5
+    for _ in range(20):
+        assert fake_api.enqueued_tokens() <= 1000
+        for batch_id, batch in fake_api.batches.items():
+            if batch["status"] == "validating":
+                fake_api.complete(batch_id)
+
+        try:
+            work = checked.to_checked(work, RollingRunner)
+        except StatusInterrupt as interrupt:
+            assert interrupt.status == schema.WorkStatus.Completed
+            break
+    else:
+        pytest.fail("work not completed")
+
+    # rejected batches were submitted again instead of failing the work
+    rejected = [
+        batch for batch in fake_api.batches.values() if batch["status"] == "failed"
+    ]
+    assert rejected
+    batches = works_db.list_batches(work.id)
+    requeued = [b for b in batches if b.state == schema.BatchState.Requeued]
+    assert len(requeued) == len(rejected)
+    assert all(b.status == "failed" for b in requeued)
+    assert max(b.attempt for b in batches) > 1
+    done = [b for b in batches if b.state == schema.BatchState.Done]
+    assert sorted(b.shard for b in done) == [shard.name for shard in archive.shards]
+    assert sum(b.request_completed or 0 for b in done) == 80
+    assert sorted(int(output.id) for output in RollingRunner.outputs) == list(range(80))
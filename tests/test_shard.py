@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from openai_batch.model import BatchInputItem, WorkConfig
+from openai_batch.shard import ShardArchive
+from openai_batch.status import created
+
+LINES = [
+    f'{{"custom_id": "{idx:03d}", "body": "{"x" * 100}"}}\n'.encode()
+    for idx in range(100)
+]
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_roundtrip(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+    archive = ShardArchive(tmp_path, compression=compression)
+    with archive.writer(max_size=len(LINES[0]) * 30) as writer:
+        for line in LINES:
+            writer.write(line)
+    archive.commit(writer.shards, dataset_hash="hash")
+
+    assert [shard.lines for shard in archive.shards] == [30, 30, 30, 10]
+
+    loaded = ShardArchive(tmp_path)
+    assert loaded.load()
+    assert loaded.compression == compression
+    assert loaded.dataset_hash == "hash"
+
+    data = b""
+    for shard in loaded.shards:
+        with loaded.open(shard) as reader:
+            data += reader.read()
+            assert reader.tell() == shard.size
+
+    assert data == b"".join(LINES)
+    if compression != "none":
+        assert loaded.size < len(data)
+
+
+def test_uncommitted(tmp_path):
+    archive = ShardArchive(tmp_path)
+    with archive.writer() as writer:
+        writer.write(LINES[0])
+
+    assert not ShardArchive(tmp_path).load()
+
+
+def test_bounded_open_files(tmp_path):
+    archive = ShardArchive(tmp_path, max_open_files=1)
+    with archive.writer(max_size=1) as writer:
+        for line in LINES[:2]:
+            writer.write(line)
+    archive.commit(writer.shards, dataset_hash=None)
+
+    first = archive.open(archive.shards[0])
+    opened = threading.Event()
+
+    def open_second():
+        with archive.open(archive.shards[1]):
+            opened.set()
+
+    thread = threading.Thread(target=open_second)
+    thread.start()
+    assert not opened.wait(0.1)
+
+    first.close()
+    assert opened.wait(1)
+    thread.join()
+
+
+def test_upload_shards(tmp_path, fake_api):
+    config = WorkConfig()
+    items = (
+        BatchInputItem(id=str(idx), messages=[{"role": "user", "content": "hi"}])
+        for idx in range(10)
+    )
+    archive = ShardArchive(tmp_path)
+    created.transform(config, items, archive)
+
+    result = created.upload(config, archive)
+
+    (batch_id,) = result.batch_ids
+    input_file = fake_api.files[fake_api.batches[batch_id]["input_file_id"]]
+    with archive.open(archive.shards[0]) as reader:
+        assert input_file.path.read_bytes() == reader.read()
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+from typer.testing import CliRunner
+
+from openai_batch.cli import app
+from openai_batch.db import schema, works_db
+from openai_batch.simulate import (
+    Backoff,
+    Cron,
+    SimulatedWork,
+    Timeline,
+    recorded,
+    simulate,
+    synthetic,
+)
+
+
+def test_timeline():
+    timeline = Timeline(ended_at=100, in_progress_at=10, finalizing_at=90)
+    assert [timeline.status_at(t) for t in (0, 10, 95, 100)] == [
+        "validating",
+        "in_progress",
+        "finalizing",
+        "completed",
+    ]
+    assert Timeline(ended_at=5, status="failed").status_at(5) == "failed"
+
+
+def test_policies():
+    cron = Cron(timedelta(hours=1))
+    assert cron.next_check(100, 0, 1) == 3600
+    assert cron.next_check(3600, 0, 2) == 7200
+
+    backoff = Backoff(timedelta(minutes=1), factor=2, maximum=timedelta(minutes=3))
+    assert [backoff.next_check(0, 0, checks) for checks in (1, 2, 3, 4)] == [
+        60,
+        120,
+        180,
+        180,
+    ]
+
+
+def test_simulate():
+    works = [
+        SimulatedWork(
+            batches=[
+                Timeline(ended_at=1000, in_progress_at=10, finalizing_at=900),
+                Timeline(ended_at=5000, in_progress_at=10, request_total=5),
+                Timeline(ended_at=20, status="failed"),
+            ],
+            submitted_at=idx * 600,
+        )
+        for idx in range(3)
+    ]
+    existing = len(works_db.list_works())
+
+    report = simulate(works, Cron(timedelta(hours=1)))
+    assert report.batches == 9 and report.undetected == 0
+    assert all(0 <= latency <= 3600 for latency in report.latencies)
+    # checks after the first one are run by launched processes
+    assert report.launches == report.checks - 3
+    assert report.api_calls["batches.list"] == report.checks
+    assert report.api_calls["files.content"] == 9
+
+    report = simulate(works, Backoff(timedelta(minutes=1)))
+    assert report.undetected == 0 and report.launches == 0
+    assert report.mean_latency < 3600
+
+    # simulated works are kept apart from real ones
+    assert len(works_db.list_works()) == existing
+
+    # works only checked at their submission before the horizon
+    report = simulate(works, Cron(timedelta(days=2)), horizon=timedelta(hours=1))
+    assert report.checks == 3 and report.undetected == 9
+
+
+def test_synthetic():
+    works = synthetic(10, batches=3, seed=1)
+    assert len(works) == 10
+    assert [work.submitted_at for work in works] == sorted(
+        work.submitted_at for work in works
+    )
+    assert synthetic(10, batches=3, seed=1) == works
+    assert all(
+        timeline.ended_at <= 24 * 3600 for work in works for timeline in work.batches
+    )
+
+
+def test_recorded():
+    work = works_db.create_work(
+        schema.Work(interpreter_path="", script="", class_name="", work_dir="")
+    )
+    assert work.id is not None
+
+    created_at = datetime(2024, 1, 1)
+    works_db.add_batches(
+        [
+            schema.Batch(
+                id=f"batch_recorded_{idx}",
+                work_id=work.id,
+                status=status,
+                input_file_id="file-input",
+                created_at=created_at,
+                ended_at=created_at + timedelta(hours=idx + 1),
+            )
+            for idx, status in enumerate(["completed", "expired"])
+        ]
+    )
+
+    timelines = recorded(work.id).batches
+    assert [timeline.ended_at for timeline in timelines] == [3600, 7200]
+    assert [timeline.status for timeline in timelines] == ["completed", "expired"]
+
+
+def test_cli():
+    result = CliRunner().invoke(
+        app, ["simulate", "--works", "3", "--batches", "2", "--interval", "2"]
+    )
+    assert result.exit_code == 0, result.output
@@ -0,0 +1,113 @@
+import json
+from datetime import datetime, timedelta
+from typing import Iterable
+
+import pytest
+from typer.testing import CliRunner
+
+from openai_batch import cli, snapshot
+from openai_batch.db import schema, works_db
+from openai_batch.model import BatchInputItem, BatchOutputItem, WorkConfig
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+from openai_batch.status import checked, created
+
+
+class SnapshotRunner(OpenAIBatchRunner):
+    work_config = WorkConfig(allow_same_dataset=True)
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        return []
+
+    @staticmethod
+    def download(output: Iterable[BatchOutputItem]):
+        for _ in output:
+            pass
+
+
+def _submitted(shards: int) -> schema.Work:
+    work = create_work(SnapshotRunner)
+    assert work.id is not None
+
+    archive = ShardArchive.of_work(work.uuid, compression="none")
+    with archive.writer(max_size=4000) as writer:
+        for idx in range(shards * 20):
+            line = {
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": "gpt-4o-mini", "messages": []},
+            }
+            writer.write(f"{json.dumps(line):<199}\n".encode())
+    archive.commit(writer.shards, dataset_hash=None)
+
+    result = created.upload(SnapshotRunner.work_config, archive)
+    created.record(work.id, result)
+
+    return work
+
+
+def test_refresh(fake_api, monkeypatch: pytest.MonkeyPatch):
+    fake_api.auto_complete = False
+    work = _submitted(shards=4)
+    assert work.id is not None
+
+    checked.to_checked(work, SnapshotRunner)
+    work = works_db.get_work(work.id)
+    assert work is not None and work.snapshot_at is not None
+    assert snapshot.progress([work])[work.id] == snapshot.Progress(batches=4)
+
+    batch_ids = [batch.id for batch in works_db.list_batches(work.id)]
+    for batch_id in batch_ids[:3]:
+        fake_api.complete(batch_id)
+
+    # one listing of the batches, outputs left to the next check
+    listed = fake_api.calls[("GET", "/batches")]
+    assert snapshot.refresh([work.id]) == 3
+    assert fake_api.calls[("GET", "/batches")] == listed + 1
+    assert works_db.count_batches(work.id, schema.BatchState.Undone) == 4
+
+    refreshed = works_db.get_work(work.id)
+    assert refreshed is not None and refreshed.snapshot_at is not None
+    assert refreshed.status == work.status
+    assert refreshed.snapshot_at > work.snapshot_at
+    progress = snapshot.progress([refreshed])[work.id]
+    assert (progress.requests, progress.processed) == (60, 60)
+    assert progress.ratio == 1
+
+    rows = works_db.list_batches(work.id)
+    assert [row.status for row in rows].count("completed") == 3
+    assert all(row.ended_at is not None for row in rows[:3])
+
+
+def test_stale(fake_api, monkeypatch: pytest.MonkeyPatch):
+    work = _submitted(shards=1)
+    assert work.id is not None
+    assert snapshot.stale([work], ttl=60) == [work.id]
+    assert snapshot.stale([work], ttl=0) == []
+
+    work.snapshot_at = datetime.now() - timedelta(seconds=30)
+    assert snapshot.stale([work], ttl=60) == []
+    work.snapshot_at = datetime.now() - timedelta(seconds=90)
+    assert snapshot.stale([work], ttl=60) == [work.id]
+
+    work.status = schema.WorkStatus.Completed
+    assert snapshot.stale([work], ttl=60) == []
+
+
+def test_list_refreshes_in_background(fake_api, monkeypatch: pytest.MonkeyPatch):
+    work = _submitted(shards=1)
+    assert work.id is not None
+
+    started: list[list[str]] = []
+    monkeypatch.setattr(snapshot.sp, "Popen", lambda args, **_: started.append(args))
+    monkeypatch.setattr(
+        snapshot,
+        "global_config",
+        snapshot.global_config.model_copy(update={"snapshot_ttl": 60}),
+    )
+
+    result = CliRunner().invoke(cli.app, ["list", "--ids", str(work.id)])
+    assert result.exit_code == 0
+    assert [args[-1] for args in started] == [str(work.id)]
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from openai_batch.model import (
+    BatchInputItem,
+    BatchInputTemplate,
+    BatchRequestInputItem,
+    WorkConfig,
+)
+from openai_batch.shard import ShardArchive
+from openai_batch.status import created
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": f"tool_{idx}",
+            "description": "A tool",
+            "parameters": {"type": "object", "properties": {"q": {"type": "string"}}},
+        },
+    }
+    for idx in range(3)
+]
+SYSTEM = {"role": "system", "content": "Answer in French."}
+
+
+@pytest.mark.parametrize("prefix", [[], [SYSTEM]])
+@pytest.mark.parametrize("messages", [[], [{"role": "user", "content": "héllo\n"}]])
+def test_encode(prefix, messages):
+    config = WorkConfig()
+    template = BatchInputTemplate(
+        model="gpt-4o-mini",
+        messages=prefix,
+        tools=TOOLS,
+        temperature=0.5,
+    )
+    item = BatchInputItem(
+        id="item-0",
+        model="gpt-4o-mini",
+        messages=[*prefix, *messages],
+        tools=TOOLS,
+        temperature=0.5,
+    )
+
+    line = template.item("item-0", messages).encode(config.endpoint)
+    assert line.endswith(b"\n")
+    assert json.loads(line) == json.loads(
+        BatchRequestInputItem.from_input(config, item).model_dump_json()
+    )
+
+
+def test_validation():
+    with pytest.raises(ValidationError):
+        BatchInputTemplate(temperature=3)
+
+    template = BatchInputTemplate()
+    with pytest.raises(ValidationError):
+        template.item("item-0", [{"role": "user"}])  # type: ignore
+
+    # the encoded template is cached, so it can't be changed
+    with pytest.raises(ValidationError):
+        template.temperature = 1
+
+
+def test_transform(tmp_path):
+    config = WorkConfig(allow_same_dataset=True)
+    template = BatchInputTemplate(messages=[SYSTEM], tools=TOOLS)
+    items = [
+        template.item(f"item-{idx}", [{"role": "user", "content": "x" * idx}])
+        for idx in range(10)
+    ]
+
+    archive = ShardArchive(tmp_path)
+    (shard,) = created.transform(config, items, archive).shards
+    with archive.open(shard) as file:
+        lines = [json.loads(line) for line in file.read().splitlines()]
+
+    assert [line["custom_id"] for line in lines] == [item.id for item in items]
+    assert lines[3]["body"]["messages"] == [SYSTEM, {"role": "user", "content": "xxx"}]
@@ -0,0 +1,73 @@
+from typing import Iterable
+
+from typer.testing import CliRunner
+
+from openai_batch import tracing
+from openai_batch.cli import app
+from openai_batch.db import works_db
+from openai_batch.model import BatchInputItem, BatchOutputItem
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+from openai_batch.status import checked, created, utils
+
+
+class TracedRunner(OpenAIBatchRunner):
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        for idx in range(10):
+            yield BatchInputItem(
+                id=str(idx),
+                messages=[{"role": "user", "content": "hi"}],
+            )
+
+    @staticmethod
+    def download(output: Iterable[BatchOutputItem]):
+        for _ in output:
+            pass
+
+
+def test_spans(tmp_path, fake_api):
+    work = create_work(TracedRunner)
+    assert work.id is not None
+    config = TracedRunner.work_config
+
+    with tracing.trace_work(work.id), tracing.span("from_created"):
+        archive = ShardArchive(tmp_path)
+        created.transform(config, TracedRunner.upload(), archive)
+        upload_result = created.upload(config, archive)
+        check_result = checked.check(upload_result.batch_ids)
+        file_ids = [status.file_id for status in check_result.statuses]
+        utils.download(TracedRunner, file_ids)  # type: ignore
+
+    spans = {span.name: span for span in works_db.list_spans(work.id)}
+    root = spans["from_created"]
+    assert spans["transform"].parent_id == root.id
+    assert spans["transform"].items == 10
+    assert spans["download"].items == 10
+    assert spans["download"].bytes
+    assert spans["download.fetch"].parent_id == spans["download"].id
+    assert "download.callback" in spans
+    assert all(span.ended_at for span in spans.values())
+
+    result = CliRunner().invoke(app, ["inspect", str(work.id), "--timings"])
+    assert result.exit_code == 0
+    assert "transform" in result.output
+
+
+def test_delete_work_with_spans():
+    work = create_work(TracedRunner)
+    assert work.id is not None
+
+    with tracing.trace_work(work.id), tracing.span("from_created"):
+        with tracing.span("transform"):
+            pass
+    assert len(works_db.list_spans(work.id)) == 2
+
+    assert works_db.delete_work(work.id) is not None
+    assert works_db.get_work(work.id) is None
+    assert works_db.list_spans(work.id) == []
+
+
+def test_no_work():
+    with tracing.span("untraced") as span:
+        span.items = 1
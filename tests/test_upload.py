@@ -0,0 +1,103 @@
+import io
+import json
+
+import pytest
+
+from openai_batch.openai import http_client, openai_client, openai_file, upload
+from openai_batch.shard import ShardArchive
+
+LINES = [json.dumps({"id": i, "text": "x" * i}) for i in range(100)]
+DATA = ("\n".join(LINES) + "\n").encode()
+
+
+@pytest.fixture
+def file_id(fake_api) -> str:
+    statuses = []
+    file = openai_file.upload(
+        io.BytesIO(DATA),
+        purpose="batch",
+        on_upload_chunk=statuses.append,
+        chunk_size=256,
+    )
+
+    assert fake_api.files[file.id].path.read_bytes() == DATA
+    assert statuses[-1].done
+    assert len(statuses) == -(-len(DATA) // 256)
+
+    fake_api.calls.clear()
+    return file.id
+
+
+def test_shared_client():
+    assert openai_client._client is http_client
+    assert openai_file.http_client is http_client
+
+
+def test_retrieve_without_metadata(fake_api, file_id):
+    chunks = list(openai_file.retrieve(file_id, chunk_size=100))
+
+    assert [chunk.line for chunk in chunks] == LINES
+    assert chunks[-1].current == chunks[-1].total == len(DATA)
+    # the size is read from Content-Length
+    assert fake_api.calls == {("GET", "/files/{file}/content"): 1}
+
+
+def test_retrieve_chunked(fake_api, file_id):
+    fake_api.chunked_content = True
+    chunks = list(openai_file.retrieve(file_id))
+
+    assert [chunk.line for chunk in chunks] == LINES
+    assert chunks[-1].total == len(DATA)
+    assert fake_api.calls[("GET", "/files/{file}")] == 1
+
+
+def test_retrieve_gzip(fake_api, file_id):
+    fake_api.gzip_content = True
+    chunks = list(openai_file.retrieve(file_id))
+
+    assert [chunk.line for chunk in chunks] == LINES
+    # progress counts compressed bytes
+    assert chunks[-1].current == chunks[-1].total < len(DATA)
+
+
+def test_upload_mapped(fake_api, tmp_path, monkeypatch: pytest.MonkeyPatch):
+    path = tmp_path / "input.jsonl"
+    path.write_bytes(b"skipped\n" + DATA)
+
+    sent = []
+    monkeypatch.setattr(
+        upload._MultipartBody, "_iter_read", lambda self: pytest.fail("read")
+    )
+    with path.open("rb") as f:
+        f.seek(len(b"skipped\n"))
+        file = openai_file.upload(
+            f,
+            purpose="batch",
+            size=len(DATA),
+            on_upload_chunk=lambda status: sent.append(status.current),
+            chunk_size=1000,
+        )
+
+    assert fake_api.files[file.id].path.read_bytes() == DATA
+    assert sent == [*range(1000, len(DATA), 1000), len(DATA)]
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_upload_shard(fake_api, tmp_path, compression):
+    archive = ShardArchive(tmp_path, compression=compression)
+    with archive.writer() as writer:
+        for line in LINES:
+            writer.write(f"{line}\n".encode())
+    archive.commit(writer.shards, dataset_hash=None)
+
+    (shard,) = archive.shards
+    with archive.open(shard) as reader:
+        # compressed shards are read, uncompressed ones mapped
+        mapped = upload._mapped(reader, 0, shard.size)
+        assert (mapped is not None) == (compression == "none")
+        if mapped is not None:
+            mapped.close()
+
+        file = openai_file.upload(reader, purpose="batch", size=shard.size)
+
+    assert fake_api.files[file.id].path.read_bytes() == DATA
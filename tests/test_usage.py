@@ -0,0 +1,134 @@
+import json
+from typing import Iterable
+
+import pytest
+from typer.testing import CliRunner
+
+from openai_batch import metrics, usage
+from openai_batch.cli import app
+from openai_batch.config import PriceConfig
+from openai_batch.db import schema, works_db
+from openai_batch.model import BatchInputItem, BatchOutputItem, WorkConfig
+from openai_batch.runner import OpenAIBatchRunner, create_work
+from openai_batch.shard import ShardArchive
+from openai_batch.status import checked, created
+from openai_batch.status.exception import StatusInterrupt
+
+PRICES = {
+    "gpt-4o": PriceConfig(input=1.25, output=5),
+    "gpt-4o-mini": PriceConfig(input=0.075, output=0.3),
+}
+
+
+def test_price_of():
+    assert usage.price_of("gpt-4o-mini", PRICES) == PRICES["gpt-4o-mini"]
+    assert usage.price_of("gpt-4o-mini-2024-07-18", PRICES) == PRICES["gpt-4o-mini"]
+    assert usage.price_of("gpt-4o-2024-08-06", PRICES) == PRICES["gpt-4o"]
+    assert usage.price_of("o1", PRICES) is None
+    assert usage.price_of(None, PRICES) is None
+
+
+def test_ledger():
+    ledger = usage.Ledger(PRICES)
+    total = usage.Usage()
+    for tokens in (10, 100, 1000):
+        output = BatchOutputItem(
+            request_id="batch_req",
+            id=str(tokens),
+            status="success",
+            prompt_tokens=tokens,
+            completion_tokens=tokens * 2,
+            model="gpt-4o-2024-08-06",
+        )
+        ledger.count(total, output)
+    assert (total.outputs, total.prompt_tokens, total.completion_tokens) == (
+        3,
+        1110,
+        2220,
+    )
+    assert total.cost == pytest.approx((1110 * 1.25 + 2220 * 5) / 1_000_000)
+    assert sum(total.prompt_buckets) == 3
+
+    observed = metrics.request_tokens.count(kind="prompt")
+    ledger.settle("file-1", total)
+    assert ledger.take() == {"file-1": total}
+    assert ledger.take() == {}
+    assert metrics.request_tokens.count(kind="prompt") == observed + 3
+
+
+class UsageRunner(OpenAIBatchRunner):
+    work_config = WorkConfig(allow_same_dataset=True, checkpoint_interval=10)
+    delivered: list[BatchOutputItem] = []
+    crash_at: int | None = None
+
+    @staticmethod
+    def upload() -> Iterable[BatchInputItem]:
+        return []
+
+    @classmethod
+    def download(cls, output: Iterable[BatchOutputItem]):
+        for item in output:
+            if len(cls.delivered) == cls.crash_at:
+                raise RuntimeError("crashed")
+            cls.delivered.append(item)
+
+
+def test_usage_counted_once(fake_api, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(
+        usage,
+        "global_config",
+        usage.global_config.model_copy(update={"prices": PRICES}),
+    )
+    work = create_work(UsageRunner)
+    assert work.id is not None
+
+    # 6 shards of 10 lines
+    archive = ShardArchive.of_work(work.uuid, compression="none")
+    with archive.writer(max_size=4000) as writer:
+        for idx in range(60):
+            line = {
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-4o-mini",
+                    "messages": [{"role": "user", "content": "x" * idx}],
+                },
+            }
+            writer.write(f"{json.dumps(line):<399}\n".encode())
+    archive.commit(writer.shards, dataset_hash=None)
+
+    result = created.upload(UsageRunner.work_config, archive)
+    created.record(work.id, result)
+
+    # outputs delivered after the last checkpoint are delivered, not counted, again
+    UsageRunner.crash_at = 35
+    with pytest.raises(RuntimeError):
+        checked.to_checked(work, UsageRunner)
+    UsageRunner.crash_at = None
+    work = works_db.get_work(work.id)
+    assert work is not None
+    with pytest.raises(StatusInterrupt):
+        checked.to_checked(work, UsageRunner)
+
+    outputs = {item.id: item for item in UsageRunner.delivered}
+    assert len(outputs) == 60
+
+    work = works_db.get_work(work.id)
+    assert work is not None
+    assert work.outputs == 60
+    assert work.prompt_tokens == sum(
+        item.prompt_tokens or 0 for item in outputs.values()
+    )
+    assert work.completion_tokens == sum(
+        item.completion_tokens or 0 for item in outputs.values()
+    )
+    assert work.cost == pytest.approx(
+        (work.prompt_tokens * 0.075 + work.completion_tokens * 0.3) / 1_000_000
+    )
+
+    batches = works_db.list_batches(work.id, {schema.BatchState.Done})
+    assert [batch.outputs for batch in batches] == [10] * 6
+    assert sum(batch.prompt_tokens for batch in batches) == work.prompt_tokens
+
+    assert CliRunner().invoke(app, ["get", str(work.id)]).exit_code == 0